@@ -1,7 +1,40 @@
+import asyncio
+import logging
+
 import httpx
 import base64
 
-NETHUNT_TASKS_FOLDER_ID = "67e17578cc9bea52af34a271" 
+from src.config import (
+    NETHUNT_EMAIL,
+    NETHUNT_API_KEY,
+    NETHUNT_BASE_URL,
+    NETHUNT_MAX_CONNECTIONS,
+    NETHUNT_MAX_KEEPALIVE_CONNECTIONS,
+    NETHUNT_KEEPALIVE_EXPIRY,
+    NETHUNT_HTTP2,
+    NETHUNT_CONNECT_TIMEOUT,
+    NETHUNT_READ_TIMEOUT,
+    NETHUNT_WRITE_TIMEOUT,
+    NETHUNT_POOL_TIMEOUT,
+    NETHUNT_RATE_LIMIT,
+    NETHUNT_RATE_PERIOD,
+    RATE_LIMIT_MAX_RETRIES,
+    NETHUNT_MAX_PAGE_SIZE,
+)
+from src.clients.ratelimit import UpstreamRateLimiter
+from src.metrics import track_upstream
+
+NETHUNT_TEAM_FOLDER_ID = "67e2c9a38fe9ca14e35144d2"
+NETHUNT_SERVICES_FOLDER_ID = "67e17578cc9bea52af34a26f"
+NETHUNT_TASKS_FOLDER_ID = "67e17578cc9bea52af34a271"
+
+
+def request_operation(url: str) -> str:
+    """Metrics label for a request: "update-record" for /zapier/actions/update-record/{id}."""
+    parts = url.strip("/").split("/")
+    return parts[2] if len(parts) > 2 and parts[0] == "zapier" else url
+
+
 class NetHuntClient:
     def __init__(self, email, api_key):
         credentials = f"{email}:{api_key}"
@@ -10,9 +43,41 @@ class NetHuntClient:
             "Authorization": f"Basic {encoded_credentials}",
             "Content-Type": "application/json"
         }
-        self.client = httpx.AsyncClient(
-            base_url="https://nethunt.com/api/v1",
-            headers=self.headers
+        self.client = self._build_client()
+        self.rate_limiter = UpstreamRateLimiter("nethunt", NETHUNT_RATE_LIMIT, NETHUNT_RATE_PERIOD, max_retries=RATE_LIMIT_MAX_RETRIES)
+        # Trigger endpoint -> which records it keeps when `limit` cuts the result, learnt on first use
+        self._selection = {}
+
+    def _build_client(self):
+        # Shared pool: every NetHunt call in the worker reuses these warm connections
+        return httpx.AsyncClient(
+            base_url=NETHUNT_BASE_URL,
+            headers=self.headers,
+            http2=NETHUNT_HTTP2,
+            limits=httpx.Limits(
+                max_connections=NETHUNT_MAX_CONNECTIONS,
+                max_keepalive_connections=NETHUNT_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=NETHUNT_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=NETHUNT_CONNECT_TIMEOUT,
+                read=NETHUNT_READ_TIMEOUT,
+                write=NETHUNT_WRITE_TIMEOUT,
+                pool=NETHUNT_POOL_TIMEOUT,
+            ),
+        )
+
+    async def open(self):
+        if self.client.is_closed:
+            self.client = self._build_client()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _request(self, method, url, **kwargs):
+        operation = request_operation(url)
+        return await self.rate_limiter.send(
+            lambda: track_upstream("nethunt", operation, lambda: self.client.request(method, url, **kwargs))
         )
 
     async def get_recent_records(self, folder_id, since, limit=None, field_names=None):
@@ -28,19 +93,19 @@ class NetHuntClient:
                 params.setdefault("fieldName", []).append(field_name)
 
         # folder_id is correctly used here:
-        resp = await self.client.get(f"/zapier/triggers/updated-record/{folder_id}", params=params)
-        
+        resp = await self._request("GET", f"/zapier/triggers/updated-record/{folder_id}", params=params)
+
         print(f"Response status code: {resp}")
         resp.raise_for_status()
         return resp.json()
-    
+
     async def get_freshly_updated_task_records(self, since, limit=10):
         return await self.get_recent_records(
             folder_id=NETHUNT_TASKS_FOLDER_ID,
             since=since,
             limit=limit
         )
-    
+
     async def get_freshly_created_records(self, folder_id, since, limit=10, field_names=None):
         params = {
             "since": since,
@@ -50,36 +115,150 @@ class NetHuntClient:
             for field_name in field_names:
                 params.setdefault("fieldName", []).append(field_name)
 
-        resp = await self.client.get(f"/zapier/triggers/new-record/{folder_id}", params=params)
-        
+        resp = await self._request("GET", f"/zapier/triggers/new-record/{folder_id}", params=params)
+
         print(f"Response status code: {resp}")
         resp.raise_for_status()
         return resp.json()
 
-    async def update_record(self, record_id, fields):
-        resp = await self.client.patch(f"/records/{record_id}", json=fields)
-        if resp.status_code == 404:
-            return None  # Handle missing record gracefully
+    async def _selection_order(self, endpoint, fetch_page, since, page, page_size, cursor_field, id_field):
+        # Trigger endpoints document neither the order of their results nor which
+        # records `limit` keeps. Ask for a larger page and see where the extra
+        # records fall: all newer than the first page means the oldest are kept.
+        # Returns ("oldest" | "newest" | None, the larger page).
+        larger = await fetch_page(since, page_size * 2)
+        first_ids = {r.get(id_field) or r.get("id") for r in page}
+        added = [r.get(cursor_field) for r in larger if (r.get(id_field) or r.get("id")) not in first_ids]
+        stamps = [r.get(cursor_field) for r in page if r.get(cursor_field)]
+        if not added or not stamps or None in added or min(stamps) == max(stamps):
+            return None, larger
+        if min(added) >= max(stamps):
+            order = "oldest"
+        elif max(added) <= min(stamps):
+            order = "newest"
+        else:
+            order = "unordered"
+        self._selection[endpoint] = order
+        logging.info(f"[nethunt] {endpoint} keeps the {order} records when a page is limited")
+        return order, larger
+
+    async def _fetch_window(self, endpoint, fetch_page, since, page_size, cursor_field, id_field):
+        """Records at or after `since`, oldest first, and whether more remain after the newest of them."""
+        page = await fetch_page(since, page_size)
+        if len(page) < page_size:
+            return sorted(page, key=lambda r: r.get(cursor_field) or ""), False
+        order = self._selection.get(endpoint)
+        limit = page_size
+        if order is None:
+            order, page = await self._selection_order(endpoint, fetch_page, since, page, page_size, cursor_field, id_field)
+            limit = page_size * 2
+        if order == "oldest":
+            # The page is the oldest slice of the window: safe to continue from its newest stamp
+            return sorted(page, key=lambda r: r.get(cursor_field) or ""), len(page) >= limit
+        # Otherwise a cut page may be missing older records that no `since` can reach,
+        # so the whole window has to come back in one response
+        while len(page) >= limit and limit < NETHUNT_MAX_PAGE_SIZE:
+            limit = min(limit * 2, NETHUNT_MAX_PAGE_SIZE)
+            page = await fetch_page(since, limit)
+        if len(page) >= limit:
+            raise RuntimeError(f"NetHunt {endpoint} has more than {limit} records since {since} and does not return the oldest first; cannot page through them")
+        return sorted(page, key=lambda r: r.get(cursor_field) or ""), False
+
+    async def _iter_pages(self, endpoint, fetch_page, since, page_size, cursor_field, id_field="recordId"):
+        # Walks a trigger endpoint window by window, oldest first. `since` is
+        # inclusive, so records sitting on the cursor come back in the next window
+        # and are dropped by id. The next window is requested before the current
+        # one is handed to the caller. Raises rather than skip records it cannot reach.
+        seen_at_cursor = set()
+        next_window = asyncio.create_task(self._fetch_window(endpoint, fetch_page, since, page_size, cursor_field, id_field))
+        try:
+            while next_window is not None:
+                page, more = await next_window
+                next_window = None
+
+                fresh = [r for r in page if (r.get(id_field) or r.get("id")) not in seen_at_cursor]
+                stamps = [r.get(cursor_field) for r in page if r.get(cursor_field)]
+                cursor = max(stamps) if stamps else None
+
+                if more:
+                    if not cursor or cursor == since or not fresh:
+                        # A full page on a single timestamp: moving on would skip or loop
+                        raise RuntimeError(f"NetHunt {endpoint} cursor stalled at {since} with a full page")
+                    seen_at_cursor = {r.get(id_field) or r.get("id") for r in page if r.get(cursor_field) == cursor}
+                    since = cursor
+                    next_window = asyncio.create_task(self._fetch_window(endpoint, fetch_page, since, page_size, cursor_field, id_field))
+
+                for record in fresh:
+                    yield record
+        finally:
+            if next_window is not None:
+                next_window.cancel()
+
+    async def iter_recent_records(self, folder_id, since, page_size=100, field_names=None):
+        """Yield every record updated since `since`, oldest first, fetching page by page."""
+        async def fetch_page(cursor, limit):
+            return await self.get_recent_records(folder_id, since=cursor, limit=limit, field_names=field_names)
+        async for record in self._iter_pages("updated-record", fetch_page, since, page_size, "updatedAt"):
+            yield record
+
+    async def iter_freshly_created_records(self, folder_id, since, page_size=100, field_names=None):
+        """Yield every record created since `since`, oldest first, fetching page by page."""
+        async def fetch_page(cursor, limit):
+            return await self.get_freshly_created_records(folder_id, since=cursor, limit=limit, field_names=field_names)
+        async for record in self._iter_pages("new-record", fetch_page, since, page_size, "createdAt"):
+            yield record
+
+    async def iter_recent_comments(self, folder_id, since, page_size=100):
+        """Yield every comment created since `since`, oldest first, fetching page by page."""
+        async def fetch_page(cursor, limit):
+            return await self.get_recent_comments(folder_id, since=cursor, limit=limit)
+        async for comment in self._iter_pages("new-comment", fetch_page, since, page_size, "createdAt", id_field="commentId"):
+            yield comment
+
+    async def find_records(self, folder_id, query=None, record_id=None, limit=None):
+        # /zapier/searches/find-record/{folder_id} accepts either a field query
+        # such as '"Name":"Call client"' or an exact recordId
+        params = {}
+        if query is not None:
+            params["query"] = query
+        if record_id is not None:
+            params["recordId"] = record_id
+        if limit is not None:
+            params["limit"] = limit
+        resp = await self._request("GET", f"/zapier/searches/find-record/{folder_id}", params=params)
         resp.raise_for_status()
         return resp.json()
 
-    async def create_record(self, fields):
-        resp = await self.client.post("/records", json=fields)
+    async def update_record(self, record_id, field_actions: dict):
+        resp = await self._request(
+            "POST",
+            f"/zapier/actions/update-record/{record_id}",
+            json={"fieldActions": field_actions}
+        )
         resp.raise_for_status()
-        return resp.json()["data"]
+        return resp.json()
+
+    async def create_record(self, folder_id, fields: dict, time_zone="Europe/London"):
+        resp = await self._request(
+            "POST",
+            f"/zapier/actions/create-record/{folder_id}",
+            json={"timeZone": time_zone, "fields": fields}
+        )
+        resp.raise_for_status()
+        return resp.json()
 
     async def get_writable_folders(self):
-        resp = await self.client.get("/zapier/triggers/readable-folder")
+        resp = await self._request("GET", "/zapier/triggers/readable-folder")
         resp.raise_for_status()
         return resp.json()
 
     async def get_folder_fields(self, folder_id):
-        resp = await self.client.get(f"/zapier/triggers/folder-field/{folder_id}")
+        resp = await self._request("GET", f"/zapier/triggers/folder-field/{folder_id}")
         resp.raise_for_status()
         return resp.json()
 
     async def create_comment(self, record_id: str, text: str):
-        resp = await self.client.post(f"/zapier/actions/create-comment/{record_id}", json={"text": text})
+        resp = await self._request("POST", f"/zapier/actions/create-comment/{record_id}", json={"text": text})
         resp.raise_for_status()
         return resp.json()
 
@@ -88,9 +267,8 @@ class NetHuntClient:
             "since": since,
             "limit": limit
         }
-        resp = await self.client.get(f"/zapier/triggers/new-comment/{folder_id}", params=params)
+        resp = await self._request("GET", f"/zapier/triggers/new-comment/{folder_id}", params=params)
         resp.raise_for_status()
         return resp.json()
 
-# Replace with your email and API key
-nethunt_client = NetHuntClient(email="agilemorphsolutions@gmail.com", api_key="30741f0a-d62d-4703-b0d4-0a03fe6f8782")
+nethunt_client = NetHuntClient(email=NETHUNT_EMAIL, api_key=NETHUNT_API_KEY)
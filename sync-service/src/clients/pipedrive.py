@@ -0,0 +1,178 @@
+import httpx
+
+from src.config import (
+    PIPEDRIVE_API_TOKEN,
+    PIPEDRIVE_BASE_URL,
+    PIPEDRIVE_MAX_CONNECTIONS,
+    PIPEDRIVE_MAX_KEEPALIVE_CONNECTIONS,
+    PIPEDRIVE_KEEPALIVE_EXPIRY,
+    PIPEDRIVE_CONNECT_TIMEOUT,
+    PIPEDRIVE_READ_TIMEOUT,
+    PIPEDRIVE_WRITE_TIMEOUT,
+    PIPEDRIVE_POOL_TIMEOUT,
+    PIPEDRIVE_RATE_LIMIT,
+    PIPEDRIVE_RATE_PERIOD,
+    RATE_LIMIT_MAX_RETRIES,
+)
+from src.clients.ratelimit import UpstreamRateLimiter
+from src.metrics import track_upstream
+
+
+def request_operation(method: str, url: str) -> str:
+    """Metrics label for a request: "PUT deals/:id" for PUT /v1/deals/7."""
+    parts = [part for part in url.split("?")[0].strip("/").split("/") if part]
+    if parts[:1] == ["api"]:
+        parts = parts[1:]
+    if parts and parts[0] in ("v1", "v2"):
+        parts = parts[1:]
+    return f"{method} " + "/".join(":id" if part.isdigit() else part for part in parts)
+
+
+class PipedriveClient:
+    def __init__(self, api_token):
+        self.headers = {
+            "x-api-token": api_token or "",
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
+        self.client = self._build_client()
+        self.rate_limiter = UpstreamRateLimiter("pipedrive", PIPEDRIVE_RATE_LIMIT, PIPEDRIVE_RATE_PERIOD, max_retries=RATE_LIMIT_MAX_RETRIES)
+
+    def _build_client(self):
+        # One pooled, keep-alive client per worker so webhooks reuse warm TLS connections
+        return httpx.AsyncClient(
+            base_url=PIPEDRIVE_BASE_URL,
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=PIPEDRIVE_MAX_CONNECTIONS,
+                max_keepalive_connections=PIPEDRIVE_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=PIPEDRIVE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=PIPEDRIVE_CONNECT_TIMEOUT,
+                read=PIPEDRIVE_READ_TIMEOUT,
+                write=PIPEDRIVE_WRITE_TIMEOUT,
+                pool=PIPEDRIVE_POOL_TIMEOUT,
+            ),
+        )
+
+    async def open(self):
+        if self.client.is_closed:
+            self.client = self._build_client()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _request(self, method, url, **kwargs):
+        operation = request_operation(method, url)
+        return await self.rate_limiter.send(
+            lambda: track_upstream("pipedrive", operation, lambda: self.client.request(method, url, **kwargs))
+        )
+
+    # Deals
+    async def get_deal(self, deal_id):
+        resp = await self._request("GET", f"/v1/deals/{deal_id}")
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_deals(self, start=0, limit=500):
+        """One page of all deals; returns (deals, next_start or None)."""
+        return await self._get_page("/v1/deals", start, limit)
+
+    async def update_deal(self, deal_id, payload: dict):
+        resp = await self._request("PUT", f"/v1/deals/{deal_id}", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    # Persons
+    async def get_person(self, person_id):
+        resp = await self._request("GET", f"/v1/persons/{person_id}")
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_persons(self, start=0, limit=500):
+        """One page of all persons; returns (persons, next_start or None)."""
+        return await self._get_page("/v1/persons", start, limit)
+
+    async def get_person_deals(self, person_id, start=0, limit=500):
+        """One page of the person's deals; returns (deals, next_start or None)."""
+        return await self._get_page(f"/v1/persons/{person_id}/deals", start, limit, params={"status": "all_not_deleted"})
+
+    async def update_person(self, person_id, payload: dict):
+        resp = await self._request("PATCH", f"/api/v2/persons/{person_id}", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    # Activities
+    async def get_activity(self, activity_id):
+        resp = await self._request("GET", f"/v1/activities/{activity_id}")
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_activities(self, start=0, limit=500):
+        """One page of every user's activities; returns (activities, next_start or None)."""
+        return await self._get_page("/v1/activities", start, limit, params={"user_id": 0})
+
+    async def list_activities(self, limit=10, sort_by="add_time", sort_direction="desc", activity_type=None):
+        params = {
+            "limit": limit,
+            "sort_by": sort_by,
+            "sort_direction": sort_direction,
+        }
+        if activity_type:
+            params["type"] = activity_type
+        resp = await self._request("GET", "/api/v2/activities", params=params)
+        resp.raise_for_status()
+        return resp.json().get("data", [])
+
+    async def create_activity(self, payload: dict):
+        resp = await self._request("POST", "/api/v2/activities", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def update_activity(self, activity_id, payload: dict):
+        resp = await self._request("PATCH", f"/api/v2/activities/{activity_id}", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    # Changes across entity types, oldest first
+    async def get_recents(self, since_timestamp: str, items: str, start=0, limit=500):
+        """One page of items changed after `since_timestamp` ("YYYY-MM-DD HH:MM:SS", UTC); returns (changes, next_start or None)."""
+        return await self._get_page("/v1/recents", start, limit, params={"since_timestamp": since_timestamp, "items": items})
+
+    # Pipelines and stages
+    async def get_pipelines(self):
+        resp = await self._request("GET", "/v1/pipelines")
+        resp.raise_for_status()
+        return resp.json().get("data", []) or []
+
+    async def get_stages(self, start=0, limit=500):
+        """One page of stages across all pipelines; returns (stages, next_start or None)."""
+        return await self._get_page("/v1/stages", start, limit)
+
+    # Field definitions
+    async def get_fields(self, entity: str, start=0, limit=500):
+        """One page of deal/person field definitions; returns (fields, next_start or None)."""
+        return await self._get_page(f"/v1/{entity}Fields", start, limit)
+
+    async def _get_page(self, path: str, start: int, limit: int, params: dict = None):
+        resp = await self._request("GET", path, params={**(params or {}), "start": start, "limit": limit})
+        resp.raise_for_status()
+        body = resp.json()
+        pagination = (body.get("additional_data") or {}).get("pagination") or {}
+        next_start = pagination.get("next_start") if pagination.get("more_items_in_collection") else None
+        return body.get("data", []) or [], next_start
+
+    # Notes
+    async def create_note(self, deal_id, content: str):
+        resp = await self._request("POST", "/v1/notes", json={"deal_id": deal_id, "content": content})
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_notes(self, deal_id):
+        resp = await self._request("GET", "/v1/notes", params={"deal_id": deal_id})
+        resp.raise_for_status()
+        return resp.json().get("data", []) or []
+
+
+pipedrive_client = PipedriveClient(api_token=PIPEDRIVE_API_TOKEN)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+
+from aiolimiter import AsyncLimiter
+
+
+def _header_float(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_retry_after(value):
+    """Return the Retry-After delay in seconds (delta-seconds or HTTP-date form)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamRateLimiter:
+    """
+    Token-bucket scheduler for a single upstream API.
+
+    Every request first takes a token from the bucket, then waits for any pause
+    or pacing slot learned from earlier responses. A 429 is not surfaced to the
+    caller: the request is queued behind the Retry-After delay and sent again.
+    """
+
+    def __init__(self, name, max_rate, time_period=1.0, max_retries=5, low_budget_ratio=0.2):
+        self.name = name
+        self.limiter = AsyncLimiter(max_rate, time_period)
+        self.max_retries = max_retries
+        self.low_budget_ratio = low_budget_ratio
+        self._blocked_until = 0.0
+        self._next_slot = 0.0
+        self._min_interval = 0.0
+
+    def _block_for(self, seconds):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def _wait_turn(self):
+        await self.limiter.acquire()
+        now = time.monotonic()
+        # Reserve a pacing slot synchronously so concurrent callers queue up in order
+        slot = max(now, self._blocked_until, self._next_slot)
+        self._next_slot = slot + self._min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def observe(self, response):
+        # Pipedrive reports the window budget in x-ratelimit-* headers (reset is in seconds)
+        headers = response.headers
+        limit = _header_float(headers, "x-ratelimit-limit")
+        remaining = _header_float(headers, "x-ratelimit-remaining")
+        reset = _header_float(headers, "x-ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        if remaining <= 0:
+            self._block_for(reset)
+            self._min_interval = 0.0
+        elif limit and remaining < limit * self.low_budget_ratio:
+            # Spread what is left of the budget evenly over the rest of the window
+            self._min_interval = reset / remaining
+        else:
+            self._min_interval = 0.0
+
+    async def send(self, request_fn):
+        """Run `request_fn` (a coroutine factory returning an httpx.Response) under the limiter."""
+        attempt = 0
+        while True:
+            await self._wait_turn()
+            response = await request_fn()
+            self.observe(response)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            attempt += 1
+            delay = parse_retry_after(response.headers.get("retry-after"))
+            if delay is None:
+                delay = _header_float(response.headers, "x-ratelimit-reset")
+            if delay is None:
+                delay = min(60.0, 2 ** attempt)
+            logging.warning(f"[{self.name}] 429 received, retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+            self._block_for(delay)
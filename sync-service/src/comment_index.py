@@ -0,0 +1,71 @@
+# comment_index.py
+import asyncio
+import logging
+
+from src.clients.nethunt import nethunt_client, NETHUNT_TEAM_FOLDER_ID, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID
+from src.state import get_state, set_state, index_comments, has_comment
+
+EPOCH = "1970-01-01T00:00:00.000Z"
+COMMENT_FOLDER_IDS = [NETHUNT_TEAM_FOLDER_ID, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID]
+BACKFILL_PAGE_SIZE = 500
+
+_backfill_running = None
+
+
+async def is_comment_index_warm() -> bool:
+    return await get_state("comment_index_warmed") == "1"
+
+
+async def _backfill() -> bool:
+    for folder_id in COMMENT_FOLDER_IDS:
+        indexed = 0
+        batch = []
+        try:
+            # iter_recent_comments raises rather than skip comments it cannot page to,
+            # so finishing the loop means the whole folder was covered
+            async for c in nethunt_client.iter_recent_comments(folder_id, since=EPOCH, page_size=BACKFILL_PAGE_SIZE):
+                batch.append((c.get("recordId"), c.get("text"), c.get("commentId")))
+                if len(batch) >= BACKFILL_PAGE_SIZE:
+                    await index_comments(batch)
+                    indexed += len(batch)
+                    batch = []
+            await index_comments(batch)
+            indexed += len(batch)
+            logging.info(f"[comment_index] Indexed {indexed} existing comments from folder {folder_id}")
+        except Exception as e:
+            logging.error(f"[comment_index] Failed to backfill comments from folder {folder_id} after {indexed}: {e}")
+            return False
+    await set_state("comment_index_warmed", "1")
+    return True
+
+
+def _backfill_task() -> asyncio.Task:
+    # One backfill at a time per process, shared by the startup task and note jobs
+    global _backfill_running
+    if _backfill_running is None or _backfill_running.done():
+        _backfill_running = asyncio.create_task(_backfill())
+    return _backfill_running
+
+
+async def warm_comment_index() -> bool:
+    """One-time backfill of the comment index with every comment created before it existed.
+
+    The index is only marked warm after all folders were paged through, so a failed
+    backfill is retried in full (re-indexing the same comments is harmless). Returns
+    True once the index is warm.
+    """
+    if await is_comment_index_warm():
+        return True
+    return await _backfill_task()
+
+
+async def comment_exists(record_id: str, text: str) -> bool:
+    if await has_comment(record_id, text):
+        return True
+    if await is_comment_index_warm():
+        return False
+    # Index not backfilled yet (first run): wait for the shared backfill rather than risk
+    # a duplicate. Shielded so a job timing out does not cancel it for everyone else.
+    if not await asyncio.shield(_backfill_task()):
+        raise RuntimeError("Comment index backfill failed; cannot rule out a duplicate comment yet")
+    return await has_comment(record_id, text)
@@ -0,0 +1,121 @@
+# config.py
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pipedrive
+PIPEDRIVE_API_TOKEN = os.getenv("PIPEDRIVE_API_TOKEN")
+PIPEDRIVE_BASE_URL = "https://api.pipedrive.com"
+
+# Connection pool for the shared Pipedrive client (one per worker process)
+PIPEDRIVE_MAX_CONNECTIONS = int(os.getenv("PIPEDRIVE_MAX_CONNECTIONS", "20"))
+PIPEDRIVE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PIPEDRIVE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+PIPEDRIVE_KEEPALIVE_EXPIRY = float(os.getenv("PIPEDRIVE_KEEPALIVE_EXPIRY", "30"))
+PIPEDRIVE_CONNECT_TIMEOUT = float(os.getenv("PIPEDRIVE_CONNECT_TIMEOUT", "5"))
+PIPEDRIVE_READ_TIMEOUT = float(os.getenv("PIPEDRIVE_READ_TIMEOUT", "20"))
+PIPEDRIVE_WRITE_TIMEOUT = float(os.getenv("PIPEDRIVE_WRITE_TIMEOUT", "20"))
+PIPEDRIVE_POOL_TIMEOUT = float(os.getenv("PIPEDRIVE_POOL_TIMEOUT", "10"))
+
+# NetHunt
+NETHUNT_EMAIL = os.getenv("NETHUNT_EMAIL")
+NETHUNT_API_KEY = os.getenv("NETHUNT_API_KEY")
+NETHUNT_BASE_URL = "https://nethunt.com/api/v1"
+
+# Connection pool for the shared NetHunt client; HTTP/2 needs the h2 package
+NETHUNT_MAX_CONNECTIONS = int(os.getenv("NETHUNT_MAX_CONNECTIONS", "20"))
+NETHUNT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("NETHUNT_MAX_KEEPALIVE_CONNECTIONS", "10"))
+NETHUNT_KEEPALIVE_EXPIRY = float(os.getenv("NETHUNT_KEEPALIVE_EXPIRY", "30"))
+NETHUNT_HTTP2 = os.getenv("NETHUNT_HTTP2", "false").lower() in ("1", "true", "yes")
+NETHUNT_CONNECT_TIMEOUT = float(os.getenv("NETHUNT_CONNECT_TIMEOUT", "5"))
+NETHUNT_READ_TIMEOUT = float(os.getenv("NETHUNT_READ_TIMEOUT", "30"))
+NETHUNT_WRITE_TIMEOUT = float(os.getenv("NETHUNT_WRITE_TIMEOUT", "30"))
+NETHUNT_POOL_TIMEOUT = float(os.getenv("NETHUNT_POOL_TIMEOUT", "10"))
+# Largest `limit` asked of a trigger endpoint when a whole window must come back at once
+NETHUNT_MAX_PAGE_SIZE = int(os.getenv("NETHUNT_MAX_PAGE_SIZE", "1000"))
+
+# Upstream rate limiting (token bucket per API, per worker process)
+PIPEDRIVE_RATE_LIMIT = float(os.getenv("PIPEDRIVE_RATE_LIMIT", "40"))
+PIPEDRIVE_RATE_PERIOD = float(os.getenv("PIPEDRIVE_RATE_PERIOD", "2"))
+NETHUNT_RATE_LIMIT = float(os.getenv("NETHUNT_RATE_LIMIT", "10"))
+NETHUNT_RATE_PERIOD = float(os.getenv("NETHUNT_RATE_PERIOD", "1"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+
+# Deal <-> NetHunt record mapping warm-up
+DEAL_MAPPING_WARMUP_LIMIT = int(os.getenv("DEAL_MAPPING_WARMUP_LIMIT", "1000"))
+DEAL_MAPPING_WARMUP_INTERVAL = float(os.getenv("DEAL_MAPPING_WARMUP_INTERVAL", str(24 * 3600)))
+
+# Task "Record links" resolution (recordId -> Pipedrive deal/person ids)
+RECORD_LINK_CACHE_SIZE = int(os.getenv("RECORD_LINK_CACHE_SIZE", "5000"))
+RECORD_LINK_CACHE_TTL = float(os.getenv("RECORD_LINK_CACHE_TTL", "900"))
+RECORD_LINK_CONCURRENCY = int(os.getenv("RECORD_LINK_CONCURRENCY", "8"))
+
+# NetHunt comment -> Pipedrive note sync
+NOTE_SYNC_CONCURRENCY = int(os.getenv("NOTE_SYNC_CONCURRENCY", "5"))
+DEAL_NOTE_CACHE_SIZE = int(os.getenv("DEAL_NOTE_CACHE_SIZE", "2000"))
+DEAL_NOTE_CACHE_TTL = float(os.getenv("DEAL_NOTE_CACHE_TTL", "600"))
+
+# poll_nethunt: concurrent per-record Pipedrive writes across all folders
+POLL_RECORD_CONCURRENCY = int(os.getenv("POLL_RECORD_CONCURRENCY", "5"))
+
+# Per-(folder, stream) NetHunt watermarks: each poll re-reads this many seconds
+# before the watermark, and starts this far back when a stream has no watermark yet
+WATERMARK_OVERLAP_SECONDS = float(os.getenv("WATERMARK_OVERLAP_SECONDS", "120"))
+WATERMARK_INITIAL_LOOKBACK = float(os.getenv("WATERMARK_INITIAL_LOOKBACK", "3600"))
+
+# Durable webhook job queue (separate SQLite file next to sync_service.db)
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH", "sync_service_queue.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "600"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+# Webhook coalescing: updates for the same deal/activity wait for a quiet window
+# and are merged into one job, but none waits longer than the max delay
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "5"))
+WEBHOOK_COALESCE_MAX_DELAY = float(os.getenv("WEBHOOK_COALESCE_MAX_DELAY", "30"))
+
+# Echo suppression: our own writes are remembered this long; a polled NetHunt record
+# or Pipedrive item is treated as our echo when its mapped fields all match what we wrote
+ECHO_WINDOW_SECONDS = float(os.getenv("ECHO_WINDOW_SECONDS", "600"))
+
+# SQLite state engine (src/db.py): WAL mode, one connection per worker process,
+# writes group-committed every STATE_FLUSH_INTERVAL seconds or STATE_MAX_BATCH writes
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "sync_service.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "0.05"))
+STATE_MAX_BATCH = int(os.getenv("STATE_MAX_BATCH", "200"))
+STATE_BUSY_TIMEOUT = float(os.getenv("STATE_BUSY_TIMEOUT", "5000"))
+
+# Pipeline-scoped stage index, loaded from Pipedrive's pipelines/stages endpoints and
+# cached on disk; refreshed in the background once older than the TTL
+STAGE_INDEX_CACHE_PATH = os.getenv("STAGE_INDEX_CACHE_PATH", "stage_index_cache.json")
+STAGE_INDEX_TTL = float(os.getenv("STAGE_INDEX_TTL", "21600"))
+STAGE_INDEX_RETRY_DELAY = float(os.getenv("STAGE_INDEX_RETRY_DELAY", "300"))
+
+# Pipedrive dealFields/personFields definitions, persisted in the state database and
+# refreshed in the background once older than the TTL
+FIELD_METADATA_TTL = float(os.getenv("FIELD_METADATA_TTL", "21600"))
+FIELD_METADATA_RETRY_DELAY = float(os.getenv("FIELD_METADATA_RETRY_DELAY", "300"))
+
+# NetHunt folder field schemas, used to prune and coerce fieldActions before sending;
+# refreshed in the background once older than the TTL
+NETHUNT_SCHEMA_TTL = float(os.getenv("NETHUNT_SCHEMA_TTL", "3600"))
+NETHUNT_SCHEMA_RETRY_DELAY = float(os.getenv("NETHUNT_SCHEMA_RETRY_DELAY", "300"))
+
+# python -m src.reconcile: concurrent pairs, records per checkpoint, progress log interval (s)
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "8"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_REPORT_INTERVAL = float(os.getenv("RECONCILE_REPORT_INTERVAL", "10"))
+
+# poll_pipedrive: /v1/recents safety net for missed webhooks (seconds between cycles, items per page)
+PIPEDRIVE_POLL_INTERVAL = float(os.getenv("PIPEDRIVE_POLL_INTERVAL", "300"))
+PIPEDRIVE_POLL_PAGE_SIZE = int(os.getenv("PIPEDRIVE_POLL_PAGE_SIZE", "500"))
+
+
+def require_credentials():
+    """Fail fast when the upstream API credentials are not set in the environment."""
+    missing = [name for name in ("PIPEDRIVE_API_TOKEN", "NETHUNT_EMAIL", "NETHUNT_API_KEY") if not globals()[name]]
+    if missing:
+        raise RuntimeError(f"Missing required settings: {', '.join(missing)} (set them in the environment or .env)")
@@ -0,0 +1,169 @@
+# db.py
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import STATE_FLUSH_INTERVAL, STATE_MAX_BATCH, STATE_BUSY_TIMEOUT
+
+
+class StateEngine:
+    """Async SQLite access in WAL mode with group commit.
+
+    Each worker process lazily opens its own connection, owned by a single
+    background thread, so queries never run on the event loop and the
+    connection is never shared across a fork. Writes join an open transaction
+    that is committed as soon as no other write is in flight, and at the
+    latest every `flush_interval` seconds or `max_batch` writes under steady
+    load; a writer awaiting the result resumes once its group is committed.
+    """
+
+    def __init__(self, path: str, init=None, flush_interval: float = STATE_FLUSH_INTERVAL, max_batch: int = STATE_MAX_BATCH):
+        self.path = path
+        self.init = init
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pid = None
+        self._executor = None
+        self._conn = None
+        self._commit_future = None
+        self._flush_handle = None
+        self._pending = 0
+        self._in_flight = 0
+
+    def _ensure_process(self):
+        if self._pid == os.getpid():
+            return
+        # First use in this process (or after a fork): nothing inherited is usable
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{os.path.basename(self.path)}")
+        self._conn = None
+        self._commit_future = None
+        self._flush_handle = None
+        self._pending = 0
+        self._in_flight = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Runs on the engine thread only
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=STATE_BUSY_TIMEOUT / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(STATE_BUSY_TIMEOUT)}")
+            if self.init:
+                conn.execute("BEGIN IMMEDIATE")
+                self.init(conn)
+                conn.execute("COMMIT")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        self._ensure_process()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # Reads
+
+    async def fetchone(self, sql: str, params=()):
+        return await self._run(lambda: self._connection().execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        return await self._run(lambda: self._connection().execute(sql, params).fetchall())
+
+    # Writes
+
+    def _in_write_transaction(self, fn):
+        conn = self._connection()
+        if not conn.in_transaction:
+            # Take the write lock up front so read-then-write callbacks are atomic
+            conn.execute("BEGIN IMMEDIATE")
+        # A failed callback must not leave half its changes in the shared group
+        conn.execute("SAVEPOINT write")
+        try:
+            result = fn(conn)
+        except Exception:
+            conn.execute("ROLLBACK TO write")
+            conn.execute("RELEASE write")
+            raise
+        conn.execute("RELEASE write")
+        return result
+
+    async def write(self, fn, wait: bool = True):
+        """Run fn(conn) inside the current write group; with wait, return once it is committed."""
+        self._ensure_process()
+        self._in_flight += 1
+        try:
+            result = await self._run(self._in_write_transaction, fn)
+        finally:
+            self._in_flight -= 1
+        committed = self._join_group()
+        if wait:
+            await asyncio.shield(committed)
+        return result
+
+    async def execute(self, sql: str, params=(), wait: bool = True):
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount, wait=wait)
+
+    async def executemany(self, sql: str, rows, wait: bool = True):
+        rows = list(rows)
+        if not rows:
+            return 0
+        return await self.write(lambda conn: conn.executemany(sql, rows).rowcount, wait=wait)
+
+    def _join_group(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self._commit_future is None:
+            self._commit_future = loop.create_future()
+            # Nobody may await a fire-and-forget group, so surface its failure in the log
+            self._commit_future.add_done_callback(self._log_commit_failure)
+            self._flush_handle = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+        self._pending += 1
+        future = self._commit_future
+        if self._pending >= self.max_batch or not self._in_flight:
+            # Nobody else is about to join, so waiting out the interval only adds latency
+            loop.call_soon(lambda: asyncio.ensure_future(self.flush()) if self._commit_future is future else None)
+        return future
+
+    @staticmethod
+    def _log_commit_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logging.error(f"[db] Group commit failed: {future.exception()}")
+
+    def _commit(self):
+        conn = self._connection()
+        if not conn.in_transaction:
+            return
+        try:
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self):
+        """Commit the open write group now."""
+        future, self._commit_future = self._commit_future, None
+        self._pending = 0
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if future is None:
+            return
+        try:
+            await self._run(self._commit)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+
+    async def close(self):
+        if self._pid != os.getpid():
+            return
+        await self.flush()
+
+        def close_connection():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        await self._run(close_connection)
+        self._executor.shutdown(wait=True)
+        self._pid = None
@@ -0,0 +1,56 @@
+# deal_mapping.py
+import logging
+import time
+
+from src.clients.nethunt import nethunt_client, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID
+from src.config import DEAL_MAPPING_WARMUP_LIMIT, DEAL_MAPPING_WARMUP_INTERVAL
+from src.state import get_state, set_state, put_deal_mappings
+
+EPOCH = "1970-01-01T00:00:00.000Z"
+
+
+def mapping_rows_for_records(folder_id: str, records: list) -> list:
+    """Build (pd_id, nh_id, team_nh_id) rows from NetHunt records carrying a Pipedrive Record ID."""
+    rows = []
+    for record in records:
+        pd_id = (record.get("fields") or {}).get("Pipedrive Record ID")
+        record_id = record.get("recordId")
+        if not pd_id or not record_id:
+            continue
+        if folder_id == NETHUNT_TEAM_FOLDER_ID:
+            rows.append((pd_id, None, record_id))
+        else:
+            rows.append((pd_id, record_id, None))
+    return rows
+
+
+async def warm_deal_mappings(force: bool = False):
+    """Fill the deal <-> record mapping table by scanning "Pipedrive Record ID" across folders."""
+    last_warmup = await get_state("deal_mappings_warmed_at")
+    if not force and last_warmup and time.time() - float(last_warmup) < DEAL_MAPPING_WARMUP_INTERVAL:
+        logging.info("[deal_mapping] Mappings warmed recently, skipping warm-up.")
+        return
+
+    for folder_id in (NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID):
+        try:
+            rows = []
+            warmed = 0
+            async for record in nethunt_client.iter_recent_records(
+                folder_id,
+                since=EPOCH,
+                page_size=DEAL_MAPPING_WARMUP_LIMIT,
+                field_names=["Pipedrive Record ID"]
+            ):
+                rows.extend(mapping_rows_for_records(folder_id, [record]))
+                if len(rows) >= DEAL_MAPPING_WARMUP_LIMIT:
+                    await put_deal_mappings(rows)
+                    warmed += len(rows)
+                    rows = []
+            await put_deal_mappings(rows)
+            warmed += len(rows)
+            logging.info(f"[deal_mapping] Warmed {warmed} deal mappings from folder {folder_id}")
+        except Exception as e:
+            logging.error(f"[deal_mapping] Failed to warm mappings from folder {folder_id}: {e}")
+            return
+
+    await set_state("deal_mappings_warmed_at", str(time.time()))
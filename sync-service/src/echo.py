@@ -0,0 +1,128 @@
+# echo.py
+import hashlib
+import json
+import time
+
+from src.config import ECHO_WINDOW_SECONDS
+from src.state import record_ledger_writes, get_ledger_writes
+
+# Pipedrive bumps these on every change, so they never tell us who made it
+VOLATILE_PIPEDRIVE_FIELDS = {
+    "update_time",
+    "update_user_id",
+    "stage_change_time",
+    "last_activity_id",
+    "last_activity_date",
+    "next_activity_id",
+    "next_activity_date",
+    "next_activity_time",
+}
+
+
+def _normalize(value):
+    # Pipedrive returns what we wrote in several shapes (63, "63", {"id": 63}, "226,227", [226, 227])
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, dict):
+        for key in ("value", "values", "id"):
+            if key in value:
+                return _normalize(value[key])
+        return json.dumps(value, sort_keys=True, default=str)
+    if isinstance(value, (list, tuple, set)):
+        return ",".join(sorted(_normalize(item) for item in value))
+    return str(value).strip()
+
+
+def same_value(a, b) -> bool:
+    """True if two values are the same once Pipedrive/NetHunt shape differences are ignored."""
+    return _normalize(a) == _normalize(b)
+
+
+def fingerprint(value) -> str:
+    return hashlib.sha256(_normalize(value).encode("utf-8")).hexdigest()
+
+
+async def record_write(entity: str, entity_id, fields: dict):
+    """Remember an outbound write so the change it causes upstream can be recognised as ours."""
+    if not entity_id or not fields:
+        return
+    now = time.time()
+    await record_ledger_writes(
+        entity,
+        entity_id,
+        {field: fingerprint(value) for field, value in fields.items()},
+        now,
+        now - ECHO_WINDOW_SECONDS
+    )
+
+
+def nethunt_written_fields(field_actions: dict) -> dict:
+    return {field: (action or {}).get("add") for field, action in field_actions.items()}
+
+
+async def _written_fingerprints(entity: str, entity_id) -> dict:
+    """field -> fingerprints of the values we wrote to this entity within the echo window."""
+    written = {}
+    for field, field_fingerprint, _ in await get_ledger_writes(entity, entity_id, time.time() - ECHO_WINDOW_SECONDS):
+        written.setdefault(field, set()).add(field_fingerprint)
+    return written
+
+
+async def is_own_write(entity: str, entity_id, fields: dict) -> bool:
+    """True if every field matches a value we wrote to this entity within the echo window."""
+    if not entity_id or not fields:
+        return False
+    written = await _written_fingerprints(entity, entity_id)
+    return all(fingerprint(value) in written.get(field, ()) for field, value in fields.items())
+
+
+def _flatten_pipedrive(data: dict) -> dict:
+    # v2 webhooks nest custom fields; our writes use the flat v1 keys
+    flat = dict(data or {})
+    flat.update(flat.pop("custom_fields", None) or {})
+    return flat
+
+
+def pipedrive_changed_fields(body: dict) -> dict:
+    """Fields whose value differs between `previous` and `data`, or {} when the event has no previous state."""
+    current = _flatten_pipedrive(body.get("data"))
+    previous = _flatten_pipedrive(body.get("previous"))
+    return {
+        key: current.get(key)
+        for key in previous
+        if key not in VOLATILE_PIPEDRIVE_FIELDS and _normalize(current.get(key)) != _normalize(previous.get(key))
+    }
+
+
+async def is_pipedrive_echo(entity: str, entity_id, body: dict) -> bool:
+    """An inbound Pipedrive webhook is our echo if every field it changed holds a value we wrote."""
+    # Our writes go through the API, so a change made in the app is never ours; an API
+    # change may still come from another integration, hence the field check either way
+    change_source = (body.get("meta") or {}).get("change_source")
+    if change_source and change_source != "api":
+        return False
+    changed = pipedrive_changed_fields(body)
+    return bool(changed) and await is_own_write(entity, entity_id, changed)
+
+
+async def _holds_our_values(entity: str, entity_id, fields: dict, mapped_fields) -> bool:
+    """True if every mapped field holds a value we wrote; fields missing from `fields` only count when we wrote them."""
+    if not entity_id:
+        return False
+    written = await _written_fingerprints(entity, entity_id)
+    if not written:
+        return False
+    compared = {name: fields.get(name) for name in mapped_fields if name in fields or name in written}
+    return bool(compared) and all(fingerprint(value) in written.get(name, ()) for name, value in compared.items())
+
+
+async def is_nethunt_echo(record: dict, mapped_fields) -> bool:
+    """A polled NetHunt record is our echo if every mapped field on it holds a value we wrote."""
+    return await _holds_our_values("nethunt_record", record.get("recordId"), record.get("fields") or {}, mapped_fields)
+
+
+async def is_pipedrive_poll_echo(entity: str, entity_id, data: dict, mapped_fields) -> bool:
+    """A polled Pipedrive item is our echo if every mapped field on it holds a value we wrote."""
+    return await _holds_our_values(entity, entity_id, _flatten_pipedrive(data), mapped_fields)
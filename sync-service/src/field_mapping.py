@@ -0,0 +1,420 @@
+# field_mapping.py
+import logging
+
+from src.field_metadata import field_index, on_refresh
+from src.stage_mapping import get_stage_id, get_pipeline_id, get_stage_pipeline_id, get_first_stage_id
+
+# Option sets (Pipedrive option label -> NetHunt value), shared by both directions.
+# Option ids are looked up by label in the Pipedrive field metadata at compile time.
+SERVICE_INTEREST = {"Chef Services": "Chef Services", "Home Assistant Services": "Home Assistant Services", "Combo Services": "Combo Services"}
+SERVICES_RECEIVED = {"Chef Service": "Chef Service", "Home Assistant Service": "Home Assistant Service", "Combo Service": "Combo Service", "Organization Service": "Organization Service"}
+# "Services Received Updated" is mirrored as one NetHunt checkbox per service
+SERVICES_CHECKBOXES = {"Chef Service": "Chef Service", "Home Assistant Service": "Home Assistant Services", "Combo Service": "Combo Services"}
+YES_NO = {"Yes": "Yes", "No": "No"}
+
+# Each entry maps one field. Pipedrive fields are given either by display name
+# ("pipedrive", resolved through src/field_metadata.py) or by raw key ("pipedrive_key").
+# "source" says where the Pipedrive value lives: the deal (default), its person, or
+# the deal's related stage/pipeline objects.
+DEAL_TO_SERVICES = [
+    {"nethunt": "Name", "source": "person", "attr": "name"},
+    {"nethunt": "Email", "source": "person", "attr": "email", "convert": "values"},
+    {"nethunt": "Phone", "source": "person", "attr": "phone", "convert": "values"},
+    {"nethunt": "Client Lost Reasons", "source": "person", "attr": "lost_reason"},
+    {"nethunt": "Stage", "source": "related", "pipedrive": "Stage", "related": "stage"},
+    {"nethunt": "Pipeline", "source": "related", "pipedrive_key": "pipeline_id", "related": "pipeline"},
+    {"nethunt": "Contact Status", "pipedrive_key": "label", "convert": "contact_status"},
+    {"pipedrive": "Services Received Updated", "convert": "checkboxes", "options": SERVICES_CHECKBOXES},
+    {"nethunt": "Address", "pipedrive": "Address"},
+    {"nethunt": "Preferred Days / Availability", "pipedrive": "Preferred Days or Availability"},
+    {"nethunt": "Chef Assigned", "pipedrive": "Chef Assigned"},
+    {"nethunt": "Home Assistant Assigned", "pipedrive": "Home Assistant Assigned"},
+    {"nethunt": "Past Providers", "pipedrive": "Past Providers"},
+    {"nethunt": "Service Interest", "pipedrive": "Service Interest", "convert": "option_list", "options": SERVICE_INTEREST},
+    {"nethunt": "Last name", "pipedrive": "Last name"},
+]
+
+DEAL_TO_TEAM = [
+    {"nethunt": "Name", "source": "person", "attr": "name"},
+    {"nethunt": "Email Primary", "source": "person", "attr": "email", "convert": "values"},
+    {"nethunt": "Phone", "source": "person", "attr": "phone", "convert": "values"},
+    {"nethunt": "Lost Reason", "pipedrive": "Lost reason"},
+    {"nethunt": "Role", "pipedrive_key": "label"},
+    {"nethunt": "Stage", "source": "related", "pipedrive": "Stage", "related": "stage"},
+    {"nethunt": "Pipeline", "source": "related", "pipedrive_key": "pipeline_id", "related": "pipeline"},
+    {"nethunt": "Address", "pipedrive": "Address"},
+    {"nethunt": "West Chester Area Availability", "pipedrive": "West Chester Availablity", "convert": "option", "options": YES_NO},
+    {"nethunt": "Philadelphia Availability", "pipedrive": "Philadelphia Availability", "convert": "option", "options": YES_NO},
+    {"nethunt": "Main Line Availability", "pipedrive": "Main Line Availability", "convert": "option", "options": YES_NO},
+    {"nethunt": "Preferred Days / Availability", "pipedrive": "Preferred Days or Availability"},
+    {"nethunt": "Last name", "pipedrive": "Last name"},
+]
+
+# NetHunt record fields -> Pipedrive deal update payload; entries run in order, so a
+# later entry writing the same key (pipeline's first stage, Current Services) wins
+RECORD_TO_DEAL = [
+    {"pipedrive": "Services Received Updated", "convert": "checkboxes", "options": SERVICES_CHECKBOXES},
+    {"pipedrive": "Title", "nethunt": "Name"},
+    {"pipedrive_key": "Email", "nethunt": "Email Primary"},
+    {"pipedrive_key": "Phone", "nethunt": "Phone"},
+    {"pipedrive": "Stage", "nethunt": "Stage", "convert": "stage", "pipeline_field": "Pipeline"},
+    {"pipedrive_key": "pipeline_id", "nethunt": "Pipeline", "convert": "pipeline"},
+    {"pipedrive": "First Name", "nethunt": "First Name"},
+    {"pipedrive": "West Chester Availablity", "nethunt": "West Chester Availablity"},
+    {"pipedrive": "Philadelphia Availability", "nethunt": "Philadelphia Availability"},
+    {"pipedrive": "Main Line Availability", "nethunt": "Main Line Availability"},
+    {"pipedrive": "Address", "nethunt": "Address"},
+    {"pipedrive": "Preferred Days or Availability", "nethunt": "Preferred Days / Availability"},
+    {"pipedrive": "Chef Assigned", "nethunt": "Chef Assigned"},
+    {"pipedrive": "Home Assistant Assigned", "nethunt": "Home Assistant Assigned"},
+    {"pipedrive": "Past Providers", "nethunt": "Past Providers"},
+    {"pipedrive": "Service Interest", "nethunt": ["Service Interest", "Current Services"], "convert": "option_list", "options": SERVICE_INTEREST},
+    {"pipedrive": "Last name", "nethunt": "Last Name"},
+    {"pipedrive": "Label", "nethunt": "Contact Status"},
+    {"pipedrive": "Lost reason", "nethunt": ["Lost Reason", "lost_reason"], "convert": "if_set"},
+    {"pipedrive_key": "client_lost_reasons", "nethunt": ["Client Lost Reasons", "client_lost_reasons"], "convert": "if_set"},
+    {"pipedrive": "Services Received Updated", "nethunt": ["Current Services"], "convert": "option_list", "options": SERVICES_RECEIVED},
+]
+
+RECORD_TO_PERSON = [
+    {"pipedrive_key": "first_name", "nethunt": "First name"},
+    {"pipedrive_key": "last_name", "nethunt": "Last name"},
+    {"pipedrive_key": "email", "nethunt": "Email"},
+    {"pipedrive_key": "phone", "nethunt": "Phone"},
+    {"pipedrive_key": "address", "nethunt": "Address"},
+]
+
+
+def _pipedrive_key(entry: dict, meta: dict) -> str:
+    if "pipedrive_key" in entry:
+        return entry["pipedrive_key"]
+    name = entry["pipedrive"]
+    if name not in meta["keys_by_name"]:
+        raise KeyError(f"Unknown Pipedrive field '{name}' in mapping spec; add it to key_name_mapping.json")
+    return meta["keys_by_name"][name]
+
+
+def _option_values(entry: dict, key: str, meta: dict) -> dict:
+    """Pipedrive option id -> NetHunt value for the entry's option set."""
+    ids = meta["option_ids"].get(key, {})
+    values = {}
+    for label, value in entry["options"].items():
+        if label in ids:
+            values[ids[label]] = value
+        else:
+            logging.warning(f"[field_mapping] Pipedrive field '{entry.get('pipedrive', key)}' has no option '{label}'")
+    return values
+
+
+def parse_option_ids(raw) -> list:
+    """Option ids out of any shape Pipedrive sends: {"values": [{"id": ..}]}, 63, or "63,64"."""
+    if isinstance(raw, dict) and "values" in raw:
+        return [v.get("id") for v in raw.get("values", []) if v.get("id") is not None]
+    if isinstance(raw, int):
+        return [raw]
+    if isinstance(raw, str) and raw:
+        try:
+            return [int(x.strip()) for x in raw.split(",") if x.strip().isdigit()]
+        except Exception:
+            return []
+    return []
+
+
+def _single_or_list(values: list, empty):
+    return values if len(values) > 1 else (values[0] if values else empty)
+
+
+# Pipedrive -> NetHunt converters: each compiles to step(data, related, person, out)
+
+def _pd_getter(entry: dict, key: str):
+    if entry.get("source") == "person":
+        attr = entry["attr"]
+        return lambda data, related, person: person.get(attr, "")
+    if entry.get("source") == "related":
+        kind = entry["related"]
+
+        def related_name(data, related, person):
+            related_id = data.get(key)
+            if related_id is None:
+                return ""
+            return related.get(kind, {}).get(str(related_id), {}).get("name", "")
+        return related_name
+    return lambda data, related, person: data.get(key, "")
+
+
+def _compile_to_nethunt(entry: dict, meta: dict):
+    key = None if entry.get("source") == "person" else _pipedrive_key(entry, meta)
+    get = _pd_getter(entry, key)
+    field = entry.get("nethunt")
+    convert = entry.get("convert")
+    options = _option_values(entry, key, meta) if "options" in entry else None
+    if convert == "option_list":
+        # Options the spec doesn't name still map to their Pipedrive label
+        options = {**meta["option_labels"].get(key, {}), **options}
+
+    if convert == "checkboxes":
+        checkboxes = list(options.items())
+
+        def step(data, related, person, out):
+            ids = parse_option_ids(get(data, related, person))
+            for option_id, checkbox in checkboxes:
+                out[checkbox] = option_id in ids
+        return step
+
+    if convert == "values":
+        def step(data, related, person, out):
+            out[field] = [item.get("value") for item in get(data, related, person) if item.get("value")]
+    elif convert == "contact_status":
+        def step(data, related, person, out):
+            out[field] = "Lead" if get(data, related, person) == "150" else "Client"
+    elif convert == "option":
+        def step(data, related, person, out):
+            raw = get(data, related, person)
+            if isinstance(raw, int):
+                out[field] = options.get(raw, "")
+            elif isinstance(raw, str) and raw.isdigit():
+                out[field] = options.get(int(raw), "")
+            else:
+                out[field] = ""
+    elif convert == "option_list":
+        def step(data, related, person, out):
+            raw = get(data, related, person)
+            if isinstance(raw, dict) and "values" in raw:
+                out[field] = _single_or_list([options.get(i, str(i)) for i in parse_option_ids(raw)], "")
+            elif isinstance(raw, int):
+                out[field] = options.get(raw, str(raw))
+            elif isinstance(raw, str) and raw:
+                try:
+                    ids = [int(x.strip()) for x in raw.split(",") if x.strip().isdigit()]
+                    out[field] = _single_or_list([options.get(i, str(i)) for i in ids], raw)
+                except Exception:
+                    out[field] = raw
+            else:
+                out[field] = str(raw) if raw else ""
+    elif convert is None:
+        def step(data, related, person, out):
+            out[field] = get(data, related, person)
+    else:
+        raise ValueError(f"Unknown Pipedrive -> NetHunt converter '{convert}' for {field}")
+    return step
+
+
+# NetHunt -> Pipedrive converters: each compiles to step(fields, payload)
+
+def _compile_to_pipedrive(entry: dict, meta: dict):
+    key = _pipedrive_key(entry, meta)
+    convert = entry.get("convert")
+    options = _option_values(entry, key, meta) if "options" in entry else None
+    names = entry.get("nethunt")
+
+    if convert == "checkboxes":
+        checkboxes = [(checkbox, option_id) for option_id, checkbox in options.items()]
+
+        def step(fields, payload):
+            ids = [option_id for checkbox, option_id in checkboxes if fields.get(checkbox) in (True, "True")]
+            if ids:
+                payload[key] = _single_or_list(ids, None)
+        return step
+
+    if convert == "option_list":
+        reverse = {label: option_id for option_id, label in options.items()}
+        first, *fallbacks = names
+
+        def step(fields, payload):
+            value = fields.get(first)
+            for fallback in fallbacks:
+                value = value or fields.get(fallback)
+            if not value:
+                return
+            if isinstance(value, str):
+                value = [value]
+            ids = [reverse.get(label) for label in value if label in reverse]
+            if ids:
+                payload[key] = _single_or_list(ids, None)
+        return step
+
+    if convert == "if_set":
+        def step(fields, payload):
+            for name in names:
+                value = fields.get(name)
+                if value:
+                    payload[key] = value
+                    return
+        return step
+
+    if convert == "stage":
+        pipeline_field = entry.get("pipeline_field")
+
+        def step(fields, payload):
+            stage_name = fields.get(names)
+            if not stage_name:
+                return
+            # Stage names repeat across pipelines, so resolve within the record's pipeline
+            pipeline_name = fields.get(pipeline_field) if pipeline_field else None
+            stage_id = get_stage_id(stage_name, get_pipeline_id(pipeline_name) if pipeline_name else None)
+            if stage_id:
+                payload[key] = stage_id
+            else:
+                logging.warning(f"Could not find stage ID for stage name: '{stage_name}'")
+        return step
+
+    if convert == "pipeline":
+        stage_key = meta["keys_by_name"]["Stage"]
+
+        def step(fields, payload):
+            pipeline_name = fields.get(names)
+            if not pipeline_name:
+                return
+            pipeline_id = get_pipeline_id(pipeline_name)
+            if not pipeline_id:
+                logging.warning(f"Could not find pipeline ID for pipeline name: '{pipeline_name}'")
+                return
+            payload[key] = pipeline_id
+            # Keep a stage that belongs to this pipeline; otherwise the deal is moving
+            # pipeline and lands on the new pipeline's first stage
+            if get_stage_pipeline_id(payload.get(stage_key)) == pipeline_id:
+                return
+            stage_id = get_first_stage_id(pipeline_id)
+            if stage_id:
+                payload[stage_key] = stage_id
+            else:
+                logging.warning(f"No first stage found for pipeline '{pipeline_name}'")
+        return step
+
+    if convert is None:
+        def step(fields, payload):
+            if names in fields:
+                value = fields[names]
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                payload[key] = value
+        return step
+
+    raise ValueError(f"Unknown NetHunt -> Pipedrive converter '{convert}' for {key}")
+
+
+def _field_sources(spec: list, meta: dict) -> dict:
+    # Pipedrive deal key -> NetHunt fields it feeds, for diffing webhook changes
+    sources = {}
+    for entry in spec:
+        key = "person_id" if entry.get("source") == "person" else _pipedrive_key(entry, meta)
+        fields = list(entry["options"].values()) if entry.get("convert") == "checkboxes" else [entry["nethunt"]]
+        sources.setdefault(key, []).extend(fields)
+    return sources
+
+
+def _record_fields(spec: list) -> set:
+    # NetHunt fields a record -> Pipedrive spec reads
+    fields = set()
+    for entry in spec:
+        if entry.get("convert") == "checkboxes":
+            fields.update(entry["options"].values())
+        names = entry.get("nethunt")
+        if names:
+            fields.update(names if isinstance(names, list) else [names])
+        if entry.get("pipeline_field"):
+            fields.add(entry["pipeline_field"])
+    return fields
+
+
+def _compile_deal_steps(spec: list, meta: dict) -> list:
+    steps = []
+    copies = None
+    for entry in spec:
+        if entry.get("convert") is None and entry.get("source") is None:
+            # Runs of plain deal fields become one step copying (field, key) pairs
+            if copies is None:
+                copies = []
+                steps.append(_copy_step(copies))
+            copies.append((entry["nethunt"], _pipedrive_key(entry, meta)))
+            continue
+        copies = None
+        steps.append(_compile_to_nethunt(entry, meta))
+    return steps
+
+
+def _copy_step(copies: list):
+    def step(data, related, person, out):
+        for field, key in copies:
+            out[field] = data.get(key, "")
+    return step
+
+
+def compile_mappings(meta: dict = None) -> dict:
+    """Resolve the spec against the Pipedrive deal field metadata into per-direction step tables."""
+    meta = meta or field_index("deal")
+    return {
+        "deal_to_services": _compile_deal_steps(DEAL_TO_SERVICES, meta),
+        "deal_to_team": _compile_deal_steps(DEAL_TO_TEAM, meta),
+        "record_to_deal": [_compile_to_pipedrive(entry, meta) for entry in RECORD_TO_DEAL],
+        "record_to_person": [_compile_to_pipedrive(entry, meta) for entry in RECORD_TO_PERSON],
+        "services_sources": _field_sources(DEAL_TO_SERVICES, meta),
+        "team_sources": _field_sources(DEAL_TO_TEAM, meta),
+    }
+
+
+# Compiled once at import so a bad spec fails at startup, not on the first webhook
+COMPILED = compile_mappings()
+SERVICES_FIELD_SOURCES = dict(COMPILED["services_sources"])
+TEAM_FIELD_SOURCES = dict(COMPILED["team_sources"])
+# NetHunt services/team fields that reach Pipedrive, compared when telling our echoes from user edits
+RECORD_SOURCE_FIELDS = frozenset(_record_fields(RECORD_TO_DEAL) | _record_fields(RECORD_TO_PERSON))
+# Pipedrive person attributes that reach NetHunt through the deal sync
+PERSON_SOURCE_FIELDS = frozenset(entry["attr"] for entry in DEAL_TO_SERVICES + DEAL_TO_TEAM if entry.get("source") == "person")
+
+
+def recompile_mappings():
+    """Rebuild the step tables after the field metadata changes; mapping keeps using the old ones until then."""
+    global COMPILED
+    try:
+        compiled = compile_mappings()
+    except Exception as e:
+        logging.error(f"[field_mapping] Keeping previous mappings, recompile failed: {e}")
+        return
+    COMPILED = compiled
+    # Updated in place: other modules hold references to these
+    for sources, fresh in ((SERVICES_FIELD_SOURCES, compiled["services_sources"]), (TEAM_FIELD_SOURCES, compiled["team_sources"])):
+        sources.clear()
+        sources.update(fresh)
+
+
+on_refresh(recompile_mappings)
+
+
+def _map_deal(steps: list, deal_data: dict) -> dict:
+    data = deal_data.get("data", {})
+    related = deal_data.get("related_objects", {})
+    person = data.get("person_id", {})
+    extracted = {}
+    for step in steps:
+        step(data, related, person, extracted)
+    return extracted
+
+
+def map_deal_to_services(deal_data: dict) -> dict:
+    """NetHunt services record fieldActions for a Pipedrive deal (GET /deals/{id} response)."""
+    extracted = _map_deal(COMPILED["deal_to_services"], deal_data)
+    return {field: {"overwrite": True, "add": value if value not in ("", [], None) else ""} for field, value in extracted.items()}
+
+
+def map_deal_to_team(deal_data: dict) -> dict:
+    """NetHunt team record fieldActions for a Pipedrive deal (GET /deals/{id} response)."""
+    extracted = _map_deal(COMPILED["deal_to_team"], deal_data)
+    return {field: {"overwrite": True, "add": value if value else ""} for field, value in extracted.items()}
+
+
+def _map_record(steps: list, record_fields: dict) -> dict:
+    payload = {}
+    for step in steps:
+        step(record_fields, payload)
+    return payload
+
+
+def map_record_to_deal(record_fields: dict) -> dict:
+    """Pipedrive deal update payload for a NetHunt record's fields."""
+    return _map_record(COMPILED["record_to_deal"], record_fields)
+
+
+def map_record_to_person(record_fields: dict) -> dict:
+    """Pipedrive person update payload for a NetHunt record's fields."""
+    return _map_record(COMPILED["record_to_person"], record_fields)
@@ -0,0 +1,184 @@
+# field_metadata.py
+import asyncio
+import json
+import logging
+import os
+import time
+
+from src.clients.pipedrive import pipedrive_client
+from src.config import FIELD_METADATA_TTL, FIELD_METADATA_RETRY_DELAY
+from src.state import get_field_definitions, put_field_definitions
+
+# Pipedrive deal field key -> name as of writing; the offline fallback for deal fields
+KEY_NAME_MAPPING_PATH = os.path.join(os.path.dirname(__file__), "key_name_mapping.json")
+
+# Option label -> id as of writing, per deal field name; the offline fallback for options
+STATIC_OPTION_IDS = {
+    "Service Interest": {"Chef Services": 63, "Home Assistant Services": 64, "Combo Services": 66},
+    "Services Received Updated": {"Chef Service": 226, "Home Assistant Service": 227, "Combo Service": 228, "Organization Service": 229},
+    "Philadelphia Availability": {"Yes": 224, "No": 225},
+    "West Chester Availablity": {"Yes": 286, "No": 287},
+    "Main Line Availability": {"Yes": 222, "No": 223},
+}
+
+ENTITIES = ("deal", "person")
+
+# Called with no arguments after the index changes (field_mapping recompiles on it)
+_refresh_listeners = []
+
+
+def load_key_names(path: str = KEY_NAME_MAPPING_PATH) -> dict:
+    """Display name -> Pipedrive deal field key, from key_name_mapping.json."""
+    with open(path, encoding="utf-8") as f:
+        key_names = json.load(f)
+    keys_by_name = {}
+    for key, name in key_names.items():
+        if name in keys_by_name:
+            raise ValueError(f"Duplicate Pipedrive field name '{name}' in {path}")
+        keys_by_name[name] = key
+    return keys_by_name
+
+
+def build_field_index(fields: list, fallback: dict = None, fetched_at: float = 0) -> dict:
+    """Lookup tables from Pipedrive field definitions (key, name, field_type, options).
+
+    Fields from `fallback` that Pipedrive no longer reports by name keep resolving,
+    so a partial response never makes a mapped field disappear.
+    """
+    index = {
+        "fetched_at": fetched_at,
+        "keys_by_name": dict((fallback or {}).get("keys_by_name", {})),
+        "names_by_key": {},
+        "types": {},
+        "option_ids": {key: dict(ids) for key, ids in (fallback or {}).get("option_ids", {}).items()},
+        "option_labels": {},
+    }
+    seen_names = {}
+    for field in fields:
+        key, name = field["key"], field.get("name")
+        index["names_by_key"][key] = name
+        index["types"][key] = field.get("field_type")
+        seen_names.setdefault(name, []).append(key)
+        options = field.get("options") or []
+        if options:
+            index["option_ids"][key] = {option["label"]: option["id"] for option in options}
+    for name, keys in seen_names.items():
+        # Pipedrive allows duplicate names; only an unambiguous name replaces the fallback key
+        if len(keys) == 1:
+            index["keys_by_name"][name] = keys[0]
+    for name, key in index["keys_by_name"].items():
+        index["names_by_key"].setdefault(key, name)
+    for key, ids in index["option_ids"].items():
+        index["option_labels"][key] = {option_id: label for label, option_id in ids.items()}
+    return index
+
+
+def _static_field_index() -> dict:
+    keys_by_name = load_key_names()
+    option_ids = {keys_by_name[name]: dict(ids) for name, ids in STATIC_OPTION_IDS.items()}
+    return {
+        "deal": build_field_index([], {"keys_by_name": keys_by_name, "option_ids": option_ids}),
+        "person": build_field_index([]),
+    }
+
+
+# Current index per entity; swapped whole on refresh so lookups never see a half-built one
+_field_index = _static_field_index()
+
+
+def field_index(entity: str = "deal") -> dict:
+    return _field_index[entity]
+
+
+def get_field_key(name: str, entity: str = "deal", default: str = None) -> str:
+    return _field_index[entity]["keys_by_name"].get(name, default)
+
+
+def get_field_name(key: str, entity: str = "deal") -> str:
+    return _field_index[entity]["names_by_key"].get(key)
+
+
+def get_field_type(key: str, entity: str = "deal") -> str:
+    return _field_index[entity]["types"].get(key)
+
+
+def get_option_id(key: str, label: str, entity: str = "deal"):
+    return _field_index[entity]["option_ids"].get(key, {}).get(label)
+
+
+def get_option_label(key: str, option_id, entity: str = "deal"):
+    return _field_index[entity]["option_labels"].get(key, {}).get(option_id)
+
+
+def on_refresh(listener):
+    _refresh_listeners.append(listener)
+
+
+def _swap_index(entity: str, index: dict):
+    _field_index[entity] = index
+    for listener in _refresh_listeners:
+        try:
+            listener()
+        except Exception as e:
+            logging.error(f"[field_metadata] Refresh listener {listener.__name__} failed: {e}")
+
+
+async def load_field_metadata():
+    """Adopt the definitions persisted in SQLite, even stale ones (they beat the static tables)."""
+    static = _static_field_index()
+    for entity in ENTITIES:
+        fields, fetched_at = await get_field_definitions(entity)
+        if fields:
+            _swap_index(entity, build_field_index(fields, static[entity], fetched_at))
+            logging.info(f"[field_metadata] Loaded {len(fields)} cached {entity} fields")
+
+
+async def _fetch_fields(entity: str) -> list:
+    fields = []
+    start = 0
+    while start is not None:
+        page, start = await pipedrive_client.get_fields(entity, start=start)
+        fields.extend(page)
+    return fields
+
+
+async def refresh_field_metadata(entity: str):
+    """Fetch the entity's field definitions from Pipedrive, persist them and swap the index."""
+    fields = await _fetch_fields(entity)
+    if not fields:
+        raise RuntimeError(f"Pipedrive returned no {entity} fields")
+    fetched_at = time.time()
+    definitions = [
+        {
+            "key": field["key"],
+            "name": field.get("name"),
+            "field_type": field.get("field_type"),
+            "options": [{"id": option.get("id"), "label": option.get("label")} for option in field.get("options") or []],
+        }
+        for field in fields
+    ]
+    await put_field_definitions(entity, definitions, fetched_at)
+    _swap_index(entity, build_field_index(definitions, _static_field_index()[entity], fetched_at))
+    logging.info(f"[field_metadata] Refreshed {len(definitions)} {entity} fields")
+
+
+async def keep_field_metadata_fresh():
+    """Background task: refresh each entity's definitions whenever they are older than FIELD_METADATA_TTL."""
+    try:
+        await load_field_metadata()
+    except Exception as e:
+        logging.error(f"[field_metadata] Failed to load cached field metadata: {e}")
+    while True:
+        next_check = FIELD_METADATA_TTL
+        for entity in ENTITIES:
+            age = time.time() - _field_index[entity]["fetched_at"]
+            if age < FIELD_METADATA_TTL:
+                next_check = min(next_check, FIELD_METADATA_TTL - age)
+                continue
+            try:
+                await refresh_field_metadata(entity)
+            except Exception as e:
+                # Keep mapping with the cached (or static) definitions and try again later
+                logging.error(f"[field_metadata] Failed to refresh {entity} fields: {e}")
+                next_check = min(next_check, FIELD_METADATA_RETRY_DELAY)
+        await asyncio.sleep(next_check)
@@ -0,0 +1,182 @@
+# folder_schema.py
+# Per-folder NetHunt field schema, used to prune and coerce fieldActions before
+# they are sent: NetHunt rejects a whole update-record call for one unknown field.
+import asyncio
+import logging
+import time
+
+from src.clients.nethunt import nethunt_client, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID
+from src.config import NETHUNT_SCHEMA_TTL, NETHUNT_SCHEMA_RETRY_DELAY
+
+SCHEMA_FOLDER_IDS = [NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID]
+
+BOOLEAN_TYPES = {"checkbox", "boolean", "bool"}
+NUMBER_TYPES = {"number", "numeric", "decimal", "integer", "currency", "percent"}
+TEXT_TYPES = {"text", "string", "textarea", "multiline", "email", "phone", "url", "link"}
+
+TRUE_STRINGS = {"true", "yes", "1", "y", "on"}
+FALSE_STRINGS = {"false", "no", "0", "n", "off", ""}
+
+# folder id -> {"fields": {name: {"type", "options"}}, "writable": bool}; empty until the first fetch
+_folder_schemas = {}
+_fetched_at = 0
+# (folder id, field name) already reported as dropped since the last refresh
+_reported = set()
+
+
+def _option_label(option):
+    if isinstance(option, dict):
+        return option.get("name") or option.get("label") or option.get("value")
+    return option
+
+
+def build_folder_schema(fields: list, writable: bool = True) -> dict:
+    """Schema from a folder-field response: field name -> lowercased type and option labels."""
+    schema = {}
+    for field in fields:
+        name = field.get("name")
+        if not name:
+            continue
+        field_type = field.get("type") or field.get("fieldType") or ""
+        options = [_option_label(option) for option in field.get("options") or field.get("values") or []]
+        schema[name] = {
+            "type": str(field_type).lower(),
+            "options": {str(label).lower(): label for label in options if label is not None},
+        }
+    return {"fields": schema, "writable": writable}
+
+
+def folder_schema(folder_id: str) -> dict:
+    return _folder_schemas.get(folder_id)
+
+
+def _report_dropped(folder_id: str, name: str, reason: str):
+    # Mapped-but-missing fields would otherwise be logged on every sync
+    if (folder_id, name) in _reported:
+        logging.debug(f"[folder_schema] Dropping field '{name}' for folder {folder_id}: {reason}")
+        return
+    _reported.add((folder_id, name))
+    logging.warning(f"[folder_schema] Dropping field '{name}' for folder {folder_id}: {reason}")
+
+
+def _coerce_value(name: str, value, field: dict):
+    """Coerce one value to the field's type; raises ValueError when it cannot be sent."""
+    field_type = field["type"]
+    if value is None:
+        return None
+    if field_type in BOOLEAN_TYPES:
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_STRINGS:
+            return True
+        if text in FALSE_STRINGS:
+            return False
+        raise ValueError(f"'{value}' is not a boolean")
+    if field_type in NUMBER_TYPES:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str) and not value.strip():
+            return None
+        number = float(str(value).strip())
+        return int(number) if number.is_integer() else number
+    if field["options"]:
+        values = value if isinstance(value, list) else [value]
+        labels = []
+        for item in values:
+            if item in ("", None):
+                continue
+            label = field["options"].get(str(item).lower())
+            if label is None:
+                raise ValueError(f"'{item}' is not an option of {name}")
+            labels.append(label)
+        if isinstance(value, list):
+            return labels
+        return labels[0] if labels else ""
+    if field_type in TEXT_TYPES:
+        if isinstance(value, list):
+            return ", ".join(str(item) for item in value if item not in ("", None))
+        return value if isinstance(value, str) else str(value)
+    return value
+
+
+def _coerce_action(name: str, action, field: dict):
+    if isinstance(action, dict) and ("add" in action or "remove" in action):
+        coerced = dict(action)
+        for part in ("add", "remove"):
+            if part in coerced:
+                coerced[part] = _coerce_value(name, coerced[part], field)
+        return coerced
+    return _coerce_value(name, action, field)
+
+
+def _validate(folder_id: str, fields: dict, coerce) -> dict:
+    schema = _folder_schemas.get(folder_id)
+    if schema is None:
+        # Schema not loaded (yet): send as-is rather than drop the sync
+        return fields
+    if not schema["writable"]:
+        logging.error(f"[folder_schema] Folder {folder_id} is not writable with these credentials, dropping {list(fields)}")
+        return {}
+    valid = {}
+    for name, value in fields.items():
+        field = schema["fields"].get(name)
+        if field is None:
+            _report_dropped(folder_id, name, "not a field of the folder")
+            continue
+        try:
+            valid[name] = coerce(name, value, field)
+        except (TypeError, ValueError) as e:
+            _report_dropped(folder_id, name, str(e))
+    return valid
+
+
+def prepare_field_actions(folder_id: str, field_actions: dict) -> dict:
+    """fieldActions for update-record with unknown fields pruned and values coerced."""
+    return _validate(folder_id, field_actions, _coerce_action)
+
+
+def prepare_fields(folder_id: str, fields: dict) -> dict:
+    """Fields for create-record with unknown fields pruned and values coerced."""
+    return _validate(folder_id, fields, _coerce_value)
+
+
+async def refresh_folder_schemas(folder_ids: list = SCHEMA_FOLDER_IDS):
+    """Fetch the writable folders and each synced folder's fields, then swap the schemas in."""
+    global _folder_schemas, _fetched_at
+    writable = {folder.get("id") for folder in await nethunt_client.get_writable_folders()}
+    results = await asyncio.gather(
+        *(nethunt_client.get_folder_fields(folder_id) for folder_id in folder_ids if folder_id in writable),
+        return_exceptions=True
+    )
+    schemas = {}
+    results = iter(results)
+    for folder_id in folder_ids:
+        if folder_id not in writable:
+            schemas[folder_id] = build_folder_schema([], writable=False)
+            continue
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        if not result:
+            raise RuntimeError(f"NetHunt returned no fields for folder {folder_id}")
+        schemas[folder_id] = build_folder_schema(result)
+    _folder_schemas = schemas
+    _fetched_at = time.time()
+    _reported.clear()
+    logging.info(f"[folder_schema] Refreshed schemas: { {folder_id: len(schema['fields']) for folder_id, schema in schemas.items()} }")
+
+
+async def keep_folder_schemas_fresh():
+    """Background task: refresh the schemas whenever they are older than NETHUNT_SCHEMA_TTL."""
+    while True:
+        age = time.time() - _fetched_at
+        if age < NETHUNT_SCHEMA_TTL:
+            await asyncio.sleep(NETHUNT_SCHEMA_TTL - age)
+            continue
+        try:
+            await refresh_folder_schemas()
+        except Exception as e:
+            # Keep validating against the previous schemas (or none) and try again later
+            logging.error(f"[folder_schema] Failed to refresh folder schemas: {e}")
+            await asyncio.sleep(NETHUNT_SCHEMA_RETRY_DELAY)
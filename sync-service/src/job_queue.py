@@ -0,0 +1,199 @@
+# job_queue.py
+import asyncio
+import json
+import logging
+import time
+
+from src.config import (
+    JOB_QUEUE_DB_PATH,
+    JOB_MAX_ATTEMPTS,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_RETRY_BASE_DELAY,
+    JOB_RETRY_MAX_DELAY,
+    JOB_POLL_INTERVAL,
+    WEBHOOK_COALESCE_WINDOW,
+    WEBHOOK_COALESCE_MAX_DELAY,
+)
+from src.db import StateEngine
+
+
+def _create_queue_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        locked_until REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    )
+    """)
+    # Older queue files predate coalescing
+    if "dedupe_key" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)").fetchall()]:
+        conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_available_at ON jobs (available_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_key ON jobs (dedupe_key)")
+    # Jobs that ran out of attempts, kept for inspection and manual replay
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS dead_letter (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        failed_at REAL NOT NULL
+    )
+    """)
+
+
+# Durable webhook job queue, kept in its own file next to sync_service.db so the
+# hot insert path never contends with the sync state tables
+db = StateEngine(JOB_QUEUE_DB_PATH, init=_create_queue_schema)
+
+# Wakes idle workers as soon as something is enqueued in this process
+_job_available = asyncio.Event()
+
+
+async def enqueue(kind: str, payload: dict, delay: float = 0) -> int:
+    now = time.time()
+    job_id = await db.write(lambda conn: conn.execute(
+        "INSERT INTO jobs (kind, payload, available_at, created_at) VALUES (?, ?, ?, ?)",
+        (kind, json.dumps(payload), now + delay, now)
+    ).lastrowid)
+    _job_available.set()
+    logging.debug(f"[job_queue] Enqueued {kind} job {job_id}")
+    return job_id
+
+
+def merge_webhook_payloads(older: dict, newer: dict) -> dict:
+    """Latest state wins, but keep the earliest `previous` value of every field so the burst reads as one change."""
+    merged = dict(newer)
+    if older.get("previous") or newer.get("previous"):
+        merged["previous"] = {**(newer.get("previous") or {}), **(older.get("previous") or {})}
+    return merged
+
+
+async def enqueue_coalesced(kind: str, dedupe_key: str, payload: dict) -> int:
+    """Enqueue behind a quiet window, folding the event into a still-pending job for the same key."""
+    now = time.time()
+
+    def coalesce(conn):
+        # Runs inside the engine's write transaction, so a worker can't claim the
+        # pending job between the read and the update
+        row = conn.execute("""
+            SELECT id, payload, created_at FROM jobs
+            WHERE dedupe_key = ? AND kind = ? AND locked_until <= ?
+            ORDER BY id LIMIT 1
+        """, (dedupe_key, kind, now)).fetchone()
+        if row:
+            job_id, pending_payload, created_at = row
+            # Debounce, but never hold a busy entity back longer than the max delay
+            available_at = min(now + WEBHOOK_COALESCE_WINDOW, created_at + WEBHOOK_COALESCE_MAX_DELAY)
+            conn.execute(
+                "UPDATE jobs SET payload = ?, available_at = MAX(available_at, ?) WHERE id = ?",
+                (json.dumps(merge_webhook_payloads(json.loads(pending_payload), payload)), available_at, job_id)
+            )
+            logging.debug(f"[job_queue] Coalesced {kind} event for {dedupe_key} into job {job_id}")
+            return job_id
+        job_id = conn.execute(
+            "INSERT INTO jobs (kind, payload, available_at, created_at, dedupe_key) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), now + WEBHOOK_COALESCE_WINDOW, now, dedupe_key)
+        ).lastrowid
+        logging.debug(f"[job_queue] Enqueued {kind} job {job_id} for {dedupe_key}")
+        return job_id
+
+    return await db.write(coalesce)
+
+
+async def claim_job():
+    """Lock the next due job for JOB_VISIBILITY_TIMEOUT seconds; returns (id, kind, payload, attempts) or None."""
+    now = time.time()
+    # Single statement, so two worker processes can never claim the same job
+    row = await db.write(lambda conn: conn.execute("""
+        UPDATE jobs SET locked_until = ?, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE available_at <= ? AND locked_until <= ?
+            ORDER BY available_at, id
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts
+    """, (now + JOB_VISIBILITY_TIMEOUT, now, now)).fetchone())
+    if not row:
+        return None
+    job_id, kind, payload, attempts = row
+    return job_id, kind, json.loads(payload), attempts
+
+
+async def complete_job(job_id: int):
+    await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+async def release_job(job_id: int):
+    """Hand an interrupted job back without counting the attempt."""
+    await db.execute(
+        "UPDATE jobs SET locked_until = 0, attempts = MAX(attempts - 1, 0) WHERE id = ?",
+        (job_id,)
+    )
+
+
+async def fail_job(job_id: int, attempts: int, error: str):
+    if attempts >= JOB_MAX_ATTEMPTS:
+        def dead_letter(conn):
+            conn.execute("""
+                INSERT OR REPLACE INTO dead_letter (id, kind, payload, attempts, last_error, created_at, failed_at)
+                SELECT id, kind, payload, attempts, ?, created_at, ? FROM jobs WHERE id = ?
+            """, (error, time.time(), job_id))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+        await db.write(dead_letter)
+        logging.error(f"[job_queue] Job {job_id} moved to dead_letter after {attempts} attempts: {error}")
+        return
+    delay = min(JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), JOB_RETRY_MAX_DELAY)
+    await db.execute(
+        "UPDATE jobs SET available_at = ?, locked_until = 0, last_error = ? WHERE id = ?",
+        (time.time() + delay, error, job_id)
+    )
+    logging.warning(f"[job_queue] Job {job_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+
+
+async def queue_depth() -> int:
+    return (await db.fetchone("SELECT COUNT(*) FROM jobs"))[0]
+
+
+async def dead_letter_depth() -> int:
+    return (await db.fetchone("SELECT COUNT(*) FROM dead_letter"))[0]
+
+
+async def run_worker(handlers: dict, worker_id: int = 0):
+    """Drain the queue forever, dispatching each job to handlers[kind](payload)."""
+    while True:
+        job = await claim_job()
+        if job is None:
+            _job_available.clear()
+            try:
+                await asyncio.wait_for(_job_available.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        job_id, kind, payload, attempts = job
+        handler = handlers.get(kind)
+        if handler is None:
+            await fail_job(job_id, JOB_MAX_ATTEMPTS, f"No handler for job kind '{kind}'")
+            continue
+        try:
+            # Finish (or give up) before the lock expires and another worker picks the job up
+            await asyncio.wait_for(handler(payload), timeout=JOB_VISIBILITY_TIMEOUT)
+            await complete_job(job_id)
+            logging.debug(f"[job_queue] Worker {worker_id} finished {kind} job {job_id}")
+        except asyncio.CancelledError:
+            await release_job(job_id)
+            raise
+        except asyncio.TimeoutError:
+            await fail_job(job_id, attempts, f"Timed out after {JOB_VISIBILITY_TIMEOUT}s")
+        except Exception as e:
+            await fail_job(job_id, attempts, repr(e))
@@ -3,18 +3,31 @@ import asyncio
 from datetime import datetime, timedelta, timezone
 import time
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import logging
 import json
 
 import httpx
 
-from src.sync_engine import create_pipedrive_activity, handle_activity_update_webhook, map_nethunt_person_fields_to_pipedrive, map_nethunt_to_pipedrive_activity, map_nethunt_to_pipedrive_activity_no_deal, update_pipedrive_activity
-from src.sync_deals_to_services_engine import does_activity_exist, fetch_deal_ids_from_record_links, get_pipedrive_activity_by_subject, handle_deals_webhook
+from src.sync_engine import create_pipedrive_activity, handle_activity_update_webhook, map_nethunt_person_fields_to_pipedrive, map_nethunt_to_pipedrive_activity, map_nethunt_to_pipedrive_activity_no_deal, update_pipedrive_activity, TASK_SOURCE_FIELDS
+from src.sync_deals_to_services_engine import fetch_deal_ids_from_record_links, record_link_cache, resolve_record_link, get_pipedrive_activity_by_subject, handle_deals_webhook
 from src.clients.nethunt import nethunt_client
-from src.state import get_last_poll, set_last_poll, get_last_comment_poll, set_last_comment_poll, is_comment_synced, mark_comment_synced
+from src.clients.pipedrive import pipedrive_client
+from src.state import db as state_db, get_task_by_activity, snapshot_delta, get_snapshot, put_snapshot, get_last_poll, get_last_comment_poll, is_comment_synced, mark_comment_synced, get_watermark, set_watermark, is_stream_item_processed, mark_stream_item_processed, prune_stream_items, get_activity_by_task, link_activity_to_task, put_deal_mappings, get_pd_ids_by_records, index_comment, index_comments, comment_content_hash
 from src.update_pipedrive_data import map_nethunt_fields_to_pipedrive, update_pipedrive_deal
+from src.deal_mapping import mapping_rows_for_records, warm_deal_mappings
+from src.field_mapping import RECORD_SOURCE_FIELDS
+from src.comment_index import comment_exists, warm_comment_index
+from src.stage_mapping import keep_stage_index_fresh
+from src.field_metadata import keep_field_metadata_fresh
+from src.folder_schema import keep_folder_schemas_fresh
+from src.pipedrive_poller import poll_pipedrive, mark_webhook_seen
+from src.cache import TTLCache
+from src.job_queue import db as job_queue_db, enqueue, enqueue_coalesced, run_worker, queue_depth, dead_letter_depth
+from src.metrics import WEBHOOK_LATENCY, WEBHOOK_REQUESTS, POLL_CYCLE_DURATION, POLL_RECORDS, JOB_QUEUE_DEPTH, DEAD_LETTER_DEPTH, register_cache, register_collector, render_metrics
+from src.echo import record_write, is_own_write, is_nethunt_echo
+from src.config import require_credentials, NOTE_SYNC_CONCURRENCY, DEAL_NOTE_CACHE_SIZE, DEAL_NOTE_CACHE_TTL, POLL_RECORD_CONCURRENCY, WATERMARK_OVERLAP_SECONDS, WATERMARK_INITIAL_LOOKBACK, JOB_WORKERS
 from src.create_activity import fetch_nethunt_record_id_by_deal_id_for_teams, fetch_pipedrive_activity_by_id, process_created_activity, fetch_nethunt_record_id_by_deal_id
 
 import os
@@ -32,7 +45,6 @@ logging.basicConfig(
 )
 
 
-PIPEDRIVE_API_TOKEN = os.getenv("PIPEDRIVE_API_TOKEN") 
 NETHUNT_TEAM_FOLDER_ID = "67e2c9a38fe9ca14e35144d2" 
 NETHUNT_SERVICES_FOLDER_ID = "67e17578cc9bea52af34a26f" 
 NETHUNT_TASKS_FOLDER_ID = "67e17578cc9bea52af34a271" 
@@ -46,89 +58,356 @@ from datetime import datetime, timezone, timedelta
 
 
 async def create_pipedrive_note(deal_id: int, content: str):
-    url = f"https://api.pipedrive.com/v1/notes"
-    headers = {
-        "x-api-token": PIPEDRIVE_API_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "deal_id": deal_id,
-        "content": content
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+    result = await pipedrive_client.create_note(deal_id, content)
+    await record_write("pipedrive_note", deal_id, {"content": content})
+    return result
 
 async def get_pipedrive_notes_for_deal(deal_id: int):
-    url = f"https://api.pipedrive.com/v1/notes"
-    headers = {
-        "x-api-token": PIPEDRIVE_API_TOKEN,
-        "Accept": "application/json"
-    }
-    params = {"deal_id": deal_id}
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        return response.json().get("data", [])
-
-async def sync_nethunt_comments_to_pipedrive_notes(folder_ids, _):
-    last_comment_poll = get_last_comment_poll()
-    print(f"[DEBUG] sync_nethunt_comments_to_pipedrive_notes called with folder_ids={folder_ids} and last_comment_poll={last_comment_poll}")
-    latest_created_at = None
-    for folder_id in folder_ids:
-        recent_comments = await nethunt_client.get_recent_comments(folder_id, since=last_comment_poll, limit=10)
-        print(f"[DEBUG] Fetched {len(recent_comments)} recent comments from NetHunt folder {folder_id}")
-        for comment in recent_comments:
+    return await pipedrive_client.get_notes(deal_id)
+
+# deal_id -> set of note content hashes already present in Pipedrive
+deal_note_hash_cache = TTLCache(maxsize=DEAL_NOTE_CACHE_SIZE, ttl=DEAL_NOTE_CACHE_TTL)
+register_cache("deal_note_hash", deal_note_hash_cache)
+register_cache("record_link", record_link_cache)
+
+
+def to_iso8601(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+async def _stream_window(folder_id: str, stream: str):
+    """Return (watermark, since) for one (folder, stream); since reaches back by the overlap window."""
+    watermark = await get_watermark(folder_id, stream)
+    if not watermark:
+        # Seed from the old global markers so an upgrade doesn't re-scan or skip anything
+        watermark = await get_last_comment_poll() if stream == "comments" else await get_last_poll()
+        try:
+            parse_iso8601(watermark)
+        except Exception:
+            watermark = to_iso8601(datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_INITIAL_LOOKBACK))
+        await set_watermark(folder_id, stream, watermark)
+    watermark_dt = parse_iso8601(watermark)
+    since = to_iso8601(watermark_dt - timedelta(seconds=WATERMARK_OVERLAP_SECONDS))
+    return watermark, since
+
+
+async def _advance_watermark(folder_id: str, stream: str, watermark: str, latest: str, failed: list):
+    # Hold the watermark at the oldest failure so it is fetched again next cycle;
+    # everything handled around it is skipped through the processed set
+    target = min(failed, key=parse_iso8601) if failed else latest
+    if not target or parse_iso8601(target) <= parse_iso8601(watermark):
+        return
+    await set_watermark(folder_id, stream, target)
+    await prune_stream_items(folder_id, stream, to_iso8601(parse_iso8601(target) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)))
+
+
+async def resolve_comment_deal_ids(folder_id: str, record_ids: set):
+    """Map each distinct commented record to its Pipedrive deal id, hitting NetHunt only for unknown records.
+
+    Returns (deal_ids, failed_record_ids); failed records could not be looked up and should be retried.
+    """
+    deal_ids = await get_pd_ids_by_records(record_ids)
+    failed_record_ids = set()
+    for record_id in record_ids - deal_ids.keys():
+        cached = record_link_cache.get(record_id)
+        if cached and cached[0]:
+            deal_ids[record_id] = cached[0]
+    unresolved = [record_id for record_id in record_ids if record_id not in deal_ids]
+    results = await asyncio.gather(
+        *(resolve_record_link(record_id, folder_id) for record_id in unresolved),
+        return_exceptions=True
+    )
+    for record_id, result in zip(unresolved, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Failed to resolve NetHunt record {record_id}: {result}")
+            failed_record_ids.add(record_id)
+        elif result[0]:
+            deal_ids[record_id] = result[0]
+            if folder_id in (NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID):
+                await put_deal_mappings(mapping_rows_for_records(folder_id, [{"recordId": record_id, "fields": {"Pipedrive Record ID": result[0]}}]))
+    return deal_ids, failed_record_ids
+
+
+async def sync_comments_to_deal(deal_id, comments: list, semaphore: asyncio.Semaphore) -> list:
+    """Create notes for the deal's comments; returns the createdAt of comments that failed."""
+    failed = []
+    async with semaphore:
+        note_hashes = deal_note_hash_cache.get(deal_id)
+        if note_hashes is None:
+            try:
+                existing_notes = await get_pipedrive_notes_for_deal(deal_id)
+            except Exception as e:
+                logging.error(f"Failed to fetch Pipedrive notes for deal {deal_id}: {e}")
+                return [comment.get("createdAt") for comment in comments]
+            note_hashes = {comment_content_hash(note.get("content")) for note in existing_notes}
+            deal_note_hash_cache.set(deal_id, note_hashes)
+        for comment in comments:
             comment_id = comment.get("commentId")
             record_id = comment.get("recordId")
             comment_text = comment.get("text")
-            created_at = comment.get("createdAt")
-            if not comment_id or not record_id or not comment_text:
-                print(f"Skipping comment with missing commentId, recordId or text: {comment}")
-                continue
-            if is_comment_synced(comment_id):
-                print(f"Comment {comment_id} already synced, skipping.")
-                continue
-            # Fetch the record to get the Pipedrive deal id
-            records = await nethunt_client.get_recent_records(folder_id, since=last_comment_poll, limit=1, field_names=None)
-            record = next((r for r in records if r.get("recordId") == record_id), None)
-            if not record:
-                print(f"No NetHunt record found for recordId {record_id}")
+            text_hash = comment_content_hash(comment_text)
+            try:
+                if text_hash in note_hashes:
+                    logging.info(f"Skipping duplicate note for deal {deal_id} (already exists in Pipedrive)")
+                else:
+                    await create_pipedrive_note(deal_id, comment_text)
+                    note_hashes.add(text_hash)
+                    logging.info(f"Created Pipedrive note for deal {deal_id} from NetHunt comment {comment_id}")
+                await mark_comment_synced(comment_id, comment.get("createdAt"), record_id)
+            except Exception as e:
+                logging.error(f"Failed to create Pipedrive note for deal {deal_id}: {e}")
+                failed.append(comment.get("createdAt"))
+    return failed
+
+
+async def _sync_comment_batch(folder_id: str, pending: list, semaphore: asyncio.Semaphore) -> list:
+    # Resolve every distinct record in the batch once, then sync notes per deal concurrently
+    deal_ids, failed_record_ids = await resolve_comment_deal_ids(folder_id, {c.get("recordId") for c in pending})
+    failed = [c.get("createdAt") for c in pending if c.get("recordId") in failed_record_ids]
+    comments_by_deal = {}
+    for comment in pending:
+        if comment.get("recordId") in failed_record_ids:
+            continue
+        pipedrive_deal_id = deal_ids.get(comment.get("recordId"))
+        if not pipedrive_deal_id:
+            logging.warning(f"[poll_nethunt] No Pipedrive deal ID on NetHunt record {comment.get('recordId')}, skipping its comment.")
+            continue
+        comments_by_deal.setdefault(pipedrive_deal_id, []).append(comment)
+    results = await asyncio.gather(*(
+        sync_comments_to_deal(deal_id, comments, semaphore)
+        for deal_id, comments in comments_by_deal.items()
+    ))
+    for deal_failed in results:
+        failed.extend(deal_failed)
+    return failed
+
+
+async def sync_folder_comments(folder_id: str):
+    """Sync one folder's new comments to Pipedrive notes and advance its comments watermark."""
+    watermark, since = await _stream_window(folder_id, "comments")
+    logging.debug(f"[poll_nethunt] Syncing comments for folder {folder_id} since={since} (watermark {watermark})")
+    latest_created_at = None
+    failed = []
+    semaphore = asyncio.Semaphore(NOTE_SYNC_CONCURRENCY)
+    pending = []
+    index_rows = []
+    async for comment in nethunt_client.iter_recent_comments(folder_id, since=since):
+        comment_id = comment.get("commentId")
+        record_id = comment.get("recordId")
+        comment_text = comment.get("text")
+        created_at = comment.get("createdAt")
+        if not comment_id or not record_id or not comment_text:
+            logging.warning(f"[poll_nethunt] Skipping comment with missing commentId, recordId or text: {comment}")
+            continue
+        latest_created_at = _newer_timestamp(latest_created_at, created_at, comment_id)
+        index_rows.append((record_id, comment_text, comment_id))
+        # Synced comments double as the id-based dedupe set for the overlap window
+        if await is_comment_synced(comment_id):
+            continue
+        if await is_own_write("nethunt_comment", record_id, {"text": comment_text}):
+            # Created by /webhook/notes from a Pipedrive note: nothing to send back
+            await mark_comment_synced(comment_id, created_at, record_id)
+            continue
+        pending.append(comment)
+        if len(pending) >= 100:
+            await index_comments(index_rows)
+            index_rows = []
+            failed.extend(await _sync_comment_batch(folder_id, pending, semaphore))
+            pending = []
+    await index_comments(index_rows)
+    if pending:
+        failed.extend(await _sync_comment_batch(folder_id, pending, semaphore))
+    await _advance_watermark(folder_id, "comments", watermark, latest_created_at, [f for f in failed if f])
+
+
+
+def _newer_timestamp(current, updated_at, record_id):
+    if not updated_at:
+        return current
+    try:
+        if not current or parse_iso8601(updated_at) > parse_iso8601(current):
+            return updated_at
+    except Exception as e:
+        logging.warning(f"[poll_nethunt] Invalid updatedAt in record {record_id}: {e}")
+    return current
+
+
+async def _run_bounded(semaphore: asyncio.Semaphore, handler, records):
+    """Run `handler` over an async stream of records, at most `semaphore` at a time."""
+    tasks = set()
+    try:
+        async for record in records:
+            # Waiting for a slot before pulling the next record keeps memory bounded
+            await semaphore.acquire()
+            task = asyncio.create_task(handler(record))
+            task.add_done_callback(lambda _: semaphore.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _write_changes(entity: str, entity_id, payload: dict, write) -> bool:
+    """Send only the keys that changed since our last successful write; the writers return None or raise on failure."""
+    delta = await snapshot_delta(entity, entity_id, payload)
+    if not delta:
+        logging.info(f"[poll_nethunt] {entity} {entity_id} unchanged since last sync, skipping write.")
+        return True
+    if await write(entity_id, delta) is None:
+        return False
+    previous = await get_snapshot(entity, entity_id)
+    await put_snapshot(entity, entity_id, {**(previous[0] if previous else {}), **payload})
+    return True
+
+
+async def process_updated_task_record(record: dict) -> bool:
+    fields = record.get("fields", {})
+    name = fields.get("Name")
+    if not name:
+        return True
+    if await is_nethunt_echo(record, TASK_SOURCE_FIELDS):
+        logging.info(f"Task {record.get('recordId')} update is an echo of our own write, skipping.")
+        return True
+    try:
+        task_record_id = record.get("recordId")
+        activity_id = await get_activity_by_task(task_record_id) if task_record_id else None
+        if not activity_id:
+            # Unlinked legacy task: fall back to matching by subject
+            existing_activity = await get_pipedrive_activity_by_subject(name)
+            if not existing_activity:
+                return True
+            activity_id = existing_activity["id"]
+            if task_record_id:
+                await link_activity_to_task(activity_id, task_record_id)
+        payload = map_nethunt_to_pipedrive_activity_no_deal(record)
+        return await _write_changes("pipedrive_activity", activity_id, payload, update_pipedrive_activity)
+    except Exception as e:
+        logging.error(f"[poll_nethunt] Error updating activity for task record {record.get('id')}: {e}")
+        return False
+
+
+async def process_new_task_record(record: dict) -> bool:
+    name = record.get("fields", {}).get("Name")
+    if not name:
+        return True
+
+    # Check for existing activity: local link first, subject search only for unlinked tasks
+    task_record_id = record.get("recordId")
+    if task_record_id and await get_activity_by_task(task_record_id):
+        logging.info(f"Task {task_record_id} is already linked to a Pipedrive activity. Skipping.")
+        return True
+    try:
+        existing_activity = await get_pipedrive_activity_by_subject(name)
+        if existing_activity:
+            logging.info(f"Activity '{name}' already exists. Skipping.")
+            if task_record_id:
+                await link_activity_to_task(existing_activity["id"], task_record_id)
+            return True
+        record_links = record.get("fields", {}).get("Record links", [])
+        deal_ids, person_ids = await fetch_deal_ids_from_record_links(record_links)
+        activity_payload = map_nethunt_to_pipedrive_activity(record, deal_ids, person_ids)
+        return await create_pipedrive_activity(activity_payload, task_record_id=task_record_id) is not None
+    except Exception as e:
+        logging.error(f"[poll_nethunt] Error processing task record {record.get('id')}: {e}")
+        return False
+
+
+async def process_folder_record(record: dict) -> bool:
+    if await is_nethunt_echo(record, RECORD_SOURCE_FIELDS):
+        logging.info(f"Record {record.get('recordId')} update is an echo of our own write, skipping.")
+        return True
+    fields = record.get("fields", {})
+    logging.info(f"Fields received from NetHunt: {list(fields.keys())}")
+    pipedrive_id = fields.get("Pipedrive Record ID")
+    person_id = fields.get("Pipedrive Person ID")
+    logging.info(f"Extracted pipedrive_id: {pipedrive_id}, person_id: {person_id}")
+    try:
+        if person_id:
+            person_payload = map_nethunt_person_fields_to_pipedrive(record)
+            if not await _write_changes("pipedrive_person", person_id, person_payload, update_pipedrive_person_v2):
+                return False
+        if pipedrive_id:
+            payload = map_nethunt_fields_to_pipedrive(fields)
+            return await _write_changes("pipedrive_deal", pipedrive_id, payload, update_pipedrive_deal)
+        return True
+    except Exception as e:
+        logging.error(f"[poll_nethunt] Error syncing record {record.get('recordId')} to Pipedrive: {e}")
+        return False
+
+
+async def poll_stream(folder_id: str, stream: str, iter_records, handler, cursor_field: str, semaphore: asyncio.Semaphore) -> int:
+    """Process one (folder, stream) delta and advance its watermark past what was handled."""
+    watermark, since = await _stream_window(folder_id, stream)
+    logging.info(f"[poll_nethunt] Fetching {stream} records from folder {folder_id} with since={since}")
+    latest = None
+    failed = []
+    processed = 0
+
+    async def pending():
+        nonlocal latest
+        async for record in iter_records(folder_id, since=since):
+            item_id = record.get("recordId") or record.get("id")
+            stamp = record.get(cursor_field)
+            latest = _newer_timestamp(latest, stamp, item_id)
+            if await is_stream_item_processed(folder_id, stream, item_id, stamp):
                 continue
-            fields = record.get("fields", {})
-            pipedrive_deal_id = fields.get("Pipedrive Record ID")
-            if pipedrive_deal_id:
-                try:
-                    # Check if note already exists in Pipedrive for this deal
-                    existing_notes = await get_pipedrive_notes_for_deal(pipedrive_deal_id)
-                    if any(note.get("content") == comment_text for note in existing_notes):
-                        print(f"Note already exists in Pipedrive for deal {pipedrive_deal_id}, skipping creation.")
-                        logging.info(f"Skipping duplicate note for deal {pipedrive_deal_id} (already exists in Pipedrive)")
-                        mark_comment_synced(comment_id, created_at, record_id)
-                        continue
-                    await create_pipedrive_note(pipedrive_deal_id, comment_text)
-                    logging.info(f"Created Pipedrive note for deal {pipedrive_deal_id} from NetHunt comment {comment_id}")
-                    mark_comment_synced(comment_id, created_at, record_id)
-                except Exception as e:
-                    print(f"Failed to create Pipedrive note for deal {pipedrive_deal_id}: {e}")
-                    logging.error(f"Failed to create Pipedrive note for deal {pipedrive_deal_id}: {e}")
-            else:
-                print(f"No Pipedrive deal ID found in NetHunt record fields for recordId {record_id}")
-            # Track the latest createdAt
-            if created_at:
-                if not latest_created_at or created_at > latest_created_at:
-                    latest_created_at = created_at
-    # After processing all comments, update the last comment poll time
-    if latest_created_at:
-        from datetime import datetime, timedelta
-        import dateutil.parser
-        dt = dateutil.parser.isoparse(latest_created_at) + timedelta(seconds=2)
-        # Format as ISO8601 with milliseconds and Z
-        corrected = dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        set_last_comment_poll(corrected)
-        print(f"[DEBUG] Updated last_nethunt_comment_poll to {corrected}")
+            yield record
+
+    async def handle(record):
+        nonlocal processed
+        stamp = record.get(cursor_field)
+        if await handler(record):
+            processed += 1
+            await mark_stream_item_processed(folder_id, stream, record.get("recordId") or record.get("id"), stamp)
+        elif stamp:
+            failed.append(stamp)
+
+    await _run_bounded(semaphore, handle, pending())
+    POLL_RECORDS.inc(processed, folder=folder_id, stream=stream, outcome="processed")
+    POLL_RECORDS.inc(len(failed), folder=folder_id, stream=stream, outcome="failed")
+    await _advance_watermark(folder_id, stream, watermark, latest, failed)
+    logging.info(f"[poll_nethunt] Processed {processed} {stream} records from folder {folder_id} ({len(failed)} failed)")
+    return processed
+
+
+async def poll_tasks_folder(semaphore: asyncio.Semaphore):
+    await asyncio.gather(
+        poll_stream(NETHUNT_TASKS_FOLDER_ID, "updated", nethunt_client.iter_recent_records, process_updated_task_record, "updatedAt", semaphore),
+        poll_stream(NETHUNT_TASKS_FOLDER_ID, "new", nethunt_client.iter_freshly_created_records, process_new_task_record, "createdAt", semaphore),
+    )
+
+
+async def poll_records_folder(folder_id: str, semaphore: asyncio.Semaphore):
+    mapping_rows = []
+
+    async def records(folder_id, since):
+        async for record in nethunt_client.iter_recent_records(folder_id, since=since):
+            mapping_rows.extend(mapping_rows_for_records(folder_id, [record]))
+            if len(mapping_rows) >= 100:
+                await put_deal_mappings(mapping_rows)
+                mapping_rows.clear()
+            yield record
+
+    try:
+        await poll_stream(folder_id, "updated", records, process_folder_record, "updatedAt", semaphore)
+    finally:
+        await put_deal_mappings(mapping_rows)
+
+
+async def _supervised(name: str, coro):
+    """Run one folder's poll in isolation; returns (succeeded, result)."""
+    started = time.monotonic()
+    try:
+        result = await coro
+        logging.info(f"[poll_nethunt] {name} finished in {time.monotonic() - started:.2f}s")
+        return True, result
+    except httpx.HTTPStatusError as e:
+        logging.error(f"[poll_nethunt] HTTP error in {name}: {e.response.status_code} - {e.response.text}")
+    except Exception as e:
+        logging.error(f"[poll_nethunt] Unexpected error in {name}: {e}")
+    return False, None
+
 
 async def poll_nethunt(interval_seconds=265):
     folder_ids = [
@@ -139,142 +418,96 @@ async def poll_nethunt(interval_seconds=265):
 
 
     while True:
+        started = time.monotonic()
         try:
-            last_poll = get_last_poll()
-            logging.info(f"[poll_nethunt] Polling NetHunt with since={last_poll}")
-            latest_updated_at = None
-            
-            await sync_nethunt_comments_to_pipedrive_notes(folder_ids, last_poll)
-            for folder_id in folder_ids:
-                params = {
-                    "folder_id": folder_id,
-                    "since": last_poll,
-                    "limit": 100
-                }
-
-                if folder_id == NETHUNT_TASKS_FOLDER_ID:
-                    five_min_ago = datetime.now(timezone.utc) - timedelta(minutes=5)
-                    since_iso = five_min_ago.strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-3] + "Z"
-                    params["since"] = since_iso
-                    logging.info(f"[poll_nethunt] Fetching TASK records with since={since_iso}")
-                    
-                    updated_records = await nethunt_client.get_recent_records(
-                        folder_id=NETHUNT_TASKS_FOLDER_ID,
-                        since=since_iso,
-                        limit=100
-                    )
-                    if updated_records:
-                        logging.info(f"[poll_nethunt] Got {len(updated_records)} updated task records")
-                        for record in updated_records:
-                            fields = record.get("fields", {})
-                            name = fields.get("Name")
-                            if not name:
-                                continue
-                            try:
-                                existing_activity = await get_pipedrive_activity_by_subject(name, PIPEDRIVE_API_TOKEN)
-                                if not existing_activity:
-                                    continue
-                                payload = map_nethunt_to_pipedrive_activity_no_deal(record)
-                                await update_pipedrive_activity(existing_activity["id"], payload)
-                            except Exception as e:
-                                logging.error(f"[poll_nethunt] Error updating activity for task record {record.get('id')}: {e}")
-                    recent_records = await nethunt_client.get_freshly_created_records(**params)
-                    if recent_records:
-                        logging.info(f"[poll_nethunt] Got {len(recent_records)} new task records")
-                        recent_records.sort(key=lambda r: r.get("createdAt") or "")
-                        for record in recent_records:
-                            name = record.get("fields", {}).get("Name")
-                            if not name:
-                                continue
-
-                            # Check for existing activity
-                            if await does_activity_exist(name, PIPEDRIVE_API_TOKEN):
-                                logging.info(f"Activity '{name}' already exists. Skipping.")
-                                continue
-                            try:
-                                record_links = record.get("fields", {}).get("Record links", [])
-                                deal_ids, person_ids = await fetch_deal_ids_from_record_links(record_links)
-                                activity_payload = map_nethunt_to_pipedrive_activity(record, deal_ids, person_ids)
-                                await create_pipedrive_activity(activity_payload)
-                            except Exception as e:
-                                logging.error(f"[poll_nethunt] Error processing task record {record.get('id')}: {e}")
-                            updated_at = record.get("updatedAt") or record.get("createdAt")
-                            if updated_at:
-                                try:
-                                    updated_dt = parse_iso8601(updated_at)
-                                    if not latest_updated_at or updated_dt > parse_iso8601(latest_updated_at):
-                                        latest_updated_at = updated_at
-                                except Exception as e:
-                                    logging.warning(f"[poll_nethunt] Invalid updatedAt in task record {record.get('id')}: {e}")
-                else:
-                    recent_records = await nethunt_client.get_recent_records(
-                        folder_id=folder_id,
-                        since=params["since"],
-                        limit=params["limit"]
-                    )
-                    print(f"recent_records: {recent_records}")
-                    logging.info(f"[poll_nethunt] Got {len(recent_records)} records from folder {folder_id}")
-                    for record in recent_records:
-                        fields = record.get("fields", {})
-                        logging.info(f"Fields received from NetHunt: {list(fields.keys())}")
-                        pipedrive_id = fields.get("Pipedrive Record ID")
-                        person_id = fields.get("Pipedrive Person ID")
-                        logging.info(f"Extracted pipedrive_id: {pipedrive_id}, person_id: {person_id}")
-                        if person_id:
-                            person_payload = map_nethunt_person_fields_to_pipedrive(record)
-                            await update_pipedrive_person_v2(person_id, person_payload, PIPEDRIVE_API_TOKEN)
-                        if pipedrive_id:
-                            payload = map_nethunt_fields_to_pipedrive(fields)
-                            await update_pipedrive_deal(pipedrive_id, payload)
-                        updated_at = record.get("updatedAt") or record.get("createdAt")
-                        if updated_at:
-                            try:
-                                updated_dt = parse_iso8601(updated_at)
-                                if not latest_updated_at or updated_dt > parse_iso8601(latest_updated_at):
-                                    latest_updated_at = updated_at
-                            except Exception as e:
-                                logging.warning(f"[poll_nethunt] Invalid updatedAt in record {record.get('id')}: {e}")
-
-            if latest_updated_at:
-                try:
-                    latest_dt = parse_iso8601(latest_updated_at)
-                    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-                    if latest_dt < one_hour_ago:
-                        corrected = one_hour_ago.strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-3] + "Z"
-                        logging.info(f"latest_updated_at too old ({latest_updated_at}), using {corrected}")
-                    else:
-                        corrected = latest_updated_at
-                        logging.info(f"Updating last poll time to {corrected}")
-                    set_last_poll(corrected)
-                except Exception as e:
-                    logging.error(f"Failed to save last poll timestamp: {e}")
-            else:
-                logging.info("No updatedAt found — skipping last_poll update.")
-
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error: {e.response.status_code} - {e.response.text}")
+            # Shared bound on concurrent Pipedrive writes across all folders
+            semaphore = asyncio.Semaphore(POLL_RECORD_CONCURRENCY)
+
+            # Each folder stream runs as its own supervised task with its own watermark,
+            # so one failure neither aborts nor holds back the others
+            await asyncio.gather(
+                *(_supervised(f"comments {folder_id}", sync_folder_comments(folder_id)) for folder_id in folder_ids),
+                _supervised(f"folder {NETHUNT_TEAM_FOLDER_ID}", poll_records_folder(NETHUNT_TEAM_FOLDER_ID, semaphore)),
+                _supervised(f"folder {NETHUNT_SERVICES_FOLDER_ID}", poll_records_folder(NETHUNT_SERVICES_FOLDER_ID, semaphore)),
+                _supervised(f"folder {NETHUNT_TASKS_FOLDER_ID}", poll_tasks_folder(semaphore)),
+            )
         except Exception as e:
             logging.error(f"Unexpected error in poll_nethunt: {e}")
         finally:
+            POLL_CYCLE_DURATION.observe(time.monotonic() - started, poller="nethunt")
             await asyncio.sleep(interval_seconds)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    require_credentials()
+    # Open the shared Pipedrive and NetHunt connection pools before anything can use them
+    await pipedrive_client.open()
+    await nethunt_client.open()
+    # Pipeline-scoped stage index: disk cache now, Pipedrive refresh in the background
+    app.state.stage_index_task = asyncio.create_task(keep_stage_index_fresh())
+    app.state.field_metadata_task = asyncio.create_task(keep_field_metadata_fresh())
+    app.state.folder_schema_task = asyncio.create_task(keep_folder_schemas_fresh())
+    # Fill the deal <-> record mapping in the background so webhooks can resolve records locally
+    app.state.mapping_task = asyncio.create_task(warm_deal_mappings())
+    # One-time backfill of the comment index used by /webhook/notes duplicate detection
+    app.state.comment_index_task = asyncio.create_task(warm_comment_index())
     # Start NetHunt poller every 15s
     app.state.nh_task = asyncio.create_task(poll_nethunt(65))
+    # Pipedrive changes the webhooks missed, from /v1/recents
+    app.state.pd_task = asyncio.create_task(poll_pipedrive())
+    # Webhook workers drain the durable job queue
+    app.state.job_workers = [asyncio.create_task(run_worker(JOB_HANDLERS, worker_id)) for worker_id in range(JOB_WORKERS)]
     yield
     # Cleanup on shutdown
-    if hasattr(app.state, "nh_task"):
-        app.state.nh_task.cancel()
-        try:
-            await app.state.nh_task
-        except asyncio.CancelledError:
-            pass
+    tasks = [getattr(app.state, task_name, None) for task_name in ("nh_task", "pd_task", "mapping_task", "comment_index_task", "stage_index_task", "field_metadata_task", "folder_schema_task")]
+    for task in tasks + app.state.job_workers:
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    await pipedrive_client.aclose()
+    await nethunt_client.aclose()
+    # Commit whatever write group is still open
+    await state_db.close()
+    await job_queue_db.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
+@app.middleware("http")
+async def webhook_metrics(request: Request, call_next):
+    if not request.url.path.startswith("/webhook"):
+        return await call_next(request)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so ids in the path can't blow up the series count
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        WEBHOOK_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+        WEBHOOK_REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+async def _collect_queue_depths():
+    JOB_QUEUE_DEPTH.set(await queue_depth())
+    DEAD_LETTER_DEPTH.set(await dead_letter_depth())
+
+
+register_collector(_collect_queue_depths)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(await render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def read_root():
     return {"message": "Hello from FastAPI"}
@@ -293,13 +526,30 @@ async def pd_webhook(req: Request):
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+def _queued(job_id: int):
+    return JSONResponse(status_code=202, content={"status": "queued", "job_id": job_id})
+
+
+def _entity_id(body: dict):
+    return (body.get("data") or {}).get("id") or (body.get("meta") or {}).get("entity_id")
+
+
+async def _enqueue_update(kind: str, entity: str, body: dict) -> int:
+    # Bursts of updates for one entity collapse into a single job carrying the latest state
+    entity_id = _entity_id(body)
+    if not entity_id:
+        return await enqueue(kind, body)
+    job_id = await enqueue_coalesced(kind, f"{entity}:{entity_id}", body)
+    await mark_webhook_seen(entity, body)
+    return job_id
+
+
 @app.post("/webhook/activity")
 async def activity_update_webhook(req: Request):
     try:
         body = await req.json()
         logging.debug(f"Received activity webhook payload: {body}")
-        await handle_activity_update_webhook(body)
-        return {"status": "ok"}
+        return _queued(await _enqueue_update("activity_updated", "activity", body))
     except Exception as e:
         logging.error(f"Error in /webhook/activity: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -314,14 +564,10 @@ async def activity_created_webhook(req: Request):
         if not activity_data:
             logging.warning("No 'data' field in activity.created webhook.")
             return JSONResponse(status_code=400, content={"error": "'data' field missing"})
-        
-        
-        activity_id = activity_data.get("id")
-        the_updated_data = await fetch_pipedrive_activity_by_id(activity_id)
-        print(f"Fetched updated activity data first time created: {the_updated_data}")
-        await process_created_activity(the_updated_data["data"])
 
-        return {"status": "ok"}
+        job_id = await enqueue("activity_created", body)
+        await mark_webhook_seen("activity", body)
+        return _queued(job_id)
 
     except Exception as e:
         logging.error(f"Error in /webhook/activity/created: {e}")
@@ -332,8 +578,7 @@ async def deals_webhook(req: Request):
     try:
         body = await req.json()
         logging.debug(f"Received deals webhook payload: {body}")
-        await handle_deals_webhook(body)
-        return {"status": "ok"}
+        return _queued(await _enqueue_update("deal_updated", "deal", body))
     except Exception as e:
         logging.error(f"Error in /webhook/deals: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -344,50 +589,68 @@ async def webhook_notes(req: Request):
         body = await req.json()
         logging.info(f"Received notes webhook payload: {body}")
         data = body.get("data", {})
-        note_text = data.get("content")
-        deal_id = data.get("deal_id")
-        if not deal_id or not note_text:
+        if not data.get("deal_id") or not data.get("content"):
             return JSONResponse(status_code=400, content={"error": "'deal_id' and 'content' are required in 'data'"})
-        record_id = await fetch_nethunt_record_id_by_deal_id(deal_id)
-        teams_record_id = await fetch_nethunt_record_id_by_deal_id_for_teams(deal_id)
-        if not record_id:
-            return JSONResponse(status_code=404, content={"error": f"No NetHunt record found for deal_id {deal_id}"})
-        # Check for duplicate comment in NetHunt before creating
-        record_comments = await get_nethunt_record_comments(record_id)
-        if any(c.get("text") == note_text for c in record_comments):
-            logging.info(f"Comment already exists in NetHunt record {record_id}, skipping creation.")
-            return {"status": "skipped", "reason": "duplicate comment in NetHunt"}
-        result = await nethunt_client.create_comment(record_id, note_text)
-        # Also check and create for teams_record_id if needed
-        if teams_record_id:
-            team_comments = await get_nethunt_record_comments(teams_record_id)
-            if not any(c.get("text") == note_text for c in team_comments):
-                await nethunt_client.create_comment(teams_record_id, note_text)
-        return result
+        job_id = await enqueue("note_created", body)
+        await mark_webhook_seen("note", body)
+        return _queued(job_id)
     except Exception as e:
         logging.error(f"Error in /webhook/notes: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-async def update_pipedrive_person_v2(person_id: int, payload: dict, api_token: str) -> dict:
+
+async def handle_activity_created_job(body: dict):
+    activity_id = body["data"].get("id")
+    # Activities we created from NetHunt tasks are linked already: skip before fetching
+    if activity_id and await get_task_by_activity(activity_id):
+        logging.info(f"Activity {activity_id} is already linked to a NetHunt task, skipping.")
+        return
+    the_updated_data = await fetch_pipedrive_activity_by_id(activity_id)
+    print(f"Fetched updated activity data first time created: {the_updated_data}")
+    if not the_updated_data or not the_updated_data.get("data"):
+        logging.warning(f"Activity {activity_id} no longer exists in Pipedrive, skipping.")
+        return
+    await process_created_activity(the_updated_data["data"])
+
+
+async def handle_note_webhook(body: dict):
+    data = body.get("data", {})
+    note_text = data.get("content")
+    deal_id = data.get("deal_id")
+    if await is_own_write("pipedrive_note", deal_id, {"content": note_text}):
+        logging.info(f"Note on deal {deal_id} was created from a NetHunt comment, skipping.")
+        return
+    record_id = await fetch_nethunt_record_id_by_deal_id(deal_id)
+    teams_record_id = await fetch_nethunt_record_id_by_deal_id_for_teams(deal_id)
+    if not record_id:
+        logging.warning(f"No NetHunt record found for deal_id {deal_id}, dropping note.")
+        return
+    # Check for duplicate comment in NetHunt before creating (local index lookup)
+    if await comment_exists(record_id, note_text):
+        logging.info(f"Comment already exists in NetHunt record {record_id}, skipping creation.")
+    else:
+        result = await nethunt_client.create_comment(record_id, note_text)
+        await record_write("nethunt_comment", record_id, {"text": note_text})
+        await index_comment(record_id, note_text, result.get("commentId") if isinstance(result, dict) else None)
+    # Also check and create for teams_record_id if needed
+    if teams_record_id and not await comment_exists(teams_record_id, note_text):
+        team_result = await nethunt_client.create_comment(teams_record_id, note_text)
+        await record_write("nethunt_comment", teams_record_id, {"text": note_text})
+        await index_comment(teams_record_id, note_text, team_result.get("commentId") if isinstance(team_result, dict) else None)
+
+
+# Queue job kind -> handler, drained by the workers started in lifespan
+JOB_HANDLERS = {
+    "activity_updated": handle_activity_update_webhook,
+    "activity_created": handle_activity_created_job,
+    "deal_updated": handle_deals_webhook,
+    "note_created": handle_note_webhook,
+}
+
+async def update_pipedrive_person_v2(person_id: int, payload: dict) -> dict:
     """
     Sends a PATCH request to Pipedrive v2 /api/v2/persons/{id} to update a person.
     """
-    url = f"https://api.pipedrive.com/api/v2/persons/{person_id}"
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    params = {"api_token": api_token}
-    async with httpx.AsyncClient() as client:
-        response = await client.patch(url, headers=headers, params=params, json=payload)
-        response.raise_for_status()
-        return response.json()
-
-async def get_nethunt_record_comments(record_id: str):
-    # Fetch all comments for a NetHunt record using the API
-    # GET /zapier/triggers/new-comment/{folderId}?since=1970-01-01T00:00:00.000Z&limit=1000
-    all_comments = []
-    for folder_id in [NETHUNT_TEAM_FOLDER_ID, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID]:
-        comments = await nethunt_client.get_recent_comments(folder_id, since="1970-01-01T00:00:00.000Z", limit=1000)
-        all_comments.extend([c for c in comments if c.get("recordId") == record_id])
-    return all_comments
\ No newline at end of file
+    result = await pipedrive_client.update_person(person_id, payload)
+    await record_write("pipedrive_person", person_id, payload)
+    return result
@@ -0,0 +1,174 @@
+# metrics.py
+# In-process metrics in the Prometheus text format, served from /metrics.
+# Values are per worker process, like the rest of the in-memory state.
+import logging
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+# Awaited before every scrape to refresh values that are read rather than counted
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()) -> str:
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. requests sent."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        # For counts kept elsewhere (e.g. TTLCache.hits) and copied in at scrape time
+        self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    """Point-in-time value, e.g. queue depth."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Per-bucket (non-cumulative) counts, the +Inf overflow last, then the sum
+            series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _samples(self):
+        for key, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), cumulative
+
+
+def register_collector(collect):
+    """Add an async callable that refreshes gauges right before each scrape."""
+    _collectors.append(collect)
+
+
+async def render_metrics() -> str:
+    for collect in _collectors:
+        try:
+            await collect()
+        except Exception as e:
+            logging.error(f"[metrics] Collector {collect.__name__} failed: {e}")
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Webhooks
+WEBHOOK_LATENCY = Histogram("sync_webhook_request_duration_seconds", "Time to answer a webhook request.", ["endpoint"])
+WEBHOOK_REQUESTS = Counter("sync_webhook_requests_total", "Webhook requests answered, by status code.", ["endpoint", "status"])
+
+# Upstream APIs
+UPSTREAM_LATENCY = Histogram("sync_upstream_request_duration_seconds", "Upstream API round trip time, excluding rate limiter waits.", ["upstream", "operation"])
+UPSTREAM_REQUESTS = Counter("sync_upstream_requests_total", "Upstream API requests sent, by status code (or exception name).", ["upstream", "operation", "status"])
+
+# Pollers
+POLL_CYCLE_DURATION = Histogram("sync_poll_cycle_duration_seconds", "Duration of one full poll cycle.", ["poller"], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+POLL_RECORDS = Counter("sync_poll_records_total", "Records handled by poll_nethunt, by folder, stream and outcome.", ["folder", "stream", "outcome"])
+POLL_JOBS = Counter("sync_poll_jobs_enqueued_total", "Jobs enqueued by poll_pipedrive for changes the webhooks missed.")
+
+# Queue and caches, refreshed by collectors at scrape time
+JOB_QUEUE_DEPTH = Gauge("sync_job_queue_depth", "Jobs waiting or running in the durable queue.")
+DEAD_LETTER_DEPTH = Gauge("sync_dead_letter_depth", "Jobs that exhausted their retries.")
+CACHE_HITS = Counter("sync_cache_hits_total", "Cache hits since start.", ["cache"])
+CACHE_MISSES = Counter("sync_cache_misses_total", "Cache misses since start.", ["cache"])
+CACHE_HIT_RATIO = Gauge("sync_cache_hit_ratio", "Cache hits / lookups since start.", ["cache"])
+CACHE_ENTRIES = Gauge("sync_cache_entries", "Entries currently held.", ["cache"])
+
+_caches = {}
+
+
+def register_cache(name: str, cache):
+    """Expose a TTLCache's hit/miss counts and size."""
+    _caches[name] = cache
+
+
+async def _collect_caches():
+    for name, cache in _caches.items():
+        lookups = cache.hits + cache.misses
+        CACHE_HITS.set_total(cache.hits, cache=name)
+        CACHE_MISSES.set_total(cache.misses, cache=name)
+        CACHE_HIT_RATIO.set(cache.hits / lookups if lookups else 0.0, cache=name)
+        CACHE_ENTRIES.set(len(cache), cache=name)
+
+
+register_collector(_collect_caches)
+
+
+async def track_upstream(upstream: str, operation: str, send):
+    """Await `send()` (an httpx request) and record its latency and status."""
+    started = time.perf_counter()
+    try:
+        response = await send()
+    except Exception as e:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream=upstream, operation=operation)
+        UPSTREAM_REQUESTS.inc(upstream=upstream, operation=operation, status=type(e).__name__)
+        raise
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream=upstream, operation=operation)
+    UPSTREAM_REQUESTS.inc(upstream=upstream, operation=operation, status=response.status_code)
+    return response
@@ -0,0 +1,180 @@
+# pipedrive_poller.py
+# Safety net for missed Pipedrive webhooks: pulls deals, persons, activities and notes
+# changed since a watermark from /v1/recents and enqueues them as the same jobs the
+# webhooks create. Items a webhook already delivered are skipped via the processed set.
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from src.clients.pipedrive import pipedrive_client
+from src.config import PIPEDRIVE_POLL_INTERVAL, PIPEDRIVE_POLL_PAGE_SIZE, WATERMARK_OVERLAP_SECONDS, WATERMARK_INITIAL_LOOKBACK
+from src.echo import is_pipedrive_poll_echo
+from src.field_mapping import SERVICES_FIELD_SOURCES, TEAM_FIELD_SOURCES, PERSON_SOURCE_FIELDS
+from src.job_queue import enqueue, enqueue_coalesced
+from src.metrics import POLL_CYCLE_DURATION, POLL_JOBS
+from src.state import get_watermark, set_watermark, is_stream_item_processed, mark_stream_item_processed, prune_stream_items, get_task_by_activity
+from src.sync_engine import ACTIVITY_SOURCE_FIELDS
+
+# processed_stream_items / watermark namespace; the stream is the Pipedrive item type
+SOURCE = "pipedrive"
+RECENT_ITEMS = ("deal", "person", "activity", "note")
+PIPEDRIVE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Write ledger entity per item type, for recognising our own writes
+LEDGER_ENTITIES = {"deal": "pipedrive_deal", "person": "pipedrive_person", "activity": "pipedrive_activity"}
+
+
+def echo_fields(item_type: str):
+    """Fields of a polled item that reach NetHunt; all must hold our written values for it to be an echo."""
+    if item_type == "deal":
+        # Read at call time: the field sources are rebuilt when the field metadata changes
+        return set(SERVICES_FIELD_SOURCES) | set(TEAM_FIELD_SOURCES)
+    if item_type == "person":
+        return PERSON_SOURCE_FIELDS
+    return ACTIVITY_SOURCE_FIELDS
+
+
+def pipedrive_stamp(value) -> str:
+    """Normalise a v1 ("YYYY-MM-DD HH:MM:SS") or v2 (ISO 8601) update time to the v1 form, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        logging.warning(f"[poll_pipedrive] Invalid update time {value}")
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime(PIPEDRIVE_TIME_FORMAT)
+
+
+async def mark_webhook_seen(item_type: str, body: dict):
+    """Remember a webhook-delivered change so the poller does not enqueue it a second time."""
+    data = body.get("data") or {}
+    entity_id = data.get("id") or (body.get("meta") or {}).get("entity_id")
+    stamp = pipedrive_stamp(data.get("update_time") or data.get("add_time"))
+    if entity_id and stamp:
+        await mark_stream_item_processed(SOURCE, item_type, entity_id, stamp)
+
+
+def _ref_id(value):
+    # v1 objects embed related entities ({"value": 5, "name": ...}); webhook payloads carry the bare id
+    if isinstance(value, dict):
+        return value.get("value", value.get("id"))
+    return value
+
+
+def _webhook_body(item_type: str, data: dict) -> dict:
+    """A webhook-shaped job payload for a polled item; no `previous`, so handlers sync every mapped field."""
+    data = dict(data)
+    for key in ("person_id", "org_id", "user_id"):
+        if key in data:
+            data[key] = _ref_id(data[key])
+    return {
+        "data": data,
+        "previous": {},
+        "meta": {"entity": item_type, "entity_id": data.get("id"), "action": "change", "change_source": "poll"},
+    }
+
+
+async def _enqueue_person_deals(person_id) -> int:
+    # Person fields reach NetHunt through the deal sync, so a person change resyncs their deals
+    enqueued = 0
+    start = 0
+    while start is not None:
+        deals, start = await pipedrive_client.get_person_deals(person_id, start=start)
+        for deal in deals:
+            await enqueue_coalesced("deal_updated", f"deal:{deal['id']}", _webhook_body("deal", deal))
+            enqueued += 1
+    return enqueued
+
+
+async def dispatch_change(item_type: str, data: dict) -> int:
+    """Enqueue the job a webhook for this change would have created; returns the number of jobs."""
+    entity_id = data.get("id")
+    if item_type == "deal":
+        await enqueue_coalesced("deal_updated", f"deal:{entity_id}", _webhook_body("deal", data))
+        return 1
+    if item_type == "activity":
+        if await get_task_by_activity(entity_id):
+            await enqueue_coalesced("activity_updated", f"activity:{entity_id}", _webhook_body("activity", data))
+        else:
+            await enqueue("activity_created", _webhook_body("activity", data))
+        return 1
+    if item_type == "note":
+        if not data.get("deal_id") or not data.get("content"):
+            return 0
+        await enqueue("note_created", _webhook_body("note", data))
+        return 1
+    if item_type == "person":
+        return await _enqueue_person_deals(entity_id)
+    return 0
+
+
+async def _poll_window():
+    """Return (watermark, since); since reaches back by the overlap window."""
+    watermark = await get_watermark(SOURCE, "recents")
+    if not watermark:
+        watermark = (datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_INITIAL_LOOKBACK)).strftime(PIPEDRIVE_TIME_FORMAT)
+        await set_watermark(SOURCE, "recents", watermark)
+    watermark_dt = datetime.strptime(watermark, PIPEDRIVE_TIME_FORMAT)
+    since = (watermark_dt - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)).strftime(PIPEDRIVE_TIME_FORMAT)
+    return watermark, since
+
+
+async def poll_pipedrive_changes() -> int:
+    """One catch-up pass over /v1/recents; returns the number of jobs enqueued."""
+    watermark, since = await _poll_window()
+    logging.info(f"[poll_pipedrive] Fetching Pipedrive changes since {since}")
+    latest = watermark
+    enqueued = 0
+    skipped = 0
+    try:
+        start = 0
+        while start is not None:
+            changes, start = await pipedrive_client.get_recents(since, ",".join(RECENT_ITEMS), start=start, limit=PIPEDRIVE_POLL_PAGE_SIZE)
+            # Oldest first: once an item is handled, the watermark may move up to it
+            for change in changes:
+                item_type = change.get("item")
+                data = change.get("data") or {}
+                entity_id = data.get("id") or change.get("id")
+                stamp = pipedrive_stamp(data.get("update_time") or data.get("add_time"))
+                if item_type not in RECENT_ITEMS or not entity_id or not stamp:
+                    continue
+                if await is_stream_item_processed(SOURCE, item_type, entity_id, stamp):
+                    skipped += 1
+                elif item_type in LEDGER_ENTITIES and await is_pipedrive_poll_echo(LEDGER_ENTITIES[item_type], entity_id, data, echo_fields(item_type)):
+                    logging.debug(f"[poll_pipedrive] {item_type} {entity_id} change is an echo of our own write, skipping.")
+                    skipped += 1
+                else:
+                    enqueued += await dispatch_change(item_type, data)
+                    await mark_stream_item_processed(SOURCE, item_type, entity_id, stamp)
+                latest = max(latest, stamp)
+    finally:
+        # Everything up to `latest` was handled, even if a later item failed
+        if latest > watermark:
+            await set_watermark(SOURCE, "recents", latest)
+            before = (datetime.strptime(latest, PIPEDRIVE_TIME_FORMAT) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)).strftime(PIPEDRIVE_TIME_FORMAT)
+            for item_type in RECENT_ITEMS:
+                await prune_stream_items(SOURCE, item_type, before)
+    POLL_JOBS.inc(enqueued)
+    logging.info(f"[poll_pipedrive] Enqueued {enqueued} jobs ({skipped} changes already delivered or our own)")
+    return enqueued
+
+
+async def poll_pipedrive(interval_seconds=PIPEDRIVE_POLL_INTERVAL):
+    while True:
+        started = time.monotonic()
+        try:
+            await poll_pipedrive_changes()
+            logging.info(f"[poll_pipedrive] Pass finished in {time.monotonic() - started:.2f}s")
+        except httpx.HTTPStatusError as e:
+            logging.error(f"[poll_pipedrive] HTTP error: {e.response.status_code} - {e.response.text}")
+        except Exception as e:
+            logging.error(f"[poll_pipedrive] Unexpected error: {e}")
+        finally:
+            POLL_CYCLE_DURATION.observe(time.monotonic() - started, poller="pipedrive")
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,335 @@
+# reconcile.py
+# Full resync of both systems after an outage or a mapping change:
+#
+#   python -m src.reconcile [--direction both|nethunt|pipedrive] [--dry-run] [--reset]
+#
+# Pipedrive deals, persons and activities are loaded page by page, then the NetHunt
+# services, team and tasks folders are streamed and every record is diffed against its
+# Pipedrive counterpart with the regular mapping functions. Only differing fields are
+# written. Progress through each folder is checkpointed in the state database, so an
+# interrupted run picks up where it stopped.
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from src.clients.nethunt import nethunt_client, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID, NETHUNT_TASKS_FOLDER_ID
+from src.clients.pipedrive import pipedrive_client
+from src.config import RECONCILE_CONCURRENCY, RECONCILE_BATCH_SIZE, RECONCILE_REPORT_INTERVAL, require_credentials
+from src.deal_mapping import EPOCH, mapping_rows_for_records
+from src.echo import record_write, same_value
+from src.field_mapping import map_deal_to_services, map_deal_to_team, map_record_to_deal, map_record_to_person
+from src.field_metadata import load_field_metadata
+from src.folder_schema import prepare_field_actions, refresh_folder_schemas
+from src.stage_mapping import get_stage_name, get_pipeline_name, load_stage_index_cache
+from src.state import db as state_db, get_state, set_states, get_activity_by_task, get_snapshot, put_snapshot, put_deal_mappings
+from src.sync_deals_to_services_engine import update_nethunt_record
+from src.sync_engine import extract_activity_data_for_nethunt, map_nethunt_to_pipedrive_activity_no_deal, update_pipedrive_activity
+from src.update_pipedrive_data import update_pipedrive_deal
+
+FOLDERS = {
+    "services": NETHUNT_SERVICES_FOLDER_ID,
+    "team": NETHUNT_TEAM_FOLDER_ID,
+    "tasks": NETHUNT_TASKS_FOLDER_ID,
+}
+
+RUN_KEY = "reconcile:run"
+
+
+def _checkpoint_key(folder_id: str) -> str:
+    return f"reconcile:folder:{folder_id}"
+
+
+def _epoch(stamp) -> float:
+    """Seconds since the epoch for NetHunt (ISO 8601) and Pipedrive ("YYYY-MM-DD HH:MM:SS", UTC) timestamps."""
+    if not stamp:
+        return 0.0
+    try:
+        parsed = datetime.fromisoformat(str(stamp).replace("Z", "+00:00"))
+    except ValueError:
+        logging.warning(f"[reconcile] Unparseable timestamp {stamp}")
+        return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+async def _load_all(fetch_page, label: str) -> dict:
+    """Every item of a paged Pipedrive listing, keyed by str(id)."""
+    items = {}
+    start = 0
+    while start is not None:
+        page, start = await fetch_page(start=start)
+        for item in page:
+            items[str(item["id"])] = item
+    logging.info(f"[reconcile] Loaded {len(items)} Pipedrive {label}")
+    return items
+
+
+def _deal_data(deal: dict) -> dict:
+    """A listed deal in the GET /deals/{id} shape the deal -> NetHunt mappings expect."""
+    related = {}
+    if deal.get("stage_id") is not None:
+        related["stage"] = {str(deal["stage_id"]): {"name": get_stage_name(deal["stage_id"]) or ""}}
+    if deal.get("pipeline_id") is not None:
+        related["pipeline"] = {str(deal["pipeline_id"]): {"name": get_pipeline_name(deal["pipeline_id"]) or ""}}
+    return {"data": deal, "related_objects": related}
+
+
+def _winner(ctx: dict, record: dict, pipedrive_item: dict) -> str:
+    """Which side's values are written to the other: the forced direction, else the newer side."""
+    if ctx["direction"] != "both":
+        return ctx["direction"]
+    if _epoch(record.get("updatedAt")) >= _epoch(pipedrive_item.get("update_time")):
+        return "nethunt"
+    return "pipedrive"
+
+
+async def _update_person(person_id, payload: dict):
+    try:
+        result = await pipedrive_client.update_person(person_id, payload)
+        await record_write("pipedrive_person", person_id, payload)
+        return result
+    except Exception as e:
+        logging.error(f"[reconcile] Failed to update person {person_id}: {e}")
+        return None
+
+
+async def _apply_to_pipedrive(ctx: dict, entity: str, entity_id, payload: dict, current: dict, write) -> bool:
+    delta = {key: value for key, value in payload.items() if not same_value(value, current.get(key))}
+    if not delta:
+        return True
+    ctx["stats"]["pipedrive_diffs"] += 1
+    if ctx["dry_run"]:
+        logging.info(f"[reconcile] Would update {entity} {entity_id}: {delta}")
+        return True
+    if await write(entity_id, delta) is None:
+        return False
+    # Keep the poller's snapshot in step so it does not resend what we just wrote
+    previous = await get_snapshot(entity, entity_id)
+    await put_snapshot(entity, entity_id, {**(previous[0] if previous else {}), **payload})
+    ctx["stats"]["pipedrive_writes"] += 1
+    return True
+
+
+async def _apply_to_nethunt(ctx: dict, record: dict, folder_id: str, field_actions: dict) -> bool:
+    fields = record.get("fields", {})
+    field_actions = prepare_field_actions(folder_id, field_actions)
+    delta = {name: action for name, action in field_actions.items() if not same_value((action or {}).get("add"), fields.get(name))}
+    if not delta:
+        return True
+    ctx["stats"]["nethunt_diffs"] += 1
+    if ctx["dry_run"]:
+        logging.info(f"[reconcile] Would update NetHunt record {record.get('recordId')}: {delta}")
+        return True
+    # Raises on HTTP errors; None means every differing field was pruned by the folder schema
+    if await update_nethunt_record(record.get("recordId"), delta, folder_id) is not None:
+        ctx["stats"]["nethunt_writes"] += 1
+    return True
+
+
+async def reconcile_deal_record(ctx: dict, folder_id: str, record: dict) -> bool:
+    """Services/team record <-> deal (and the services record's person)."""
+    fields = record.get("fields", {})
+    deal = ctx["deals"].get(str(fields.get("Pipedrive Record ID") or ""))
+    if deal is None:
+        ctx["stats"]["unmatched"] += 1
+        return True
+    ctx["stats"]["matched"] += 1
+    if _winner(ctx, record, deal) == "pipedrive":
+        map_deal = map_deal_to_team if folder_id == NETHUNT_TEAM_FOLDER_ID else map_deal_to_services
+        return await _apply_to_nethunt(ctx, record, folder_id, map_deal(_deal_data(deal)))
+    succeeded = await _apply_to_pipedrive(ctx, "pipedrive_deal", deal["id"], map_record_to_deal(fields), deal, update_pipedrive_deal)
+    person = ctx["persons"].get(str(fields.get("Pipedrive Person ID") or ""))
+    if person is not None:
+        succeeded = await _apply_to_pipedrive(ctx, "pipedrive_person", person["id"], map_record_to_person(fields), person, _update_person) and succeeded
+    return succeeded
+
+
+async def reconcile_task_record(ctx: dict, folder_id: str, record: dict) -> bool:
+    """Task record <-> the activity it is linked to."""
+    activity_id = await get_activity_by_task(record.get("recordId"))
+    activity = ctx["activities"].get(str(activity_id)) if activity_id else None
+    if activity is None:
+        ctx["stats"]["unmatched"] += 1
+        return True
+    ctx["stats"]["matched"] += 1
+    if _winner(ctx, record, activity) == "pipedrive":
+        return await _apply_to_nethunt(ctx, record, folder_id, extract_activity_data_for_nethunt(activity)["fieldActions"])
+    payload = map_nethunt_to_pipedrive_activity_no_deal(record)
+    return await _apply_to_pipedrive(ctx, "pipedrive_activity", activity["id"], payload, activity, update_pipedrive_activity)
+
+
+async def reconcile_folder(ctx: dict, folder_id: str, handler):
+    """Stream one folder oldest-first, reconciling records in batches and checkpointing after each."""
+    key = _checkpoint_key(folder_id)
+    checkpoint = {} if ctx["dry_run"] else json.loads(await get_state(key) or "{}")
+    if checkpoint.get("complete"):
+        logging.info(f"[reconcile] Folder {folder_id} already reconciled in this run, skipping.")
+        return
+    cursor = checkpoint.get("cursor") or EPOCH
+    done_at_cursor = set(checkpoint.get("done_at_cursor", []))
+    failed = checkpoint.get("failed", [])
+    if cursor != EPOCH:
+        logging.info(f"[reconcile] Resuming folder {folder_id} from {cursor}")
+
+    async def run(record):
+        async with ctx["semaphore"]:
+            try:
+                succeeded = await handler(ctx, folder_id, record)
+            except Exception as e:
+                logging.error(f"[reconcile] Error reconciling record {record.get('recordId')}: {e}")
+                succeeded = False
+        ctx["stats"]["scanned"] += 1
+        if not succeeded:
+            ctx["stats"]["failed"] += 1
+            failed.append(record.get("recordId"))
+
+    async def flush(batch):
+        nonlocal cursor, done_at_cursor
+        await asyncio.gather(*(run(record) for record in batch))
+        if folder_id != NETHUNT_TASKS_FOLDER_ID and not ctx["dry_run"]:
+            await put_deal_mappings(mapping_rows_for_records(folder_id, batch))
+        # The stream is ordered by updatedAt: everything up to the batch's newest stamp is done
+        newest = max(record.get("updatedAt") or cursor for record in batch)
+        at_newest = {record.get("recordId") for record in batch if record.get("updatedAt") == newest}
+        done_at_cursor = done_at_cursor | at_newest if newest == cursor else at_newest
+        cursor = newest
+        if not ctx["dry_run"]:
+            await set_states({key: json.dumps({"cursor": cursor, "done_at_cursor": sorted(done_at_cursor), "failed": failed})})
+
+    batch = []
+    async for record in nethunt_client.iter_recent_records(folder_id, since=cursor, page_size=RECONCILE_BATCH_SIZE):
+        if record.get("updatedAt") == cursor and record.get("recordId") in done_at_cursor:
+            continue
+        # Changes made after the run started (including our own writes) belong to the regular poller
+        if _epoch(record.get("updatedAt")) > ctx["started_at"]:
+            continue
+        batch.append(record)
+        if len(batch) >= RECONCILE_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    if failed:
+        logging.warning(f"[reconcile] {len(failed)} records in folder {folder_id} failed: {failed}")
+    if not ctx["dry_run"]:
+        await set_states({key: json.dumps({"complete": True, "failed": failed})})
+
+
+def _log_progress(ctx: dict, label: str = "Progress"):
+    stats = ctx["stats"]
+    elapsed = max(time.monotonic() - ctx["clock"], 1e-6)
+    logging.info(
+        f"[reconcile] {label}: {stats['scanned']} records in {elapsed:.0f}s ({stats['scanned'] / elapsed:.1f}/s), "
+        f"{stats['matched']} matched, {stats['unmatched']} unmatched; "
+        f"Pipedrive {stats['pipedrive_writes']}/{stats['pipedrive_diffs']} and NetHunt {stats['nethunt_writes']}/{stats['nethunt_diffs']} differing records written; "
+        f"{stats['failed']} failed"
+    )
+
+
+async def _report_progress(ctx: dict):
+    while True:
+        await asyncio.sleep(RECONCILE_REPORT_INTERVAL)
+        _log_progress(ctx)
+
+
+async def _start_run(direction: str, reset: bool) -> dict:
+    """The run to resume, or a fresh one (clearing old folder checkpoints) when there is none or on reset."""
+    run = json.loads(await get_state(RUN_KEY) or "{}")
+    if run and not reset:
+        if run["direction"] != direction:
+            logging.warning(f"[reconcile] Resuming run with direction '{run['direction']}' (pass --reset to start over with '{direction}')")
+        logging.info(f"[reconcile] Resuming run started at {datetime.fromtimestamp(run['started_at'], timezone.utc).isoformat()}")
+        return run
+    run = {"started_at": time.time(), "direction": direction}
+    await set_states({RUN_KEY: json.dumps(run), **{_checkpoint_key(folder_id): "" for folder_id in FOLDERS.values()}})
+    return run
+
+
+async def reconcile(direction: str = "both", dry_run: bool = False, reset: bool = False, folders=tuple(FOLDERS), concurrency: int = RECONCILE_CONCURRENCY):
+    folder_ids = [FOLDERS[name] for name in folders]
+    await pipedrive_client.open()
+    await nethunt_client.open()
+    try:
+        # Same field, stage and folder metadata the service maps with
+        load_stage_index_cache()
+        await load_field_metadata()
+        try:
+            await refresh_folder_schemas()
+        except Exception as e:
+            logging.warning(f"[reconcile] Could not load NetHunt folder schemas, sending fields unvalidated: {e}")
+
+        if dry_run:
+            run = {"started_at": time.time(), "direction": direction}
+        else:
+            run = await _start_run(direction, reset)
+
+        # Re-read on resume: the Pipedrive side is only held for the join, never checkpointed
+        deals, persons, activities = await asyncio.gather(
+            _load_all(pipedrive_client.get_deals, "deals"),
+            _load_all(pipedrive_client.get_persons, "persons"),
+            _load_all(pipedrive_client.get_activities, "activities"),
+        )
+        ctx = {
+            "direction": run["direction"],
+            "dry_run": dry_run,
+            "started_at": run["started_at"],
+            "deals": deals,
+            "persons": persons,
+            "activities": activities,
+            "semaphore": asyncio.Semaphore(concurrency),
+            "stats": Counter(),
+            "clock": time.monotonic(),
+        }
+        handlers = {folder_id: reconcile_task_record if folder_id == NETHUNT_TASKS_FOLDER_ID else reconcile_deal_record for folder_id in folder_ids}
+
+        reporter = asyncio.create_task(_report_progress(ctx))
+        try:
+            # Folders are independent: one failing keeps its checkpoint and the others finish
+            results = await asyncio.gather(
+                *(reconcile_folder(ctx, folder_id, handlers[folder_id]) for folder_id in folder_ids),
+                return_exceptions=True
+            )
+        finally:
+            reporter.cancel()
+        for folder_id, result in zip(folder_ids, results):
+            if isinstance(result, Exception):
+                ctx["stats"]["failed_folders"] += 1
+                logging.error(f"[reconcile] Folder {folder_id} stopped: {result}")
+        _log_progress(ctx, "Done" if not ctx["stats"]["failed_folders"] else "Interrupted")
+
+        if ctx["stats"]["failed_folders"]:
+            logging.error("[reconcile] Run incomplete; run the command again to resume from the checkpoint.")
+        elif not dry_run:
+            # Finished: the next invocation starts a fresh run
+            await set_states({RUN_KEY: "", **{_checkpoint_key(folder_id): "" for folder_id in FOLDERS.values()}})
+        return ctx["stats"]
+    finally:
+        await pipedrive_client.aclose()
+        await nethunt_client.aclose()
+        await state_db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.reconcile", description="Reconcile NetHunt records with Pipedrive deals, persons and activities.")
+    parser.add_argument("--direction", choices=("both", "nethunt", "pipedrive"), default="both",
+                        help="side whose values win: 'nethunt' writes NetHunt values to Pipedrive, 'pipedrive' the reverse, 'both' (default) the more recently updated side")
+    parser.add_argument("--folders", nargs="+", choices=tuple(FOLDERS), default=list(FOLDERS), help="NetHunt folders to reconcile")
+    parser.add_argument("--dry-run", action="store_true", help="report differences without writing or checkpointing")
+    parser.add_argument("--reset", action="store_true", help="discard the checkpoint of an interrupted run and start over")
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY, help="records reconciled at once")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    require_credentials()
+    stats = asyncio.run(reconcile(args.direction, args.dry_run, args.reset, args.folders, args.concurrency))
+    sys.exit(1 if stats["failed_folders"] or stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
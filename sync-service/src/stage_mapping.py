@@ -1,5 +1,15 @@
 # Stage mapping for Pipedrive stages
-# This file contains mappings between stage names and IDs for all pipelines
+# This file contains mappings between stage names and IDs for all pipelines.
+# The static tables are the offline fallback; the live index is built from
+# Pipedrive's pipelines/stages endpoints and cached on disk.
+import asyncio
+import json
+import logging
+import os
+import time
+
+from src.clients.pipedrive import pipedrive_client
+from src.config import STAGE_INDEX_CACHE_PATH, STAGE_INDEX_TTL, STAGE_INDEX_RETRY_DELAY
 
 # Forward mapping: Stage name -> Stage ID
 STAGE_NAME_TO_ID = {
@@ -99,6 +109,15 @@ PIPELINE_ID_TO_NAME = {
     5: "CHEF Candidates",
 }
 
+# Pipeline name -> first stage name, where a deal lands when it moves pipeline
+PIPELINE_FIRST_STAGE = {
+    "Sales": "Form Submitted",
+    "HA Candidates": "Application Submitted",
+    "Staff": "Onboard**",
+    "Clients": "Signed & Paid",
+    "CHEF Candidates": "Application Submitted",
+}
+
 # Pipeline name to ID mapping
 PIPELINE_NAME_TO_ID = {
     "Sales": 1,
@@ -108,18 +127,177 @@ PIPELINE_NAME_TO_ID = {
     "CHEF Candidates": 5,
 }
 
-def get_stage_id(stage_name: str) -> int:
-    """Get stage ID from stage name"""
-    return STAGE_NAME_TO_ID.get(stage_name)
+# Stage ID -> pipeline ID, from the groups above; lets the offline fallback scope names too
+STAGE_ID_TO_PIPELINE_ID = {
+    **{stage_id: 1 for stage_id in (1, 3, 4, 38)},
+    **{stage_id: 2 for stage_id in (13, 12, 46, 11, 79, 78, 58, 8, 63)},
+    **{stage_id: 3 for stage_id in (17, 18, 60, 64, 20, 22, 65, 55)},
+    **{stage_id: 4 for stage_id in (40, 50, 56, 41, 57)},
+    **{stage_id: 5 for stage_id in (66, 67, 68, 69, 70, 75, 71, 80, 72, 73)},
+}
+
+
+def build_stage_index(pipelines: list, stages: list, fetched_at: float = 0) -> dict:
+    """Lookup tables from Pipedrive pipeline and stage objects (id, name, pipeline_id, order_nr)."""
+    index = {
+        "fetched_at": fetched_at,
+        "pipeline_ids": {},
+        "pipeline_names": {},
+        "stage_ids": {},
+        "stage_names": {},
+        "stage_pipelines": {},
+        "first_stages": {},
+        "unscoped_stage_ids": {},
+    }
+    for pipeline in pipelines:
+        index["pipeline_ids"][pipeline["name"]] = pipeline["id"]
+        index["pipeline_names"][pipeline["id"]] = pipeline["name"]
+    first_order = {}
+    owners = {}
+    for stage in stages:
+        if stage.get("active_flag") is False:
+            continue
+        stage_id, name, pipeline_id = stage["id"], stage["name"], stage["pipeline_id"]
+        index["stage_ids"][(pipeline_id, name)] = stage_id
+        index["stage_names"][stage_id] = name
+        index["stage_pipelines"][stage_id] = pipeline_id
+        order = stage.get("order_nr", 0)
+        if pipeline_id not in first_order or order < first_order[pipeline_id]:
+            first_order[pipeline_id] = order
+            index["first_stages"][pipeline_id] = stage_id
+        owners.setdefault(name, set()).add(stage_id)
+    # A bare stage name only resolves when no other pipeline uses it
+    index["unscoped_stage_ids"] = {name: next(iter(ids)) for name, ids in owners.items() if len(ids) == 1}
+    return index
+
+
+def _static_stage_index() -> dict:
+    pipelines = [{"id": pipeline_id, "name": name} for pipeline_id, name in PIPELINE_ID_TO_NAME.items()]
+    first_stage_ids = {
+        PIPELINE_NAME_TO_ID[pipeline]: stage_id
+        for stage_id, name in STAGE_ID_TO_NAME.items()
+        for pipeline, first_name in PIPELINE_FIRST_STAGE.items()
+        if name == first_name and STAGE_ID_TO_PIPELINE_ID.get(stage_id) == PIPELINE_NAME_TO_ID[pipeline]
+    }
+    stages = [
+        {
+            "id": stage_id,
+            "name": name,
+            "pipeline_id": STAGE_ID_TO_PIPELINE_ID.get(stage_id),
+            "order_nr": 0 if first_stage_ids.get(STAGE_ID_TO_PIPELINE_ID.get(stage_id)) == stage_id else 1,
+        }
+        for stage_id, name in STAGE_ID_TO_NAME.items()
+    ]
+    return build_stage_index(pipelines, stages)
+
+
+# Current index; swapped whole on refresh so lookups never see a half-built one.
+# Starts from the static tables above until Pipedrive (or the disk cache) answers.
+_stage_index = _static_stage_index()
+
+
+def get_stage_id(stage_name: str, pipeline_id: int = None) -> int:
+    """Get stage ID from stage name, within pipeline_id when given.
+
+    Without a pipeline, names used by several pipelines ("Considering", "Onboarding", ...)
+    are ambiguous and resolve to None rather than to an arbitrary pipeline's stage.
+    """
+    if pipeline_id is not None:
+        return _stage_index["stage_ids"].get((pipeline_id, stage_name))
+    return _stage_index["unscoped_stage_ids"].get(stage_name)
 
 def get_stage_name(stage_id: int) -> str:
     """Get stage name from stage ID"""
-    return STAGE_ID_TO_NAME.get(stage_id)
+    return _stage_index["stage_names"].get(stage_id)
+
+def get_stage_pipeline_id(stage_id: int) -> int:
+    """Get the pipeline a stage belongs to"""
+    return _stage_index["stage_pipelines"].get(stage_id)
+
+def get_first_stage_id(pipeline_id: int) -> int:
+    """Get the first stage of a pipeline, where a deal lands when it moves pipeline"""
+    return _stage_index["first_stages"].get(pipeline_id)
 
 def get_pipeline_id(pipeline_name: str) -> int:
     """Get pipeline ID from pipeline name"""
-    return PIPELINE_NAME_TO_ID.get(pipeline_name)
+    return _stage_index["pipeline_ids"].get(pipeline_name)
 
 def get_pipeline_name(pipeline_id: int) -> str:
     """Get pipeline name from pipeline ID"""
-    return PIPELINE_ID_TO_NAME.get(pipeline_id) 
\ No newline at end of file
+    return _stage_index["pipeline_names"].get(pipeline_id)
+
+
+# Loading and refreshing from Pipedrive
+
+def _index_to_json(index: dict) -> dict:
+    data = dict(index)
+    # JSON object keys are strings, so tuple keys are stored as rows
+    data["stage_ids"] = [[pipeline_id, name, stage_id] for (pipeline_id, name), stage_id in index["stage_ids"].items()]
+    for key in ("pipeline_names", "stage_names", "stage_pipelines", "first_stages"):
+        data[key] = [[k, v] for k, v in index[key].items()]
+    return data
+
+
+def _index_from_json(data: dict) -> dict:
+    index = dict(data)
+    index["stage_ids"] = {(pipeline_id, name): stage_id for pipeline_id, name, stage_id in data["stage_ids"]}
+    for key in ("pipeline_names", "stage_names", "stage_pipelines", "first_stages"):
+        index[key] = {k: v for k, v in data[key]}
+    return index
+
+
+def load_stage_index_cache(path: str = STAGE_INDEX_CACHE_PATH) -> bool:
+    """Adopt the on-disk index if there is one (even stale, it beats the static tables)."""
+    global _stage_index
+    try:
+        with open(path, encoding="utf-8") as f:
+            _stage_index = _index_from_json(json.load(f))
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logging.warning(f"[stage_mapping] Ignoring unreadable stage index cache {path}: {e}")
+        return False
+    logging.info(f"[stage_mapping] Loaded stage index cache from {path} ({len(_stage_index['stage_names'])} stages)")
+    return True
+
+
+def _write_stage_index_cache(index: dict, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_index_to_json(index), f)
+    os.replace(tmp_path, path)
+
+
+async def refresh_stage_index(path: str = STAGE_INDEX_CACHE_PATH):
+    """Rebuild the index from Pipedrive, swap it in and write it to the disk cache."""
+    global _stage_index
+    pipelines = await pipedrive_client.get_pipelines()
+    stages = []
+    start = 0
+    while start is not None:
+        page, start = await pipedrive_client.get_stages(start=start)
+        stages.extend(page)
+    if not pipelines or not stages:
+        raise RuntimeError(f"Pipedrive returned {len(pipelines)} pipelines and {len(stages)} stages")
+    _stage_index = build_stage_index(pipelines, stages, fetched_at=time.time())
+    try:
+        _write_stage_index_cache(_stage_index, path)
+    except Exception as e:
+        logging.warning(f"[stage_mapping] Failed to write stage index cache {path}: {e}")
+    logging.info(f"[stage_mapping] Refreshed stage index: {len(pipelines)} pipelines, {len(_stage_index['stage_names'])} stages")
+
+
+async def keep_stage_index_fresh():
+    """Background task: refresh the index whenever it is older than STAGE_INDEX_TTL."""
+    load_stage_index_cache()
+    while True:
+        age = time.time() - _stage_index["fetched_at"]
+        if age < STAGE_INDEX_TTL:
+            await asyncio.sleep(STAGE_INDEX_TTL - age)
+            continue
+        try:
+            await refresh_stage_index()
+        except Exception as e:
+            # Keep serving the cached (or static) index and try again later
+            logging.error(f"[stage_mapping] Failed to refresh stage index: {e}")
+            await asyncio.sleep(STAGE_INDEX_RETRY_DELAY)
@@ -1,47 +1,120 @@
 from datetime import datetime, timezone
-import sqlite3
+import hashlib
+import json
 import logging
 
-# Initialize SQLite database
-DB_PATH = "sync_service.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cursor = conn.cursor()
-
-# Create tables if they don't exist
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS state (
-    key TEXT PRIMARY KEY,
-    value TEXT
-)
-""")
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS mappings (
-    pd_id TEXT PRIMARY KEY,
-    nh_id TEXT
-)
-""")
-# New table for synced NetHunt comments
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS synced_nethunt_comments (
-    comment_id TEXT PRIMARY KEY,
-    created_at TEXT,
-    record_id TEXT
-)
-""")
-conn.commit()
-
-def set_last_poll(updated_at_string: str):
+from src.config import STATE_DB_PATH
+from src.db import StateEngine
+
+DB_PATH = STATE_DB_PATH
+
+
+def _create_schema(conn):
+    cursor = conn.cursor()
+    # Create tables if they don't exist
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS mappings (
+        pd_id TEXT PRIMARY KEY,
+        nh_id TEXT,
+        team_nh_id TEXT
+    )
+    """)
+    # Older databases predate the team column
+    if "team_nh_id" not in [row[1] for row in cursor.execute("PRAGMA table_info(mappings)").fetchall()]:
+        cursor.execute("ALTER TABLE mappings ADD COLUMN team_nh_id TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mappings_nh_id ON mappings (nh_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mappings_team_nh_id ON mappings (team_nh_id)")
+    # New table for synced NetHunt comments
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS synced_nethunt_comments (
+        comment_id TEXT PRIMARY KEY,
+        created_at TEXT,
+        record_id TEXT
+    )
+    """)
+    # Pipedrive activity <-> NetHunt task record links (UNIQUE gives the reverse index)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS activity_task_links (
+        activity_id TEXT PRIMARY KEY,
+        task_record_id TEXT UNIQUE
+    )
+    """)
+    # NetHunt comments by record and content hash, for duplicate detection without refetching comments
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS nethunt_comment_index (
+        record_id TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        comment_id TEXT,
+        PRIMARY KEY (record_id, content_hash)
+    )
+    """)
+    # Items already handled per (folder, stream), so the watermark overlap window can be re-read safely
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS processed_stream_items (
+        folder_id TEXT NOT NULL,
+        stream TEXT NOT NULL,
+        item_id TEXT NOT NULL,
+        stamp TEXT NOT NULL,
+        PRIMARY KEY (folder_id, stream, item_id, stamp)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_stream_items_stamp ON processed_stream_items (folder_id, stream, stamp)")
+    # Fingerprints of our own recent outbound writes, used to recognise their echoes
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS write_ledger (
+        entity TEXT NOT NULL,
+        entity_id TEXT NOT NULL,
+        field TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        written_at REAL NOT NULL,
+        PRIMARY KEY (entity, entity_id, field, fingerprint)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_write_ledger_written_at ON write_ledger (written_at)")
+    # Last payload successfully written per Pipedrive entity by the poller
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_snapshots (
+        entity TEXT NOT NULL,
+        entity_id TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        payload_hash TEXT NOT NULL,
+        synced_at TEXT NOT NULL,
+        PRIMARY KEY (entity, entity_id)
+    )
+    """)
+    # Pipedrive field definitions (dealFields/personFields) behind src/field_metadata.py
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS pipedrive_fields (
+        entity TEXT NOT NULL,
+        key TEXT NOT NULL,
+        name TEXT,
+        field_type TEXT,
+        options TEXT,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (entity, key)
+    )
+    """)
+
+
+# One engine per worker process; see src/db.py
+db = StateEngine(DB_PATH, init=_create_schema)
+
+async def set_last_poll(updated_at_string: str):
     try:
-        cursor.execute("REPLACE INTO state (key, value) VALUES (?, ?)", ('last_nethunt_poll', updated_at_string))
-        conn.commit()
+        await db.execute("REPLACE INTO state (key, value) VALUES (?, ?)", ('last_nethunt_poll', updated_at_string))
         logging.info(f"Successfully updated last_nethunt_poll to {updated_at_string}")
     except Exception as e:
         logging.error(f"Failed to update last_nethunt_poll: {e}")
 
-def get_last_poll():
+async def get_last_poll():
     try:
-        cursor.execute("SELECT value FROM state WHERE key = 'last_nethunt_poll'")
-        result = cursor.fetchone()
+        result = await db.fetchone("SELECT value FROM state WHERE key = 'last_nethunt_poll'")
         if result:
             logging.info(f"Retrieved last_nethunt_poll: {result[0]}")
             return result[0]
@@ -51,48 +124,111 @@ def get_last_poll():
         logging.error(f"Failed to retrieve last_nethunt_poll: {e}")
         return None
 
-def map_pd_to_nh(pd_id, nh_id):
-    cursor.execute("REPLACE INTO mappings (pd_id, nh_id) VALUES (?, ?)", (pd_id, nh_id))
-    conn.commit()
+async def get_state(key: str):
+    result = await db.fetchone("SELECT value FROM state WHERE key = ?", (key,))
+    return result[0] if result else None
+
+async def set_state(key: str, value: str):
+    await db.execute("REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
 
-def get_nh_by_pd(pd_id):
-    cursor.execute("SELECT nh_id FROM mappings WHERE pd_id = ?", (pd_id,))
-    result = cursor.fetchone()
+async def get_states(keys) -> dict:
+    """Bulk lookup: {key: value} for the keys that are set."""
+    keys = list(keys)
+    found = {}
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        found.update(await db.fetchall(f"SELECT key, value FROM state WHERE key IN ({placeholders})", chunk))
+    return found
+
+async def set_states(values: dict):
+    """Bulk upsert of key -> value, committed as one group."""
+    await db.executemany("REPLACE INTO state (key, value) VALUES (?, ?)", values.items())
+
+# Deal <-> record mappings: nh_id is the services folder record, team_nh_id the team folder record.
+# Upserts only touch the column being written so the other folder's link is preserved.
+async def map_pd_to_nh(pd_id, nh_id):
+    await put_deal_mappings([(pd_id, nh_id, None)])
+
+async def get_nh_by_pd(pd_id):
+    result = await db.fetchone("SELECT nh_id FROM mappings WHERE pd_id = ?", (str(pd_id),))
     return result[0] if result else None
 
-def map_nh_to_pd(nh_id, pd_id):
-    cursor.execute("REPLACE INTO mappings (pd_id, nh_id) VALUES (?, ?)", (pd_id, nh_id))
-    conn.commit()
+async def map_nh_to_pd(nh_id, pd_id):
+    await put_deal_mappings([(pd_id, nh_id, None)])
+
+async def get_pd_by_nh(nh_id):
+    result = await db.fetchone("SELECT pd_id FROM mappings WHERE nh_id = ?", (nh_id,))
+    return result[0] if result else None
+
+async def map_pd_to_team_nh(pd_id, team_nh_id):
+    await put_deal_mappings([(pd_id, None, team_nh_id)])
+
+async def get_team_nh_by_pd(pd_id):
+    result = await db.fetchone("SELECT team_nh_id FROM mappings WHERE pd_id = ?", (str(pd_id),))
+    return result[0] if result else None
 
-def get_pd_by_nh(nh_id):
-    cursor.execute("SELECT pd_id FROM mappings WHERE nh_id = ?", (nh_id,))
-    result = cursor.fetchone()
+async def get_pd_by_team_nh(team_nh_id):
+    result = await db.fetchone("SELECT pd_id FROM mappings WHERE team_nh_id = ?", (team_nh_id,))
     return result[0] if result else None
 
+async def put_deal_mappings(rows):
+    """Bulk upsert of (pd_id, nh_id, team_nh_id) rows; None leaves that column unchanged."""
+    rows = [(str(pd_id), nh_id, team_nh_id) for pd_id, nh_id, team_nh_id in rows if pd_id]
+    await db.executemany("""
+        INSERT INTO mappings (pd_id, nh_id, team_nh_id) VALUES (?, ?, ?)
+        ON CONFLICT(pd_id) DO UPDATE SET
+            nh_id = COALESCE(excluded.nh_id, mappings.nh_id),
+            team_nh_id = COALESCE(excluded.team_nh_id, mappings.team_nh_id)
+    """, rows)
+
+async def get_pd_ids_by_records(record_ids) -> dict:
+    """Bulk reverse lookup: {record_id: pd_id} across both services and team record columns."""
+    record_ids = [record_id for record_id in record_ids if record_id]
+    found = {}
+    for start in range(0, len(record_ids), 400):
+        chunk = record_ids[start:start + 400]
+        placeholders = ",".join("?" * len(chunk))
+        rows = await db.fetchall(
+            f"SELECT pd_id, nh_id, team_nh_id FROM mappings WHERE nh_id IN ({placeholders}) OR team_nh_id IN ({placeholders})",
+            chunk + chunk
+        )
+        wanted = set(chunk)
+        for pd_id, nh_id, team_nh_id in rows:
+            for record_id in (nh_id, team_nh_id):
+                if record_id in wanted:
+                    found[record_id] = pd_id
+    return found
+
+async def get_deal_mappings(pd_ids) -> dict:
+    """Bulk lookup: {pd_id: (nh_id, team_nh_id)} for the deal ids that are mapped."""
+    pd_ids = [str(pd_id) for pd_id in pd_ids if pd_id]
+    found = {}
+    # Stay well under SQLite's bound-parameter limit
+    for start in range(0, len(pd_ids), 500):
+        chunk = pd_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for pd_id, nh_id, team_nh_id in await db.fetchall(f"SELECT pd_id, nh_id, team_nh_id FROM mappings WHERE pd_id IN ({placeholders})", chunk):
+            found[pd_id] = (nh_id, team_nh_id)
+    return found
 
-def get_last_task_created_at():
-    cursor.execute("SELECT value FROM state WHERE key = 'last_task_created_at'")
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    return None
 
-def set_last_task_created_at(created_at_string: str):
-    cursor.execute("REPLACE INTO state (key, value) VALUES (?, ?)", ('last_task_created_at', created_at_string))
-    conn.commit()
+async def get_last_task_created_at():
+    return await get_state('last_task_created_at')
 
-def set_last_comment_poll(updated_at_string: str):
+async def set_last_task_created_at(created_at_string: str):
+    await set_state('last_task_created_at', created_at_string)
+
+async def set_last_comment_poll(updated_at_string: str):
     try:
-        cursor.execute("REPLACE INTO state (key, value) VALUES (?, ?)", ('last_nethunt_comment_poll', updated_at_string))
-        conn.commit()
+        await db.execute("REPLACE INTO state (key, value) VALUES (?, ?)", ('last_nethunt_comment_poll', updated_at_string))
         logging.info(f"Successfully updated last_nethunt_comment_poll to {updated_at_string}")
     except Exception as e:
         logging.error(f"Failed to update last_nethunt_comment_poll: {e}")
 
-def get_last_comment_poll():
+async def get_last_comment_poll():
     try:
-        cursor.execute("SELECT value FROM state WHERE key = 'last_nethunt_comment_poll'")
-        result = cursor.fetchone()
+        result = await db.fetchone("SELECT value FROM state WHERE key = 'last_nethunt_comment_poll'")
         if result:
             logging.info(f"Retrieved last_nethunt_comment_poll: {result[0]}")
             return result[0]
@@ -102,21 +238,169 @@ def get_last_comment_poll():
         logging.error(f"Failed to retrieve last_nethunt_comment_poll: {e}")
         return None
 
-def is_comment_synced(comment_id: str) -> bool:
+async def is_comment_synced(comment_id: str) -> bool:
     try:
-        cursor.execute("SELECT 1 FROM synced_nethunt_comments WHERE comment_id = ?", (comment_id,))
-        return cursor.fetchone() is not None
+        return await db.fetchone("SELECT 1 FROM synced_nethunt_comments WHERE comment_id = ?", (comment_id,)) is not None
     except Exception as e:
         logging.error(f"Failed to check if comment is synced: {e}")
         return False
 
-def mark_comment_synced(comment_id: str, created_at: str, record_id: str):
+async def mark_comment_synced(comment_id: str, created_at: str, record_id: str):
     try:
-        cursor.execute(
+        await db.execute(
             "REPLACE INTO synced_nethunt_comments (comment_id, created_at, record_id) VALUES (?, ?, ?)",
             (comment_id, created_at, record_id)
         )
-        conn.commit()
         logging.info(f"Marked comment {comment_id} as synced.")
     except Exception as e:
         logging.error(f"Failed to mark comment as synced: {e}")
+
+async def link_activity_to_task(activity_id, task_record_id):
+    def link(conn):
+        # Drop any stale link for either side so the pair stays one-to-one
+        conn.execute(
+            "DELETE FROM activity_task_links WHERE activity_id = ? OR task_record_id = ?",
+            (str(activity_id), str(task_record_id))
+        )
+        conn.execute(
+            "INSERT INTO activity_task_links (activity_id, task_record_id) VALUES (?, ?)",
+            (str(activity_id), str(task_record_id))
+        )
+    try:
+        await db.write(link)
+        logging.info(f"Linked Pipedrive activity {activity_id} to NetHunt task {task_record_id}.")
+    except Exception as e:
+        logging.error(f"Failed to link activity {activity_id} to task {task_record_id}: {e}")
+
+async def get_task_by_activity(activity_id):
+    result = await db.fetchone("SELECT task_record_id FROM activity_task_links WHERE activity_id = ?", (str(activity_id),))
+    return result[0] if result else None
+
+async def get_activity_by_task(task_record_id):
+    result = await db.fetchone("SELECT activity_id FROM activity_task_links WHERE task_record_id = ?", (str(task_record_id),))
+    return result[0] if result else None
+
+def comment_content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+async def index_comments(rows):
+    """Bulk insert (record_id, text, comment_id) rows into the comment index."""
+    rows = [(record_id, comment_content_hash(text), comment_id) for record_id, text, comment_id in rows if record_id and text]
+    try:
+        await db.executemany(
+            "INSERT OR IGNORE INTO nethunt_comment_index (record_id, content_hash, comment_id) VALUES (?, ?, ?)",
+            rows
+        )
+    except Exception as e:
+        logging.error(f"Failed to index comments: {e}")
+
+async def index_comment(record_id: str, text: str, comment_id: str = None):
+    await index_comments([(record_id, text, comment_id)])
+
+async def has_comment(record_id: str, text: str) -> bool:
+    result = await db.fetchone(
+        "SELECT 1 FROM nethunt_comment_index WHERE record_id = ? AND content_hash = ?",
+        (record_id, comment_content_hash(text))
+    )
+    return result is not None
+
+async def get_watermark(folder_id: str, stream: str):
+    return await get_state(f"watermark:{folder_id}:{stream}")
+
+async def set_watermark(folder_id: str, stream: str, value: str):
+    await set_state(f"watermark:{folder_id}:{stream}", value)
+    logging.info(f"Advanced {stream} watermark for folder {folder_id} to {value}")
+
+async def is_stream_item_processed(folder_id: str, stream: str, item_id: str, stamp: str) -> bool:
+    result = await db.fetchone(
+        "SELECT 1 FROM processed_stream_items WHERE folder_id = ? AND stream = ? AND item_id = ? AND stamp = ?",
+        (folder_id, stream, str(item_id), stamp or "")
+    )
+    return result is not None
+
+async def mark_stream_item_processed(folder_id: str, stream: str, item_id: str, stamp: str):
+    try:
+        await db.execute(
+            "INSERT OR IGNORE INTO processed_stream_items (folder_id, stream, item_id, stamp) VALUES (?, ?, ?, ?)",
+            (folder_id, stream, str(item_id), stamp or "")
+        )
+    except Exception as e:
+        logging.error(f"Failed to mark {stream} item {item_id} in folder {folder_id} as processed: {e}")
+
+async def prune_stream_items(folder_id: str, stream: str, before: str):
+    """Forget processed items that fall before the overlap window and can no longer be re-read."""
+    await db.execute(
+        "DELETE FROM processed_stream_items WHERE folder_id = ? AND stream = ? AND stamp < ?",
+        (folder_id, stream, before)
+    )
+
+async def record_ledger_writes(entity: str, entity_id, fingerprints: dict, written_at: float, expire_before: float):
+    """Store field -> fingerprint for one outbound write and drop entries older than the echo window."""
+    def record(conn):
+        conn.executemany(
+            "REPLACE INTO write_ledger (entity, entity_id, field, fingerprint, written_at) VALUES (?, ?, ?, ?, ?)",
+            [(entity, str(entity_id), field, fingerprint, written_at) for field, fingerprint in fingerprints.items()]
+        )
+        conn.execute("DELETE FROM write_ledger WHERE written_at < ?", (expire_before,))
+    try:
+        await db.write(record)
+    except Exception as e:
+        logging.error(f"Failed to record {entity} {entity_id} write in ledger: {e}")
+
+async def get_ledger_writes(entity: str, entity_id, since: float) -> list:
+    """Return (field, fingerprint, written_at) rows for writes to the entity since `since`."""
+    return await db.fetchall(
+        "SELECT field, fingerprint, written_at FROM write_ledger WHERE entity = ? AND entity_id = ? AND written_at >= ?",
+        (entity, str(entity_id), since)
+    )
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+def payload_hash(payload: dict) -> str:
+    return hashlib.sha256(_canonical(payload).encode("utf-8")).hexdigest()
+
+async def get_snapshot(entity: str, entity_id):
+    result = await db.fetchone(
+        "SELECT payload, payload_hash FROM sync_snapshots WHERE entity = ? AND entity_id = ?",
+        (entity, str(entity_id))
+    )
+    return (json.loads(result[0]), result[1]) if result else None
+
+async def put_snapshot(entity: str, entity_id, payload: dict):
+    try:
+        await db.execute(
+            "REPLACE INTO sync_snapshots (entity, entity_id, payload, payload_hash, synced_at) VALUES (?, ?, ?, ?, ?)",
+            (entity, str(entity_id), _canonical(payload), payload_hash(payload), datetime.now(timezone.utc).isoformat())
+        )
+    except Exception as e:
+        logging.error(f"Failed to save {entity} {entity_id} snapshot: {e}")
+
+async def snapshot_delta(entity: str, entity_id, payload: dict) -> dict:
+    """Keys of `payload` that differ from the last snapshot written for the entity (all keys if none)."""
+    snapshot = await get_snapshot(entity, entity_id)
+    if not snapshot:
+        return dict(payload)
+    previous, previous_hash = snapshot
+    if previous_hash == payload_hash(payload):
+        return {}
+    return {key: value for key, value in payload.items() if key not in previous or _canonical(previous[key]) != _canonical(value)}
+
+async def get_field_definitions(entity: str):
+    """Return (fields, fetched_at) for the entity's stored Pipedrive field definitions."""
+    rows = await db.fetchall(
+        "SELECT key, name, field_type, options, fetched_at FROM pipedrive_fields WHERE entity = ?",
+        (entity,)
+    )
+    fields = [{"key": key, "name": name, "field_type": field_type, "options": json.loads(options or "[]")} for key, name, field_type, options, _ in rows]
+    return fields, min((row[4] for row in rows), default=0)
+
+async def put_field_definitions(entity: str, fields: list, fetched_at: float):
+    """Replace the entity's stored field definitions in one transaction."""
+    def replace(conn):
+        conn.execute("DELETE FROM pipedrive_fields WHERE entity = ?", (entity,))
+        conn.executemany(
+            "INSERT INTO pipedrive_fields (entity, key, name, field_type, options, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(entity, field["key"], field.get("name"), field.get("field_type"), json.dumps(field.get("options") or []), fetched_at) for field in fields]
+        )
+    await db.write(replace)
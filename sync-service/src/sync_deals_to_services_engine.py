@@ -1,184 +1,174 @@
 # src/sync_engine.py
-import requests
-import base64
+import asyncio
 import httpx
 import logging
-from src.clients.nethunt import nethunt_client
+from src.clients.nethunt import nethunt_client, NETHUNT_SERVICES_FOLDER_ID, NETHUNT_TEAM_FOLDER_ID
+from src.clients.pipedrive import pipedrive_client
+from src.state import put_deal_mappings
+from src.echo import is_pipedrive_echo, record_write, nethunt_written_fields, pipedrive_changed_fields
+from src.cache import TTLCache
+from src.field_mapping import map_deal_to_services, map_deal_to_team, SERVICES_FIELD_SOURCES, TEAM_FIELD_SOURCES
+from src.field_metadata import get_field_key
+from src.folder_schema import prepare_field_actions
+from src.config import RECORD_LINK_CACHE_SIZE, RECORD_LINK_CACHE_TTL, RECORD_LINK_CONCURRENCY
 import json
-import os
-import httpx
-import logging
-from dotenv import load_dotenv
-load_dotenv()
-
-NETHUNT_API_KEY = os.getenv("NETHUNT_API_KEY")
-NETHUNT_EMAIL = os.getenv("NETHUNT_EMAIL")
-PIPEDRIVE_API_TOKEN = os.getenv("PIPEDRIVE_API_TOKEN")
-PIPEDRIVE_BASE_URL = "https://api.pipedrive.com/v1"
-
-BASE_URL = "https://nethunt.com/api/v1/zapier/actions/update-record"
-
-def get_auth_header(email: str, api_key: str):
-    token = base64.b64encode(f"{email}:{api_key}".encode()).decode()
-    return {"Authorization": f"Basic {token}"}
-
-async def get_pipedrive_activity_by_subject(title: str, api_token: str, activity_type: str = None) -> dict | None:
-    url = "https://api.pipedrive.com/api/v2/activities"
-    params = {
-        "limit": 10,
-        "sort_by": "add_time",
-        "sort_direction": "desc",
-        "api_token": api_token
-    }
-
-    if activity_type:
-        params["type"] = activity_type
 
+async def get_pipedrive_activity_by_subject(title: str, activity_type: str = None) -> dict | None:
     logging.debug(f"Searching for Pipedrive activity with title: '{title}' and type: '{activity_type}'")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            logging.debug(f"Sending GET request to {url} with params: {params}")
-            response = await client.get(url, params=params)
-            response.raise_for_status()
+    try:
+        activities = await pipedrive_client.list_activities(limit=10, activity_type=activity_type)
 
-            data = response.json()
-            activities = data.get("data", [])
+        logging.debug(f"Fetched {len(activities)} recent activities from Pipedrive")
 
-            logging.debug(f"Fetched {len(activities)} recent activities from Pipedrive")
+        for activity in activities:
+            subject = activity.get("subject", "")
+            logging.debug(f"Checking activity subject: '{subject}'")
+            if subject == title:
+                logging.info(f"Found matching Pipedrive activity with title '{title}'")
+                return activity
 
-            for activity in activities:
-                subject = activity.get("subject", "")
-                logging.debug(f"Checking activity subject: '{subject}'")
-                if subject == title:
-                    logging.info(f"Found matching Pipedrive activity with title '{title}'")
-                    return activity
+        logging.info(f"No activity found with title '{title}' in Pipedrive")
+        return None
 
-            logging.info(f"No activity found with title '{title}' in Pipedrive")
-            return None
-
-        except Exception as e:
-            logging.warning(f"Failed to fetch activities from Pipedrive: {e}")
-            return None
+    except Exception as e:
+        logging.warning(f"Failed to fetch activities from Pipedrive: {e}")
+        return None
 
 
 from dateutil.parser import isoparse  # for parsing ISO 8601 timestamps
 
-async def does_activity_exist(title: str, api_token: str, activity_type: str = None) -> bool:
-    url = "https://api.pipedrive.com/api/v2/activities"
-    params = {
-        "limit": 10,
-        "sort_by": "add_time",
-        "sort_direction": "desc",
-        "api_token": api_token
-    }
-
-    if activity_type:
-        params["type"] = activity_type
-
+async def does_activity_exist(title: str, activity_type: str = None) -> bool:
     logging.debug(f"Checking existence of activity with title: '{title}' and type: '{activity_type}'")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            logging.debug(f"Sending GET request to {url} with params: {params}")
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            activities = data.get("data", [])
+    try:
+        activities = await pipedrive_client.list_activities(limit=10, activity_type=activity_type)
 
-            logging.debug(f"Fetched {len(activities)} recent activities from Pipedrive")
+        logging.debug(f"Fetched {len(activities)} recent activities from Pipedrive")
 
-            for activity in activities:
-                subject = activity.get("subject", "")
-                logging.debug(f"Checking activity subject: '{subject}'")
-                if subject == title:
-                    logging.info(f"Activity with title '{title}' already exists in Pipedrive")
-                    return True
+        for activity in activities:
+            subject = activity.get("subject", "")
+            logging.debug(f"Checking activity subject: '{subject}'")
+            if subject == title:
+                logging.info(f"Activity with title '{title}' already exists in Pipedrive")
+                return True
 
-            logging.info(f"No activity found with title '{title}' in Pipedrive")
-            return False
+        logging.info(f"No activity found with title '{title}' in Pipedrive")
+        return False
 
-        except Exception as e:
-            logging.warning(f"Failed to fetch activities from Pipedrive: {e}")
-            return False
+    except Exception as e:
+        logging.warning(f"Failed to fetch activities from Pipedrive: {e}")
+        return False
 
 
 
-async def update_nethunt_record(record_id: str, fields: dict):
-    url = f"{BASE_URL}/{record_id}"
-    headers = {
-        "Content-Type": "application/json",
-        **get_auth_header(NETHUNT_EMAIL, NETHUNT_API_KEY)
-    }
+async def update_nethunt_record(record_id: str, fields: dict, folder_id: str = None):
+    """Awaitable NetHunt update-record; `fields` are the fieldActions to apply.
 
-    payload = {
-        "fieldActions": fields
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        if response.status_code == 200:
-            logging.info(f"Successfully updated NetHunt record {record_id}")
-            return response.json()
-        else:
-            logging.error(f"Failed to update NetHunt record {record_id}: {response.status_code} - {response.text}")
+    With `folder_id`, fields the folder does not have are dropped and values are
+    coerced to the folder's field types first. Returns None when nothing is left to
+    send; HTTP errors are raised so a queued job is retried.
+    """
+    if folder_id:
+        fields = prepare_field_actions(folder_id, fields)
+        if not fields:
+            logging.info(f"No valid fields left to update on NetHunt record {record_id}, skipping.")
             return None
+    try:
+        result = await nethunt_client.update_record(record_id, fields)
+        await record_write("nethunt_record", record_id, nethunt_written_fields(fields))
+        logging.info(f"Successfully updated NetHunt record {record_id}")
+        return result
+    except httpx.HTTPStatusError as e:
+        logging.error(f"Failed to update NetHunt record {record_id}: {e.response.status_code} - {e.response.text}")
+        raise
+
+
+# recordId -> (Pipedrive deal id, person id), shared across poll cycles
+record_link_cache = TTLCache(maxsize=RECORD_LINK_CACHE_SIZE, ttl=RECORD_LINK_CACHE_TTL)
+_record_link_semaphore = asyncio.Semaphore(RECORD_LINK_CONCURRENCY)
+_record_link_inflight: dict[str, asyncio.Task] = {}
+
+
+async def _fetch_record_link(record_id: str, folder_id: str):
+    async with _record_link_semaphore:
+        result = await nethunt_client.find_records(folder_id, record_id=record_id)
+    if result and isinstance(result, list):
+        fields = result[0].get("fields", {})
+        ids = (fields.get("Pipedrive Record ID"), fields.get("Pipedrive Person ID"))
+        logging.debug(f"Resolved record link {record_id} to deal {ids[0]}, person {ids[1]}")
+    else:
+        logging.debug(f"No valid record found for record ID: {record_id}")
+        ids = (None, None)
+    record_link_cache.set(record_id, ids)
+    return ids
+
+
+async def resolve_record_link(record_id: str, folder_id: str = NETHUNT_SERVICES_FOLDER_ID):
+    """Return (deal id, person id) for a linked record, from cache or a single shared lookup."""
+    cached = record_link_cache.get(record_id)
+    if cached is not None:
+        return cached
+    # Tasks in the same batch often link the same client record: share one request
+    task = _record_link_inflight.get(record_id)
+    if task is None:
+        task = asyncio.create_task(_fetch_record_link(record_id, folder_id))
+        _record_link_inflight[record_id] = task
+        task.add_done_callback(lambda _: _record_link_inflight.pop(record_id, None))
+    return await task
 
 
 async def fetch_deal_ids_from_record_links(record_links: list[str]) -> list[str]:
     deal_ids = []
     person_ids = []
-    async with httpx.AsyncClient() as client:
-        for record_id in record_links:
-            headers = {
-                "Content-Type": "application/json",
-                **get_auth_header(NETHUNT_EMAIL, NETHUNT_API_KEY)
-            }
-            try:
-                url = "https://nethunt.com/api/v1/zapier/searches/find-record/67e17578cc9bea52af34a26f"
-                params = {"recordId": record_id}
-
-                response = await client.get(url, headers=headers, params=params)
-
-                response.raise_for_status()
-                result = response.json()
-
-                print(f"[DEBUG] Parsed response JSON:\n{json.dumps(result, indent=2)}")
-
-                if result and isinstance(result, list):
-                    record = result[0]
-                    pipedrive_id = record.get("fields", {}).get("Pipedrive Record ID")
-                    pipedrive_person_id = record.get("fields", {}).get("Pipedrive Person ID")
-                    print(f"[DEBUG] Extracted Pipedrive Record ID: {pipedrive_id}")
-                    if pipedrive_id:
-                        deal_ids.append(pipedrive_id)
-                        person_ids.append(pipedrive_person_id)
-                else:
-                    print(f"[DEBUG] No valid record found for record ID: {record_id}")
-
-            except Exception as e:
-                logging.warning(f"Failed to fetch Pipedrive Record ID for record {record_id}: {e}")
-                print(f"[ERROR] Exception for record {record_id}: {e}")
+    results = await asyncio.gather(
+        *(resolve_record_link(record_id) for record_id in record_links),
+        return_exceptions=True
+    )
+    for record_id, result in zip(record_links, results):
+        if isinstance(result, Exception):
+            logging.warning(f"Failed to fetch Pipedrive Record ID for record {record_id}: {result}")
+            continue
+        pipedrive_id, pipedrive_person_id = result
+        if pipedrive_id:
+            deal_ids.append(pipedrive_id)
+            person_ids.append(pipedrive_person_id)
     return deal_ids,person_ids
 
+def changed_nethunt_fields(changed_keys, field_sources: dict) -> set:
+    return {field for key in changed_keys for field in field_sources.get(key, ())}
+
+
+def only_fields(field_actions: dict, fields) -> dict:
+    """Restrict fieldActions to `fields`; None means the full set (no previous state to diff against)."""
+    if fields is None:
+        return field_actions
+    return {name: action for name, action in field_actions.items() if name in fields}
+
+
 # PIPEDRIVE_API
 async def handle_deals_webhook(body: dict):
     current = body.get("data", {})
     previous = body.get("previous", {})
     activity_id = str(current.get("id"))
 
-    # Detect only changed fields
-    updated_fields = {
-        key: current[key]
-        for key in current.keys()
-        if current.get(key) != previous.get(key)
-    }
-
-    if not updated_fields:
-        logging.info(f"No changes detected for activity {activity_id}")
+    # Our own poll wrote this deal; syncing it back would bounce it to NetHunt again
+    if await is_pipedrive_echo("pipedrive_deal", current.get("id"), body):
+        logging.info(f"Deal {activity_id} change is an echo of our own write, skipping.")
         return
 
+    # Detect only changed fields; without a previous state every mapped field is sent
+    if previous:
+        updated_fields = pipedrive_changed_fields(body)
+        services_fields = changed_nethunt_fields(updated_fields, SERVICES_FIELD_SOURCES)
+        team_fields = changed_nethunt_fields(updated_fields, TEAM_FIELD_SOURCES)
+        if not services_fields and not team_fields:
+            logging.info(f"No mapped fields changed for deal {activity_id}: {list(updated_fields)}")
+            return
+    else:
+        updated_fields = current
+        services_fields = team_fields = None
+
     logging.info(f"Activity {activity_id} updated with fields: {updated_fields}")
 
     person_id = current.get("person_id")
@@ -186,81 +176,71 @@ async def handle_deals_webhook(body: dict):
         logging.warning(f"No person_id associated with activity {activity_id}")
         return
 
-    headers = {
-        "Accept": "application/json",
-        "x-api-token": PIPEDRIVE_API_TOKEN
-    }
-
-    async with httpx.AsyncClient() as client:
-        # Fetch person
-        person_url = f"{PIPEDRIVE_BASE_URL}/persons/{person_id}"
-        person_response = await client.get(person_url, headers=headers)
-
-        if person_response.status_code != 200:
-            logging.error(f"Failed to fetch person {person_id}: {person_response.status_code} - {person_response.text}")
+    # Fetch person
+    try:
+        person_data = await pipedrive_client.get_person(person_id)
+    except httpx.HTTPStatusError as e:
+        logging.error(f"Failed to fetch person {person_id}: {e.response.status_code} - {e.response.text}")
+        if e.response.status_code == 404:
             return
+        raise
 
-        person_data = person_response.json()
-        logging.info(f"Person data for ID {person_id}: {person_data}")
+    logging.info(f"Person data for ID {person_id}: {person_data}")
 
 
-        # ------------------------
-        # Deal fetch and folder/record ID extraction
-        # ------------------------
-        deal_id = current.get("id")
-        nethunt_folder_id = None
-        nethunt_record_id = None
-        nethunt_team_record_id = None
+    # ------------------------
+    # Deal fetch and folder/record ID extraction
+    # ------------------------
+    deal_id = current.get("id")
+    nethunt_folder_id = None
+    nethunt_record_id = None
+    nethunt_team_record_id = None
 
-        if deal_id:
-            deal_url = f"{PIPEDRIVE_BASE_URL}/deals/{deal_id}"
-            deal_response = await client.get(deal_url, headers=headers)
-
-            if deal_response.status_code != 200:
-                logging.error(f"Failed to fetch deal {deal_id}: {deal_response.status_code} - {deal_response.text}")
+    if deal_id:
+        try:
+            deal_data = await pipedrive_client.get_deal(deal_id)
+        except httpx.HTTPStatusError as e:
+            logging.error(f"Failed to fetch deal {deal_id}: {e.response.status_code} - {e.response.text}")
+            if e.response.status_code == 404:
                 return
+            raise
 
-            deal_data = deal_response.json()
-            logging.info(f"Deal data for ID {deal_id}: {deal_data}")
-
-            # Nethunt Hardcoded field keys
-            record_id_key = "55eb66f5d38ea77a03e23d3f0f3dd31b891739d1"
-            team_record_id_key = "b0d55c75b49af56fd540cd2e53af1de5cba0b340"
-            folder_id_key = "6cff18ff6ad02610ded066fab268f76d7d6431c9"
-
-            deal_fields = deal_data.get("data", {})
-            nethunt_folder_id = deal_fields.get(folder_id_key)
-            nethunt_record_id = deal_fields.get(record_id_key)
-            nethunt_team_record_id = deal_fields.get(team_record_id_key)
-            
-            
-            mapped_fields = extract_person_data_for_nethunt(deal_data)
-            team_mapped_fields = extract_team_data_for_nethunt(deal_data)
-            logging.info(f"Mapped fields for NetHunt: {mapped_fields}")
-
-            if not nethunt_folder_id or not nethunt_record_id:
-                logging.warning(f"NetHunt folder or record ID not found in deal {deal_id}")
-                return
-            
+        logging.info(f"Deal data for ID {deal_id}: {deal_data}")
 
-            logging.info(f"NetHunt folder_id: {nethunt_folder_id}, record_id: {nethunt_record_id}, team_record_id: {nethunt_team_record_id}")
+        # NetHunt id field keys, resolved by name from the Pipedrive field metadata
+        record_id_key = get_field_key("Nethunt Record ID", default="55eb66f5d38ea77a03e23d3f0f3dd31b891739d1")
+        team_record_id_key = get_field_key("Nethunt Team Record ID", default="b0d55c75b49af56fd540cd2e53af1de5cba0b340")
+        folder_id_key = get_field_key("Nethunt Folder ID", default="6cff18ff6ad02610ded066fab268f76d7d6431c9")
 
-        # ------------------------
-        # Proceed to update NetHunt record
-        # ------------------------
+        deal_fields = deal_data.get("data", {})
+        nethunt_folder_id = deal_fields.get(folder_id_key)
+        nethunt_record_id = deal_fields.get(record_id_key)
+        nethunt_team_record_id = deal_fields.get(team_record_id_key)
+        
+        
+        mapped_fields = {"fieldActions": only_fields(extract_person_data_for_nethunt(deal_data)["fieldActions"], services_fields)}
+        team_mapped_fields = {"fieldActions": only_fields(extract_team_data_for_nethunt(deal_data)["fieldActions"], team_fields)}
+        logging.info(f"Mapped fields for NetHunt: {mapped_fields}")
+
+        if not nethunt_folder_id or not nethunt_record_id:
+            logging.warning(f"NetHunt folder or record ID not found in deal {deal_id}")
+            return
         
-        email = NETHUNT_EMAIL
-        api_key = NETHUNT_API_KEY
-        if nethunt_record_id:
-            credentials = f"{email}:{api_key}"
-            encoded_credentials = base64.b64encode(credentials.encode()).decode()
-            logging.info(f"Updating NetHunt record {nethunt_record_id} with fields: {mapped_fields} and the api key {encoded_credentials}")
-            update_nethunt_record(nethunt_record_id, mapped_fields, encoded_credentials)
-        if nethunt_team_record_id:
-            credentials = f"{email}:{api_key}"
-            encoded_credentials = base64.b64encode(credentials.encode()).decode()
-            logging.info(f"Updating NetHunt record {nethunt_team_record_id} with fields: {team_mapped_fields} and the api key {encoded_credentials}")
-            update_nethunt_record(nethunt_team_record_id, team_mapped_fields, encoded_credentials)
+
+        logging.info(f"NetHunt folder_id: {nethunt_folder_id}, record_id: {nethunt_record_id}, team_record_id: {nethunt_team_record_id}")
+        # The deal carries both record ids, so keep the local mapping current for the notes/activity webhooks
+        await put_deal_mappings([(deal_id, nethunt_record_id, nethunt_team_record_id)])
+
+    # ------------------------
+    # Proceed to update NetHunt record
+    # ------------------------
+    
+    if nethunt_record_id and mapped_fields["fieldActions"]:
+        logging.info(f"Updating NetHunt record {nethunt_record_id} with fields: {mapped_fields}")
+        await update_nethunt_record(nethunt_record_id, mapped_fields["fieldActions"], nethunt_folder_id)
+    if nethunt_team_record_id and team_mapped_fields["fieldActions"]:
+        logging.info(f"Updating NetHunt record {nethunt_team_record_id} with fields: {team_mapped_fields}")
+        await update_nethunt_record(nethunt_team_record_id, team_mapped_fields["fieldActions"], NETHUNT_TEAM_FOLDER_ID)
 
 
 # ALLOWED_FIELDS = {
@@ -284,355 +264,9 @@ async def handle_deals_webhook(body: dict):
 # }
 
 def extract_person_data_for_nethunt(deal_data):
-    # Mapping of Pipedrive field keys to NetHunt field names
-    key_mapping = {
-        # "b4657a3853fbae1a21222a1f6265dffd1111fc55": "First Name", 
-        "ec3c9109c278d7cb22cd6d63187fb63b9c03af21": "Address",
-        # "fb3c253d2c30416d52191beb3c443f96133c571c": "West Chester Availablity",
-        # "4f01b3626ca1c664c9dec11aad381c405e73bc5d": "Philadelphia Availability",
-        # "4d7a7e1d75b47934b2734ca8d4e270b5e80dd40f": "Main Line Availability",
-        "fe16f95ae1442816f87a9c4ee18b5056f8743030": "Preferred Days / Availability",
-        "e042a0ac93f8d43206b3a96cbe21f24610b74276": "Chef Assigned",
-        "d64ea5791d2efd1b160cba0b4dde0d997d1b513d": "Home Assistant Assigned",
-        "73950ad98eab1e4948d742be2fa34897e457a2f4": "Past Providers",
-        # "3d5c1f11c39686c2d445c279f00ee873c3aa5847": "Services Received Updated",
-        "ac2082c8795591a9fb4c4ee0ee6062a11daea132": "Service Interest",
-        "71b7dcc1f0a176ed854b4eb3c2eaa7bf33070908": "Last name"
-    }
-
-    data = deal_data.get("data", {})
-    related = deal_data.get("related_objects", {})
-
-    extracted = {}
-
-    # Extract from person
-    person = data.get("person_id", {})
-    extracted["Name"] = person.get("name", "")
-    
-    extracted["Email"] = [
-        email.get("value") for email in person.get("email", []) if email.get("value")
-    ]
-
-    extracted["Phone"] = [
-        phone.get("value") for phone in person.get("phone", []) if phone.get("value")
-    ]
-    
-    extracted["Client Lost Reasons"] = person.get("lost_reason", "")
-
-    # Extract stage and pipeline
-    stage_id = data.get("stage_id")
-    stage_name = ""
-
-    if stage_id is not None:
-        stage_info = related.get("stage", {}).get(str(stage_id), {})
-        stage_name = stage_info.get("name", "")
-
-    # Extract pipeline name
-    pipeline_id = data.get("pipeline_id")
-    pipeline_name = ""
-
-    if pipeline_id is not None:
-        pipeline_info = related.get("pipeline", {}).get(str(pipeline_id), {})
-        pipeline_name = pipeline_info.get("name", "")
-
-    # Store extracted values
-    extracted["Stage"] = stage_name
-    extracted["Pipeline"] = pipeline_name
-
-    # Map Pipedrive 'label' field to NetHunt 'Contact Status' with mapping
-    label_value = data.get("label", "")
-    if label_value == "150":
-        extracted["Contact Status"] = "Lead"
-    else:
-        extracted["Contact Status"] = "Client"
-
-    # Service Interest and Services Received Updated mapping
-    service_interest_map = {
-        63: "Chef Services",
-        64: "Home Assistant Services",
-        66: "Combo Services"
-    }
-    services_recieved_map = {
-        226: "Chef Service",
-        227: "Home Assistant Service",
-        228: "Combo Service",
-        229: "Organization Service"
-    }
-    # Services Received Updated (checkboxes)
-    services_checkbox_map = {
-        226: "Chef Service",
-        227: "Home Assistant Services",
-        228: "Combo Services"
-    }
-
-    # Availability mappings
-    philadelphia_availability_map = {
-        224: "Yes",
-        225: "No"
-    }
-    west_chester_availability_map = {
-        286: "Yes",
-        287: "No"
-    }
-    main_line_availability_map = {
-        222: "Yes",
-        223: "No"
-    }
-
-    # Always set the three checkbox fields based on the IDs in Services Received Updated
-    # Find the raw value for the Pipedrive set field (3d5c1f11c39686c2d445c279f00ee873c3aa5847)
-    services_received_key = "3d5c1f11c39686c2d445c279f00ee873c3aa5847"
-    raw_val = data.get(services_received_key, "")
-    ids = []
-    if isinstance(raw_val, dict) and "values" in raw_val:
-        ids = [v.get("id") for v in raw_val.get("values", []) if v.get("id") is not None]
-    elif isinstance(raw_val, int):
-        ids = [raw_val]
-    elif isinstance(raw_val, str) and raw_val:
-        try:
-            ids = [int(x.strip()) for x in raw_val.split(",") if x.strip().isdigit()]
-        except Exception:
-            ids = []
-    # Set each checkbox field
-    for pid, nh_field in services_checkbox_map.items():
-        extracted[nh_field] = pid in ids
-
-    # Extract custom fields by key
-    for key, label in key_mapping.items():
-        if label == "Service Interest":
-            raw_val = data.get(key, "")
-            mapped_val = ""
-            if isinstance(raw_val, dict) and "values" in raw_val:
-                ids = [v.get("id") for v in raw_val.get("values", []) if v.get("id") is not None]
-                mapped_val_list = [service_interest_map.get(i, str(i)) for i in ids]
-                mapped_val = mapped_val_list if len(mapped_val_list) > 1 else (mapped_val_list[0] if mapped_val_list else "")
-            elif isinstance(raw_val, int):
-                mapped_val = service_interest_map.get(raw_val, str(raw_val))
-            elif isinstance(raw_val, str) and raw_val:
-                try:
-                    ids = [int(x.strip()) for x in raw_val.split(",") if x.strip().isdigit()]
-                    mapped_val_list = [service_interest_map.get(i, str(i)) for i in ids]
-                    mapped_val = mapped_val_list if len(mapped_val_list) > 1 else (mapped_val_list[0] if mapped_val_list else raw_val)
-                except Exception:
-                    mapped_val = raw_val
-            else:
-                mapped_val = str(raw_val) if raw_val else ""
-            extracted[label] = mapped_val
-        elif label == "Services Received Updated":
-            raw_val = data.get(key, "")
-            logging.debug(f"[Services Received Updated] Raw value for key {key}: {raw_val}")
-            ids = []
-            if isinstance(raw_val, dict) and "values" in raw_val:
-                ids = [v.get("id") for v in raw_val.get("values", []) if v.get("id") is not None]
-            elif isinstance(raw_val, int):
-                ids = [raw_val]
-            elif isinstance(raw_val, str) and raw_val:
-                try:
-                    ids = [int(x.strip()) for x in raw_val.split(",") if x.strip().isdigit()]
-                except Exception:
-                    ids = []
-            # Set each checkbox field
-            for pid, nh_field in services_checkbox_map.items():
-                extracted[nh_field] = pid in ids
-            # Also keep the mapped label for backward compatibility if needed
-            mapped_val_list = [services_checkbox_map.get(i, str(i)) for i in ids]
-            mapped_val = mapped_val_list if len(mapped_val_list) > 1 else (mapped_val_list[0] if mapped_val_list else "")
-            logging.debug(f"[Services Received Updated] Mapped value for key {key}: {mapped_val}")
-            extracted[label] = mapped_val
-        elif label == "Philadelphia Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 224:
-                mapped_val = "Yes"
-            elif val == 225:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        elif label == "West Chester Area Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 286:
-                mapped_val = "Yes"
-            elif val == 287:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        elif label == "Main Line Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 222:
-                mapped_val = "Yes"
-            elif val == 223:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        else:
-            extracted[label] = data.get(key, "")
-
-    # Build final fieldActions payload
-    field_actions = {
-        key: {
-            "overwrite": True,
-            "add": value if value not in ("", [], None) else ""
-        } for key, value in extracted.items()
-    }
-
-    return {"fieldActions": field_actions}
+    return {"fieldActions": map_deal_to_services(deal_data)}
 
 def extract_team_data_for_nethunt(deal_data):
-    # Mapping of Pipedrive field keys to NetHunt field names
-    key_mapping = {
-        # "b4657a3853fbae1a21222a1f6265dffd1111fc55": "First Name", 
-        "ec3c9109c278d7cb22cd6d63187fb63b9c03af21": "Address",
-        "fb3c253d2c30416d52191beb3c443f96133c571c": "West Chester Area Availability",
-        "4f01b3626ca1c664c9dec11aad381c405e73bc5d": "Philadelphia Availability",
-        "4d7a7e1d75b47934b2734ca8d4e270b5e80dd40f": "Main Line Availability",
-        "fe16f95ae1442816f87a9c4ee18b5056f8743030": "Preferred Days / Availability",
-        "71b7dcc1f0a176ed854b4eb3c2eaa7bf33070908": "Last name"
-    }
-
-    data = deal_data.get("data", {})
-    related = deal_data.get("related_objects", {})
-
-    extracted = {}
-
-    # Extract from person
-    person = data.get("person_id", {})
-    extracted["Name"] = person.get("name", "")
-    
-    extracted["Email Primary"] = [
-        email.get("value") for email in person.get("email", []) if email.get("value")
-    ]
-
-    extracted["Phone"] = [
-        phone.get("value") for phone in person.get("phone", []) if phone.get("value")
-    ]
-
-    # Add lost reason from deal top-level field
-    extracted["Lost Reason"] = data.get("lost_reason", "")
-
-    # Map Pipedrive 'label' field to NetHunt 'Role'
-    extracted["Role"] = data.get("label", "")
-
-    # Extract stage and pipeline
-    stage_id = data.get("stage_id")
-    stage_name = ""
-
-    if stage_id is not None:
-        stage_info = related.get("stage", {}).get(str(stage_id), {})
-        stage_name = stage_info.get("name", "")
-
-    # Extract pipeline name
-    pipeline_id = data.get("pipeline_id")
-    pipeline_name = ""
-
-    if pipeline_id is not None:
-        pipeline_info = related.get("pipeline", {}).get(str(pipeline_id), {})
-        pipeline_name = pipeline_info.get("name", "")
-
-    # Store extracted values
-    extracted["Stage"] = stage_name
-    extracted["Pipeline"] = pipeline_name
-
-    # Add placeholder for Client Status
-
-    # Extract custom fields by key
-    for key, label in key_mapping.items():
-        if label == "Philadelphia Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 224:
-                mapped_val = "Yes"
-            elif val == 225:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        elif label == "West Chester Area Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 286:
-                mapped_val = "Yes"
-            elif val == 287:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        elif label == "Main Line Availability":
-            raw_val = data.get(key, "")
-            val = None
-            if isinstance(raw_val, int):
-                val = raw_val
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                val = int(raw_val)
-            if val == 222:
-                mapped_val = "Yes"
-            elif val == 223:
-                mapped_val = "No"
-            else:
-                mapped_val = ""
-            extracted[label] = mapped_val
-
-        else:
-            extracted[label] = data.get(key, "")
-
-    # Build final fieldActions payload
-    field_actions = {
-        key: {
-            "overwrite": True,
-            "add": value if value else ""
-        } for key, value in extracted.items()
-    }
-
+    field_actions = map_deal_to_team(deal_data)
     print("Extracted team data for NetHunt: ", field_actions)
     return {"fieldActions": field_actions}
-
-
-
-def update_nethunt_record(record_id: str, field_actions: dict, api_key: str):
-    url = f"https://nethunt.com/api/v1/zapier/actions/update-record/{record_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Basic {api_key}"
-    }
-
-    payload = field_actions  
-
-    print("Updating NetHunt record with payload:")
-    print(json.dumps(payload, indent=2)) 
-
-    response = requests.post(url, headers=headers, json=payload)
-
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error {response.status_code}: {response.text}")
-        response.raise_for_status()
\ No newline at end of file
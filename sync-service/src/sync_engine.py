@@ -1,56 +1,25 @@
 # src/sync_engine.py
-import requests
-import base64
 import httpx
 import logging
-import os
 import json
-from dotenv import load_dotenv
+from src.clients.nethunt import NETHUNT_TASKS_FOLDER_ID
+from src.clients.pipedrive import pipedrive_client
 from src.create_activity import format_due_date_iso, nethunt_activity_exists_by_name_returns_results
-load_dotenv()
+from src.sync_deals_to_services_engine import update_nethunt_record
+from src.state import get_task_by_activity, link_activity_to_task
+from src.echo import is_pipedrive_echo, record_write
+from src.field_mapping import map_record_to_person
 
 
-
-# Nethunt
-NETHUNT_API_KEY = os.getenv("NETHUNT_API_KEY")
-NETHUNT_EMAIL = os.getenv("NETHUNT_EMAIL")
-PIPEDRIVE_API_TOKEN = os.getenv("PIPEDRIVE_API_TOKEN")
-
-BASE_URL = "https://nethunt.com/api/v1/zapier/actions/update-record"
-
-def get_auth_header(email: str, api_key: str):
-    token = base64.b64encode(f"{email}:{api_key}".encode()).decode()
-    return {"Authorization": f"Basic {token}"}
-
-async def update_nethunt_record(record_id: str, fields: dict):
-    url = f"{BASE_URL}/{record_id}"
-    headers = {
-        "Content-Type": "application/json",
-        **get_auth_header(NETHUNT_EMAIL, NETHUNT_API_KEY)
-    }
-
-    payload = {
-        "fieldActions": fields
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        if response.status_code == 200:
-            logging.info(f"Successfully updated NetHunt record {record_id}")
-            return response.json()
-        else:
-            logging.error(f"Failed to update NetHunt record {record_id}: {response.status_code} - {response.text}")
-            return None
-
-
-# PIPEDRIVE_API
-PIPEDRIVE_BASE_URL = "https://api.pipedrive.com/v1"
-
 async def handle_activity_update_webhook(body: dict):
     current = body.get("data", {})
     previous = body.get("previous", {})
     activity_id = str(current.get("id"))
 
+    if await is_pipedrive_echo("pipedrive_activity", current.get("id"), body):
+        logging.info(f"Activity {activity_id} change is an echo of our own write, skipping.")
+        return
+
     # Detect only changed fields
     updated_fields = {
         key: current[key]
@@ -67,34 +36,32 @@ async def handle_activity_update_webhook(body: dict):
     # Always re-fetch the full activity details
     full_activity = await fetch_pipedrive_activity_by_id(activity_id)
     if not full_activity:
-        logging.warning(f"Could not fetch full activity data for ID {activity_id}")
+        logging.warning(f"Activity {activity_id} no longer exists in Pipedrive, skipping.")
         return
 
     logging.debug(f"Full activity data: {full_activity}")
 
     # Extract mapped fields from full activity
-    try:
-        mapped_fields = extract_activity_data_for_nethunt(full_activity)
-        logging.info(f"Mapped fields for NetHunt Update: {mapped_fields}")
-    except Exception as e:
-        logging.error(f"Error mapping activity fields for NetHunt Update: {e}")
-        return
-
-    nethunt_record = await nethunt_activity_exists_by_name_returns_results(full_activity.get("subject"))
+    mapped_fields = extract_activity_data_for_nethunt(full_activity)
+    logging.info(f"Mapped fields for NetHunt Update: {mapped_fields}")
+
+    record_id = await get_task_by_activity(activity_id)
+    if not record_id:
+        # Legacy activity created before links were recorded: fall back to a subject search
+        nethunt_record = await nethunt_activity_exists_by_name_returns_results(full_activity.get("subject"))
+        if nethunt_record:
+            record_id = nethunt_record[0].get("recordId")
+            if record_id:
+                await link_activity_to_task(activity_id, record_id)
 
     # -----------------------
     # Proceed to update NetHunt record
     # ------------------------
-    if nethunt_record:
-        print(f"Updating NetHunt record {nethunt_record[0].get("id")} with fields: {mapped_fields}")
-        try:
-            credentials = f"{NETHUNT_EMAIL}:{NETHUNT_API_KEY}"
-            encoded_credentials = base64.b64encode(credentials.encode()).decode()
-
-            update_nethunt_record(nethunt_record[0].get("id"), mapped_fields, encoded_credentials)
-            logging.info(f"NetHunt record {nethunt_record[0].get("id")} updated successfully.")
-        except Exception as e:
-            logging.error(f"Failed to update NetHunt record {nethunt_record[0].get("id")}: {e}")
+    if record_id:
+        print(f"Updating NetHunt record {record_id} with fields: {mapped_fields}")
+        # Errors propagate so the queued job is retried
+        if await update_nethunt_record(record_id, mapped_fields["fieldActions"], NETHUNT_TASKS_FOLDER_ID) is not None:
+            logging.info(f"NetHunt record {record_id} updated successfully.")
 
 
 def extract_person_data_for_nethunt(pipedrive_data: dict) -> str:
@@ -169,23 +136,14 @@ def map_nethunt_to_pipedrive_activity(nethunt_record: dict, deal_ids: list[str],
 
 
 def map_nethunt_person_fields_to_pipedrive(record_fields: dict) -> dict:
-    key_mapping = {
-        "first_name": "First name",
-        "last_name": "Last name",
-        "email": "Email",
-        "phone": "Phone",
-        "address": "Address",
-    }
-    payload = {}
-    for pipedrive_key, field_name in key_mapping.items():
-        if field_name in record_fields:
-            value = record_fields[field_name]
-            if isinstance(value, list):
-                value = value[0] if value else None
-            payload[pipedrive_key] = value
+    payload = map_record_to_person(record_fields)
     print(f"Mapped person fields for Pipedrive update: {payload}")
     return payload
 
+# NetHunt task fields map_nethunt_to_pipedrive_activity_no_deal reads
+TASK_SOURCE_FIELDS = ("Description", "Due date", "Priority")
+
+
 def map_nethunt_to_pipedrive_activity_no_deal(nethunt_record: dict) -> dict:
     fields = nethunt_record.get("fields", {})
     print(f"Mapping NetHunt record to Pipedrive activity (update): {fields}")
@@ -222,48 +180,30 @@ def map_nethunt_to_pipedrive_activity_no_deal(nethunt_record: dict) -> dict:
     }
 
 
-def update_nethunt_record(record_id, field_actions, api_key):
-    url = f"https://nethunt.com/api/v1/zapier/actions/update-record/{record_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Basic {api_key}"
-    }
-
-
-    response = requests.post(url, headers=headers, json=field_actions)
-
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error {response.status_code}: {response.text}")
-        response.raise_for_status()
-
-
-async def create_pipedrive_activity(activity_data: dict):
-    url = f"https://api.pipedrive.com/api/v2/activities"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "x-api-token": PIPEDRIVE_API_TOKEN
-    }
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, headers=headers, json=activity_data)
-            response.raise_for_status()
-            result = response.json()
-            logging.info(f"Created activity in Pipedrive: {result}")
-            return result
-        except httpx.HTTPStatusError as e:
-            logging.error(f"Failed to create activity: {e.response.status_code} - {e.response.text}")
-        except Exception as e:
-            logging.error(f"Unexpected error during activity creation: {e}")
+async def create_pipedrive_activity(activity_data: dict, task_record_id: str = None):
+    try:
+        result = await pipedrive_client.create_activity(activity_data)
+        logging.info(f"Created activity in Pipedrive: {result}")
+        activity_id = (result.get("data") or {}).get("id")
+        await record_write("pipedrive_activity", activity_id, activity_data)
+        if task_record_id and activity_id:
+            await link_activity_to_task(activity_id, task_record_id)
+        return result
+    except httpx.HTTPStatusError as e:
+        logging.error(f"Failed to create activity: {e.response.status_code} - {e.response.text}")
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error during activity creation: {e}")
+        raise
 
 
 import re
 import json
 import logging
 
+# Pipedrive activity fields extract_activity_data_for_nethunt reads
+ACTIVITY_SOURCE_FIELDS = ("due_date", "note", "priority")
+
 def extract_activity_data_for_nethunt(activity: dict) -> dict:
     try:
         subject = activity.get("subject")
@@ -319,46 +259,31 @@ def extract_activity_data_for_nethunt(activity: dict) -> dict:
 
 
 async def fetch_pipedrive_activity_by_id(activity_id: int) -> dict | None:
-
-    url = f"{PIPEDRIVE_BASE_URL}/activities/{activity_id}"
-    headers = {
-        "x-api-token": PIPEDRIVE_API_TOKEN,
-        "Accept": "application/json"
-    }
-    params = {}
-
     logging.debug(f"Fetching activity ID={activity_id} ")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, params=params)
-            logging.debug(f"Pipedrive GET {url} - status {response.status_code}")
-            response.raise_for_status()
-            result = response.json()
-            logging.debug(f"Fetched activity {activity_id} data: {result}")
-            return result.get("data")
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error fetching activity {activity_id}: {e.response.status_code} - {e.response.text}")
-        except Exception as e:
-            logging.error(f"Unexpected error fetching activity {activity_id}: {e}")
-    return None
+    try:
+        result = await pipedrive_client.get_activity(activity_id)
+        logging.debug(f"Fetched activity {activity_id} data: {result}")
+        return result.get("data")
+    except httpx.HTTPStatusError as e:
+        logging.error(f"HTTP error fetching activity {activity_id}: {e.response.status_code} - {e.response.text}")
+        # A deleted activity has nothing left to sync; anything else is worth a retry
+        if e.response.status_code == 404:
+            return None
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error fetching activity {activity_id}: {e}")
+        raise
 
 async def update_pipedrive_activity(activity_id: int, activity_data: dict):
-    url = f"https://api.pipedrive.com/api/v2/activities/{activity_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "x-api-token": PIPEDRIVE_API_TOKEN
-    }
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.patch(url, headers=headers, json=activity_data)
-            response.raise_for_status()
-            result = response.json()
-            logging.info(f"Updated Pipedrive activity {activity_id}: {result}")
-            return result
-        except httpx.HTTPStatusError as e:
-            logging.error(f"Failed to update activity {activity_id}: {e.response.status_code} - {e.response.text}")
-        except Exception as e:
-            logging.error(f"Unexpected error during activity update {activity_id}: {e}")
+    try:
+        result = await pipedrive_client.update_activity(activity_id, activity_data)
+        await record_write("pipedrive_activity", activity_id, activity_data)
+        logging.info(f"Updated Pipedrive activity {activity_id}: {result}")
+        return result
+    except httpx.HTTPStatusError as e:
+        logging.error(f"Failed to update activity {activity_id}: {e.response.status_code} - {e.response.text}")
+        raise
+    except Exception as e:
+        logging.error(f"Unexpected error during activity update {activity_id}: {e}")
+        raise
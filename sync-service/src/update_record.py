@@ -1,3 +1,7 @@
+import logging
+
+from src.field_metadata import get_field_key, get_option_id, get_option_label
+
 key_mapping = {
     "b4657a3853fbae1a21222a1f6265dffd1111fc55": "First Name",
     "71b7dcc1f0a176ed854b4eb3c2eaa7bf33070908": "Last name",
@@ -13,61 +17,37 @@ key_mapping = {
     "ac2082c8795591a9fb4c4ee0ee6062a11daea132": "Service Interest",
 }
 
-service_interest_map = {
-    63: "Chef Services",
-    64: "Home Assistant Services",
-    66: "Combo Services"
-}
-services_recieved_map = {
-    226: "Chef Service",
-    227: "Home Assistant Service",
-    228: "Combo Service",
-    229: "Organization Service"
-}
-service_interest_reverse_map = {v: k for k, v in service_interest_map.items()}
-services_recieved_reverse_map = {v: k for k, v in services_recieved_map.items()}
+def _option_label(raw_val, key):
+    # Pipedrive option id -> label from the cached field metadata
+    if isinstance(raw_val, int):
+        return get_option_label(key, raw_val) or str(raw_val)
+    if isinstance(raw_val, str) and raw_val.isdigit():
+        return get_option_label(key, int(raw_val)) or raw_val
+    return raw_val
+
+# NetHunt fields holding Pipedrive option ids
+option_fields = {"Service Interest", "Services Received Updated"}
 
 def extract_fields(deal_data, key_mapping):
     extracted_fields = {}
     for key, field_name in key_mapping.items():
-        if field_name == "Service Interest":
-            raw_val = deal_data.get(key, "")
-            if isinstance(raw_val, int):
-                extracted_fields[field_name] = service_interest_map.get(raw_val, str(raw_val))
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                extracted_fields[field_name] = service_interest_map.get(int(raw_val), raw_val)
-            else:
-                extracted_fields[field_name] = raw_val
-        elif field_name == "Services Received Updated":
-            raw_val = deal_data.get(key, "")
-            if isinstance(raw_val, int):
-                extracted_fields[field_name] = services_recieved_map.get(raw_val, str(raw_val))
-            elif isinstance(raw_val, str) and raw_val.isdigit():
-                extracted_fields[field_name] = services_recieved_map.get(int(raw_val), raw_val)
-            else:
-                extracted_fields[field_name] = raw_val
-        else:
-            extracted_fields[field_name] = deal_data.get(key, "")
+        raw_val = deal_data.get(key, "")
+        extracted_fields[field_name] = _option_label(raw_val, key) if field_name in option_fields else raw_val
     return extracted_fields
 
 def update_nethunt_record(deal_data, api_key):
     fields_to_update = extract_fields(deal_data, key_mapping)
     # Reverse mapping for update to Pipedrive
     payload = {}
-    si = fields_to_update.get("Service Interest")
-    if si:
-        if isinstance(si, str):
-            si = [si]
-        ids = [service_interest_reverse_map.get(s) for s in si if s in service_interest_reverse_map]
-        if ids:
-            payload["ac2082c8795591a9fb4c4ee0ee6062a11daea132"] = ids if len(ids) > 1 else ids[0]
-    sr = fields_to_update.get("Services Received Updated")
-    if sr:
-        if isinstance(sr, str):
-            sr = [sr]
-        ids = [services_recieved_reverse_map.get(s) for s in sr if s in services_recieved_reverse_map]
-        if ids:
-            payload["3d5c1f11c39686c2d445c279f00ee873c3aa5847"] = ids if len(ids) > 1 else ids[0]
+    for field_name in ("Service Interest", "Services Received Updated"):
+        labels = fields_to_update.get(field_name)
+        if labels:
+            if isinstance(labels, str):
+                labels = [labels]
+            key = get_field_key(field_name)
+            ids = [option_id for option_id in (get_option_id(key, label) for label in labels) if option_id is not None]
+            if ids:
+                payload[key] = ids if len(ids) > 1 else ids[0]
     # Add other fields as needed
-    print(f"Updating NetHunt record with fields: {payload} and API key: {api_key}")
+    logging.debug(f"Updating NetHunt record with fields: {payload}")
 